@@ -0,0 +1,251 @@
+"""
+End-to-end benchmarks of the registration and verification ceremonies.
+
+Every scenario drives the real views through Django's test client, with a
+software authenticator from ``webauth.testing`` standing in for the browser and
+security key. Run it from the repository root:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --devices 1 10 50 --table-size 0 100000 --alg es256 rs256
+    BENCH_DATABASE=postgresql python -m benchmarks.run --json results.json
+
+For each combination of algorithm, devices per user and device table size it
+reports requests per second and latency percentiles of:
+
+* ``registration.get``: registration options
+* ``registration.post``: attestation verification and device creation
+* ``verification.get``: authentication options
+* ``verification.post``: assertion verification
+* ``protected.get``: a ``@webauth_required`` view after verification
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+ALGORITHMS = {"es256": -7, "eddsa": -8, "rs256": -257}
+SEED_BATCH_SIZE = 1000
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of already sorted ``samples``."""
+    index = max(0, min(len(samples) - 1, round(fraction * len(samples)) - 1))
+    return samples[index]
+
+
+def summarize(scenario, config, samples):
+    samples = sorted(samples)
+    total = sum(samples)
+    return dict(
+        config,
+        scenario=scenario,
+        requests=len(samples),
+        rps=len(samples) / total if total else 0.0,
+        mean_ms=statistics.mean(samples) * 1000,
+        p50_ms=percentile(samples, 0.50) * 1000,
+        p90_ms=percentile(samples, 0.90) * 1000,
+        p99_ms=percentile(samples, 0.99) * 1000,
+    )
+
+
+def reset_database():
+    from django.contrib.auth import get_user_model
+    from django.core.cache import caches
+
+    from webauth.models import WebAuthDevice
+
+    WebAuthDevice.objects.all().delete()
+    get_user_model().objects.all().delete()
+    for cache in caches.all():
+        cache.clear()
+
+
+def seed_devices(count):
+    """Fill the device table with ``count`` devices of unrelated users."""
+    from django.contrib.auth import get_user_model
+
+    from webauth.models import WebAuthDevice, hash_credential_id
+
+    users = [get_user_model().objects.create_user(f"filler{n}") for n in range(100)]
+    for start in range(0, count, SEED_BATCH_SIZE):
+        devices = []
+        for n in range(start, min(count, start + SEED_BATCH_SIZE)):
+            credential_id = os.urandom(32)
+            devices.append(
+                WebAuthDevice(
+                    user=users[n % len(users)],
+                    name=f"filler{n}",
+                    credential_id=credential_id,
+                    credential_hash=hash_credential_id(credential_id),
+                    public_key=os.urandom(77),
+                    format="none",
+                    type="public-key",
+                    sign_count=0,
+                )
+            )
+        WebAuthDevice.objects.bulk_create(devices)
+
+
+def options(response):
+    data = json.loads(response.content)
+    return data["ceremony"], bytes.fromhex(data["publicKey"]["challenge"])
+
+
+def logged_in_client(username):
+    from django.contrib.auth import get_user_model
+    from django.test import Client
+
+    client = Client()
+    client.force_login(get_user_model().objects.create_user(username))
+    return client
+
+
+def register(client, authenticator):
+    ceremony, challenge = options(client.get("/webauth/registration/"))
+    started = time.perf_counter()
+    response = client.post(
+        "/webauth/registration/",
+        json.dumps(
+            {"name": "bench", "pubKeyCredential": authenticator.register(challenge)}
+        ),
+        content_type="application/json",
+        HTTP_X_WEBAUTH_CEREMONY=ceremony,
+    )
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 201, response
+    return elapsed
+
+
+def verify(client, authenticator):
+    ceremony, challenge = options(client.get("/webauth/verification/"))
+    started = time.perf_counter()
+    response = client.post(
+        "/webauth/verification/",
+        json.dumps(authenticator.authenticate(challenge)),
+        content_type="application/json",
+        HTTP_X_WEBAUTH_CEREMONY=ceremony,
+    )
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 200, response
+    return elapsed
+
+
+def timed(func, iterations, warmup):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def run_config(alg, devices, table_size, iterations, warmup):
+    from webauth.testing import SoftAuthenticator
+
+    reset_database()
+    seed_devices(table_size)
+    config = dict(alg=alg, devices=devices, table_size=table_size)
+    make = lambda: SoftAuthenticator(alg=ALGORITHMS[alg])  # noqa: E731
+    results = []
+
+    client = logged_in_client("registering")
+    results.append(
+        summarize(
+            "registration.get",
+            config,
+            timed(lambda: client.get("/webauth/registration/"), iterations, warmup),
+        )
+    )
+    for _ in range(warmup):
+        register(client, make())
+    results.append(
+        summarize(
+            "registration.post",
+            config,
+            [register(client, make()) for _ in range(iterations)],
+        )
+    )
+
+    client = logged_in_client("verifying")
+    authenticators = [make() for _ in range(devices)]
+    for authenticator in authenticators:
+        register(client, authenticator)
+    results.append(
+        summarize(
+            "verification.get",
+            config,
+            timed(lambda: client.get("/webauth/verification/"), iterations, warmup),
+        )
+    )
+    for _ in range(warmup):
+        verify(client, authenticators[-1])
+    results.append(
+        summarize(
+            "verification.post",
+            config,
+            [verify(client, authenticators[-1]) for _ in range(iterations)],
+        )
+    )
+    results.append(
+        summarize(
+            "protected.get",
+            config,
+            timed(lambda: client.get("/protected/"), iterations, warmup),
+        )
+    )
+    return results
+
+
+def print_results(results, file=sys.stdout):
+    header = (
+        f"{'scenario':<20}{'alg':>7}{'devices':>9}{'table':>10}"
+        f"{'req/s':>10}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}"
+    )
+    print(header, file=file)
+    print("-" * len(header), file=file)
+    for r in results:
+        print(
+            f"{r['scenario']:<20}{r['alg']:>7}{r['devices']:>9}{r['table_size']:>10}"
+            f"{r['rps']:>10.1f}{r['p50_ms']:>9.2f}"
+            f"{r['p90_ms']:>9.2f}{r['p99_ms']:>9.2f}",
+            file=file,
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--alg", nargs="+", choices=ALGORITHMS, default=["es256"])
+    parser.add_argument("--devices", nargs="+", type=int, default=[1, 10])
+    parser.add_argument("--table-size", nargs="+", type=int, default=[0, 10000])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", interactive=False, verbosity=0)
+
+    results = []
+    for alg in args.alg:
+        for table_size in args.table_size:
+            for devices in args.devices:
+                results.extend(
+                    run_config(alg, devices, table_size, args.iterations, args.warmup)
+                )
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Django settings for the benchmark suite.
+
+SQLite is used by default. Set BENCH_DATABASE=postgresql to run against a
+local PostgreSQL server, configured with the usual PG* environment variables.
+"""
+import os
+import tempfile
+from pathlib import Path
+
+SECRET_KEY = "benchmarks-only"
+
+DEBUG = False
+
+ALLOWED_HOSTS = ["testserver", "localhost"]
+
+INSTALLED_APPS = [
+    "django.contrib.auth",
+    "django.contrib.contenttypes",
+    "django.contrib.sessions",
+    "webauth",
+]
+
+MIDDLEWARE = [
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+]
+
+ROOT_URLCONF = "benchmarks.urls"
+
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "APP_DIRS": True,
+    },
+]
+
+if os.environ.get("BENCH_DATABASE", "sqlite") == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("PGDATABASE", "webauth_bench"),
+            "USER": os.environ.get("PGUSER", ""),
+            "PASSWORD": os.environ.get("PGPASSWORD", ""),
+            "HOST": os.environ.get("PGHOST", "localhost"),
+            "PORT": os.environ.get("PGPORT", ""),
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get(
+                "BENCH_SQLITE_NAME",
+                Path(tempfile.gettempdir()) / "webauth-bench.sqlite3",
+            ),
+        }
+    }
+
+PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+USE_TZ = True
+
+DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+WEBAUTH_RP_ID = "localhost"
+WEBAUTH_RP_NAME = "Benchmarks"
+WEBAUTH_ORIGIN = "http://localhost:8000"
+WEBAUTH_VERIFY_URL = "/webauth/verify/"
+# The benchmark deliberately sends far more requests than a user would.
+WEBAUTH_THROTTLE_RATES = {"user": None, "ip": None, "credential": None}
@@ -0,0 +1,15 @@
+from django.http import HttpResponse
+from django.urls import include, path
+
+from webauth.decorators import webauth_required
+
+
+@webauth_required
+def protected(request):
+    return HttpResponse("ok")
+
+
+urlpatterns = [
+    path("protected/", protected),
+    path("webauth/", include("webauth.urls")),
+]
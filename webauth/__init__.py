@@ -1,12 +1,40 @@
+from asgiref.sync import sync_to_async
+
+from .state import aget_verification, get_verification, is_fresh
+from .trust import atrusted_stamp, trusted_stamp
+
 REDIRECT_FIELD_NAME = "next"
 
 
-def user_is_webauth_verified(request) -> bool:
+def user_is_webauth_verified(request, max_age=None) -> bool:
     """
     Checks if the user is logged in AND completed two factor authentication
-    using Web Authentication.
+    using Web Authentication, at most ``max_age`` seconds ago if given. Without
+    ``max_age``, a browser the user asked to be remembered also counts.
     """
     if not request.user.is_authenticated:
         return False
-    device_id = request.session.get("webauth_device_id", None)
-    return request.user.webauth_devices.filter(id=device_id).exists()
+    stamp = get_verification(request) or trusted_stamp(request)
+    if stamp is None:
+        return False
+    return max_age is None or is_fresh(stamp, max_age)
+
+
+async def aget_user(request):
+    """
+    Resolves the lazy ``request.user`` (and with it the session) in a single
+    hop to the sync thread, after which both are safe to use from async code.
+    """
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+async def auser_is_webauth_verified(request, max_age=None) -> bool:
+    """Async version of ``user_is_webauth_verified``."""
+    user = await aget_user(request)
+    if not user.is_authenticated:
+        return False
+    stamp = await aget_verification(request) or await atrusted_stamp(request)
+    if stamp is None:
+        return False
+    return max_age is None or is_fresh(stamp, max_age)
@@ -1,14 +1,126 @@
-from django.contrib import admin
+from datetime import timedelta
+
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _, ngettext
 
 from .models import WebAuthDevice
+from .trust import forget_browsers
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that takes the planner's row estimate instead of running a
+    COUNT over an unfiltered table, once that table is larger than
+    ``threshold`` rows. Only PostgreSQL keeps such an estimate; other
+    databases always count.
+    """
+
+    threshold = 100000
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        connection = connections[self.object_list.db]
+        if connection.vendor == "postgresql" and not query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                    [query.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] > self.threshold:
+                return int(row[0])
+        return super().count
+
+
+class LastUsedFilter(admin.SimpleListFilter):
+    """Filters devices by how long ago they were last used."""
+
+    title = _("last used")
+    parameter_name = "unused_for"
+
+    def lookups(self, request, model_admin):
+        return (
+            ("7", _("Not in the last 7 days")),
+            ("30", _("Not in the last 30 days")),
+            ("90", _("Not in the last 90 days")),
+            ("365", _("Not in the last year")),
+            ("never", _("Never")),
+        )
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value == "never":
+            return queryset.filter(last_used_at__isnull=True)
+        if value in {"7", "30", "90", "365"}:
+            return queryset.unused_since(timezone.now() - timedelta(days=int(value)))
+        return queryset
 
 
 @admin.register(WebAuthDevice)
 class WebAuthDeviceAdmin(admin.ModelAdmin):
     list_display = (
         "name",
+        "user",
         "created_at",
+        "last_used_at",
+        "use_count",
         "format",
         "type",
         "sign_count",
     )
+    list_filter = (LastUsedFilter,)
+    list_select_related = ("user",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ("revoke_user_devices", "revoke_stale_devices", "forget_user_browsers")
+
+    def get_queryset(self, request):
+        # The binary columns are only needed on the change form.
+        qs = super().get_queryset(request)
+        if request.resolver_match and request.resolver_match.url_name.endswith(
+            "_changelist"
+        ):
+            qs = qs.defer("credential_id", "public_key")
+        return qs
+
+    @admin.action(description=_("Revoke all devices of the selected devices' users"))
+    def revoke_user_devices(self, request, queryset):
+        revoked = WebAuthDevice.objects.filter(
+            user__in=queryset.values("user_id")
+        ).revoke()
+        self._revoked(request, revoked)
+
+    @admin.action(description=_("Revoke the selected devices that are stale"))
+    def revoke_stale_devices(self, request, queryset):
+        self._revoked(request, queryset.stale().revoke())
+
+    @admin.action(
+        description=_("Forget the trusted browsers of the selected devices' users")
+    )
+    def forget_user_browsers(self, request, queryset):
+        user_ids = set(queryset.values_list("user_id", flat=True))
+        for user_id in user_ids:
+            forget_browsers(user_id)
+        count = len(user_ids)
+        self.message_user(
+            request,
+            ngettext(
+                "Forgot the trusted browsers of %d user.",
+                "Forgot the trusted browsers of %d users.",
+                count,
+            )
+            % count,
+            messages.SUCCESS,
+        )
+
+    def _revoked(self, request, count):
+        self.message_user(
+            request,
+            ngettext("Revoked %d device.", "Revoked %d devices.", count) % count,
+            messages.SUCCESS,
+        )
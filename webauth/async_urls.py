@@ -0,0 +1,25 @@
+from django.urls import path
+
+from . import views
+
+
+app_name = "webauth"
+urlpatterns = [
+    path("devices/", views.DeviceListView.as_view(), name="devices"),
+    path("devices/<int:pk>/delete/", views.DeleteDevice.as_view(), name="delete"),
+    path(
+        "devices/forget-browsers/",
+        views.forget_trusted_browsers,
+        name="forget_browsers",
+    ),
+    path("registration/", views.AsyncRegistration.as_view(), name="registration"),
+    path("verify/", views.verify, name="verify"),
+    path("verification/", views.AsyncVerification.as_view(), name="verification"),
+    path("login/", views.passwordless, name="login"),
+    path("login/ceremony/", views.AsyncLogin.as_view(), name="login_ceremony"),
+    path(
+        "verification/batch/",
+        views.AsyncBatchVerification.as_view(),
+        name="batch_verification",
+    ),
+]
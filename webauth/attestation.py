@@ -0,0 +1,310 @@
+"""
+Attestation trust anchors from the FIDO Metadata Service.
+
+``verify_registration_response`` only validates an attestation certificate
+chain when it is given root certificates for the attestation format, and
+``Registration`` used to give it none. Point ``WEBAUTH_MDS_BLOB`` at a copy of
+the MDS3 blob (https://mds3.fidoalliance.org/) and the roots published for
+the authenticator's AAGUID are used instead. The blob is read once per
+process, from disk only, and indexed by AAGUID, so finding the roots of an
+authenticator model is a dict lookup. If ``WEBAUTH_MDS_ROOT_CERTIFICATE``
+names the PEM file of the MDS signing root, the blob's signature is checked
+when it is loaded.
+
+Most authenticators share their attestation certificates with many others of
+the same batch, so a chain that validated once is remembered by fingerprint
+in a per-process LRU of ``WEBAUTH_VERIFIED_CHAIN_CACHE_SIZE`` entries until
+its first certificate expires. A registration presenting a remembered chain
+skips chain building; the attestation signature is still checked against
+its certificate.
+
+Authenticators whose metadata reports a compromise are always refused. A
+model the blob publishes roots for must present a certificate chain to them:
+``none`` and self attestation are refused, as anyone can produce them for any
+AAGUID. ``WEBAUTH_ALLOWED_AAGUIDS`` limits registration to the listed models,
+which must then all attest that way, and ``WEBAUTH_ATTESTATION_REQUIRED``
+applies the same to every authenticator.
+"""
+import base64
+import hashlib
+import json
+import logging
+import mmap
+import time
+import uuid
+from datetime import timezone
+from functools import lru_cache
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+from cryptography.x509 import load_der_x509_certificate
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from webauthn import verify_registration_response
+from webauthn.helpers import base64url_to_bytes, parse_attestation_object
+from webauthn.helpers.exceptions import (
+    InvalidCertificateChain,
+    InvalidRegistrationResponse,
+)
+from webauthn.helpers.validate_certificate_chain import validate_certificate_chain
+
+from .lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Status reports after which an authenticator model can no longer be trusted.
+COMPROMISED_STATUSES = frozenset(
+    {
+        "REVOKED",
+        "USER_VERIFICATION_BYPASS",
+        "ATTESTATION_KEY_COMPROMISE",
+        "USER_KEY_REMOTE_COMPROMISE",
+        "USER_KEY_PHYSICAL_COMPROMISE",
+    }
+)
+
+
+class UntrustedAuthenticator(InvalidRegistrationResponse):
+    """The authenticator's model is compromised, not allowed or unknown."""
+
+
+class MetadataEntry:
+    """What the blob says about one authenticator model."""
+
+    __slots__ = ("description", "root_certificates", "compromised")
+
+    def __init__(self, description, root_certificates, compromised):
+        self.description = description
+        self.root_certificates = root_certificates
+        self.compromised = compromised
+
+
+class MetadataStore:
+    """The entries of an MDS3 blob with an AAGUID, keyed by its 16 bytes."""
+
+    def __init__(self, entries, number=None, next_update=None):
+        self.entries = entries
+        self.number = number
+        self.next_update = next_update
+
+    def get(self, aaguid: bytes):
+        return self.entries.get(aaguid)
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "MetadataStore":
+        entries = {}
+        for entry in payload.get("entries", ()):
+            if not entry.get("aaguid"):
+                # U2F authenticators are identified by key identifiers instead.
+                continue
+            statement = entry.get("metadataStatement", {})
+            entries[uuid.UUID(entry["aaguid"]).bytes] = MetadataEntry(
+                statement.get("description", ""),
+                [
+                    _pem(base64.b64decode(certificate))
+                    for certificate in statement.get("attestationRootCertificates", ())
+                ],
+                any(
+                    report.get("status") in COMPROMISED_STATUSES
+                    for report in entry.get("statusReports", ())
+                ),
+            )
+        return cls(entries, payload.get("no"), payload.get("nextUpdate"))
+
+
+def _pem(der: bytes) -> bytes:
+    body = base64.encodebytes(der).decode().replace("\n", "")
+    lines = [body[i : i + 64] for i in range(0, len(body), 64)]
+    return (
+        "-----BEGIN CERTIFICATE-----\n"
+        + "\n".join(lines)
+        + "\n-----END CERTIFICATE-----\n"
+    ).encode()
+
+
+def load_blob(path, root_certificate=None, use_mmap=False) -> MetadataStore:
+    """
+    Reads an MDS3 blob, a JWT, from ``path``. With ``root_certificate``, the
+    PEM bytes of the MDS signing root, the signature and certificate chain of
+    the blob are checked first. ``use_mmap`` maps the file rather than reading
+    a copy of it, so only the payload is ever copied.
+    """
+    with open(path, "rb") as f:
+        if use_mmap:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as blob:
+                return _parse_blob(blob, root_certificate)
+        return _parse_blob(f.read(), root_certificate)
+
+
+def _parse_blob(blob, root_certificate):
+    first = blob.find(b".")
+    second = blob.find(b".", first + 1)
+    if first < 0 or second < 0:
+        raise ValueError("The metadata blob is not a JWT")
+    end = len(blob)
+    while end > second and blob[end - 1 : end].isspace():
+        end -= 1
+    header = json.loads(base64url_to_bytes(blob[:first].decode()))
+    payload_part = blob[first + 1 : second]
+    if root_certificate is not None:
+        _verify_blob(
+            header,
+            bytes(blob[:second]),
+            base64url_to_bytes(blob[second + 1 : end].decode()),
+            root_certificate,
+        )
+    return MetadataStore.from_payload(
+        json.loads(base64url_to_bytes(payload_part.decode()))
+    )
+
+
+def _verify_blob(header, signed, signature, root_certificate):
+    x5c = [base64.b64decode(certificate) for certificate in header.get("x5c", ())]
+    try:
+        validate_certificate_chain(x5c=x5c, pem_root_certs_bytes=[root_certificate])
+    except InvalidCertificateChain as e:
+        raise ValueError(f"The metadata blob's certificate chain is invalid: {e}")
+    key = load_der_x509_certificate(x5c[0]).public_key()
+    algorithm = header.get("alg")
+    try:
+        if algorithm == "RS256":
+            key.verify(signature, signed, padding.PKCS1v15(), hashes.SHA256())
+        elif algorithm == "ES256":
+            r = int.from_bytes(signature[:32], "big")
+            s = int.from_bytes(signature[32:], "big")
+            key.verify(
+                encode_dss_signature(r, s), signed, ec.ECDSA(hashes.SHA256())
+            )
+        else:
+            raise ValueError(f"Unsupported metadata blob algorithm {algorithm!r}")
+    except InvalidSignature:
+        raise ValueError("The metadata blob's signature is invalid")
+
+
+@lru_cache(maxsize=None)
+def get_metadata():
+    """The ``MetadataStore`` of ``WEBAUTH_MDS_BLOB``, or ``None`` if unset."""
+    path = getattr(settings, "WEBAUTH_MDS_BLOB", None)
+    if path is None:
+        return None
+    root_path = getattr(settings, "WEBAUTH_MDS_ROOT_CERTIFICATE", None)
+    use_mmap = getattr(settings, "WEBAUTH_MDS_MMAP", False)
+    try:
+        root_certificate = None
+        if root_path is not None:
+            with open(root_path, "rb") as f:
+                root_certificate = f.read()
+        store = load_blob(path, root_certificate, use_mmap)
+    except (OSError, ValueError) as e:
+        raise ImproperlyConfigured(f"Cannot load WEBAUTH_MDS_BLOB: {e}")
+    logger.info(
+        "Loaded metadata blob %s with %d authenticators",
+        store.number,
+        len(store.entries),
+    )
+    return store
+
+
+@lru_cache(maxsize=None)
+def get_allowed_aaguids():
+    """``WEBAUTH_ALLOWED_AAGUIDS`` as a set of 16-byte values, or ``None``."""
+    aaguids = getattr(settings, "WEBAUTH_ALLOWED_AAGUIDS", None)
+    if aaguids is None:
+        return None
+    if getattr(settings, "WEBAUTH_MDS_BLOB", None) is None:
+        # Without roots to chain to, any authenticator could claim an AAGUID.
+        raise ImproperlyConfigured("WEBAUTH_ALLOWED_AAGUIDS requires WEBAUTH_MDS_BLOB")
+    return frozenset(uuid.UUID(aaguid).bytes for aaguid in aaguids)
+
+
+class VerifiedChainCache:
+    """Thread-safe LRU of certificate chains that validated, by fingerprint."""
+
+    def __init__(self, max_size=1024):
+        self._chains = LRUCache(max_size)
+
+    def __contains__(self, fingerprint):
+        expires = self._chains.get(fingerprint)
+        if expires is None:
+            return False
+        if expires <= time.time():
+            self._chains.pop(fingerprint)
+            return False
+        return True
+
+    def add(self, fingerprint, expires):
+        self._chains.set(fingerprint, expires)
+
+    def clear(self):
+        self._chains.clear()
+
+
+verified_chains = VerifiedChainCache(
+    getattr(settings, "WEBAUTH_VERIFIED_CHAIN_CACHE_SIZE", 1024)
+)
+
+
+def chain_fingerprint(aaguid, x5c) -> bytes:
+    """Identifies a certificate chain presented for an authenticator model."""
+    digest = hashlib.sha256(aaguid)
+    for certificate in x5c:
+        digest.update(hashlib.sha256(certificate).digest())
+    return digest.digest()
+
+
+def _chain_expiry(x5c) -> float:
+    expiries = []
+    for certificate in x5c:
+        certificate = load_der_x509_certificate(certificate)
+        not_after = getattr(certificate, "not_valid_after_utc", None)
+        if not_after is None:
+            not_after = certificate.not_valid_after.replace(tzinfo=timezone.utc)
+        expiries.append(not_after.timestamp())
+    return min(expiries)
+
+
+def verify_registration(*, credential, **kwargs):
+    """
+    ``verify_registration_response`` with the trust anchors and policy of
+    the metadata blob applied. Raises ``UntrustedAuthenticator`` for
+    authenticators the policy refuses.
+    """
+    metadata = get_metadata()
+    allowed = get_allowed_aaguids()
+    required = getattr(settings, "WEBAUTH_ATTESTATION_REQUIRED", False)
+    if metadata is None and allowed is None and not required:
+        return verify_registration_response(credential=credential, **kwargs)
+
+    attestation = parse_attestation_object(credential.response.attestation_object)
+    attested = attestation.auth_data.attested_credential_data
+    if attested is None:
+        raise InvalidRegistrationResponse("Authenticator did not attest a credential")
+    aaguid = attested.aaguid
+    x5c = attestation.att_stmt.x5c if attestation.att_stmt else None
+    entry = metadata.get(aaguid) if metadata is not None else None
+
+    if allowed is not None and aaguid not in allowed:
+        raise UntrustedAuthenticator(
+            f"Authenticator {uuid.UUID(bytes=aaguid)} is not allowed"
+        )
+    if entry is not None and entry.compromised:
+        raise UntrustedAuthenticator(f"{entry.description} is compromised")
+    anchored = entry is not None and bool(entry.root_certificates)
+    if (required or allowed is not None or anchored) and not (anchored and x5c):
+        raise UntrustedAuthenticator("Authenticator attestation cannot be verified")
+
+    fingerprint = None
+    if anchored:
+        fingerprint = chain_fingerprint(aaguid, x5c)
+        if fingerprint in verified_chains:
+            fingerprint = None
+        else:
+            kwargs["pem_root_certs_bytes_by_fmt"] = {
+                attestation.fmt: entry.root_certificates
+            }
+    verification = verify_registration_response(credential=credential, **kwargs)
+    if fingerprint is not None:
+        verified_chains.add(fingerprint, _chain_expiry(x5c))
+    return verification
@@ -0,0 +1,301 @@
+"""
+Storage for the challenges issued at the start of each ceremony.
+
+A challenge is filed under a short, random ceremony id that the client sends
+back in the ``X-WebAuth-Ceremony`` header when it completes the ceremony.
+Every stored challenge is bound to the user and the kind of ceremony it was
+issued for, and expires after ``WEBAUTH_TIMEOUT`` milliseconds.
+
+Select a backend with ``WEBAUTH_CHALLENGE_STORE``; keyword arguments for its
+constructor may be given in ``WEBAUTH_CHALLENGE_STORE_OPTIONS``.
+"""
+import time
+from functools import lru_cache
+from secrets import token_hex, token_urlsafe
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from .lru import LRUCache
+
+CEREMONY_HEADER = "X-WebAuth-Ceremony"
+
+REGISTRATION = "registration"
+AUTHENTICATION = "authentication"
+LOGIN = "login"
+
+
+def get_timeout() -> int:
+    """Milliseconds a client is given to complete a ceremony."""
+    return getattr(settings, "WEBAUTH_TIMEOUT", 60000)
+
+
+class ChallengeStore:
+    """
+    Base class for challenge stores. Subclasses implement ``save`` and
+    ``pop``; expiry and the user and ceremony checks are handled here.
+
+    The async views use ``aissue`` and ``aconsume``, which call ``asave`` and
+    ``apop``. By default those run ``save`` and ``pop`` inline, which suits
+    stores that never block.
+    """
+
+    def issue(self, request, ceremony: str) -> Tuple[str, str]:
+        """Create a challenge for ``ceremony``. Returns (ceremony id, challenge)."""
+        ceremony_id, entry = self._new_entry(request, ceremony)
+        self.save(request, ceremony_id, entry)
+        return ceremony_id, entry["challenge"]
+
+    async def aissue(self, request, ceremony: str) -> Tuple[str, str]:
+        ceremony_id, entry = self._new_entry(request, ceremony)
+        await self.asave(request, ceremony_id, entry)
+        return ceremony_id, entry["challenge"]
+
+    def issue_many(self, request, ceremony: str, count: int) -> List[Tuple[str, str]]:
+        """Create ``count`` challenges for ``ceremony`` at once."""
+        issued = [self._new_entry(request, ceremony) for _ in range(count)]
+        self.save_many(request, issued)
+        return [(ceremony_id, entry["challenge"]) for ceremony_id, entry in issued]
+
+    async def aissue_many(
+        self, request, ceremony: str, count: int
+    ) -> List[Tuple[str, str]]:
+        issued = [self._new_entry(request, ceremony) for _ in range(count)]
+        await self.asave_many(request, issued)
+        return [(ceremony_id, entry["challenge"]) for ceremony_id, entry in issued]
+
+    def consume(self, request, ceremony: str, ceremony_id: str) -> Optional[bytes]:
+        """
+        Remove and return the challenge issued under ``ceremony_id``, or
+        ``None`` if there is none, it expired, or it belongs to another user
+        or kind of ceremony.
+        """
+        if not ceremony_id:
+            return None
+        return self._check_entry(request, ceremony, self.pop(request, ceremony_id))
+
+    async def aconsume(
+        self, request, ceremony: str, ceremony_id: str
+    ) -> Optional[bytes]:
+        if not ceremony_id:
+            return None
+        entry = await self.apop(request, ceremony_id)
+        return self._check_entry(request, ceremony, entry)
+
+    def save(self, request, ceremony_id: str, entry: dict):
+        raise NotImplementedError
+
+    def pop(self, request, ceremony_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def save_many(self, request, entries: List[Tuple[str, dict]]):
+        for ceremony_id, entry in entries:
+            self.save(request, ceremony_id, entry)
+
+    async def asave(self, request, ceremony_id: str, entry: dict):
+        self.save(request, ceremony_id, entry)
+
+    async def asave_many(self, request, entries: List[Tuple[str, dict]]):
+        self.save_many(request, entries)
+
+    async def apop(self, request, ceremony_id: str) -> Optional[dict]:
+        return self.pop(request, ceremony_id)
+
+    def _new_entry(self, request, ceremony):
+        entry = {
+            "challenge": token_hex(),
+            "ceremony": ceremony,
+            "user": _user_key(request),
+            "expires": time.time() + get_timeout() / 1000,
+        }
+        return token_urlsafe(12), entry
+
+    def _check_entry(self, request, ceremony, entry):
+        if (
+            entry is None
+            or entry["ceremony"] != ceremony
+            or entry["user"] != _user_key(request)
+            or entry["expires"] < time.time()
+        ):
+            return None
+        return bytes.fromhex(entry["challenge"])
+
+
+class SessionChallengeStore(ChallengeStore):
+    """
+    Keeps the challenges in flight in the user's session: a single one, or
+    the set issued together by ``issue_many``.
+    """
+
+    session_key = "webauth_challenge"
+
+    def save(self, request, ceremony_id, entry):
+        request.session[self.session_key] = dict(entry, id=ceremony_id)
+
+    def save_many(self, request, entries):
+        request.session[self.session_key] = {"batch": dict(entries)}
+
+    def pop(self, request, ceremony_id):
+        stored = request.session.pop(self.session_key, None)
+        if stored is None:
+            return None
+        if "batch" in stored:
+            entry = stored["batch"].pop(ceremony_id, None)
+            if stored["batch"]:
+                request.session[self.session_key] = stored
+            return entry
+        if stored.get("id") != ceremony_id:
+            return None
+        return stored
+
+
+class CacheChallengeStore(ChallengeStore):
+    """
+    Keeps challenges in Django's cache, where they expire along with the
+    ceremony. Suitable for any number of processes sharing that cache.
+    """
+
+    key_prefix = "webauth:challenge:"
+
+    def __init__(self, alias=None):
+        self.alias = alias or getattr(settings, "WEBAUTH_CACHE", "default")
+
+    def save(self, request, ceremony_id, entry):
+        caches[self.alias].set(
+            self.key_prefix + ceremony_id, entry, get_timeout() / 1000
+        )
+
+    def save_many(self, request, entries):
+        caches[self.alias].set_many(
+            {self.key_prefix + ceremony_id: entry for ceremony_id, entry in entries},
+            get_timeout() / 1000,
+        )
+
+    def pop(self, request, ceremony_id):
+        cache = caches[self.alias]
+        key = self.key_prefix + ceremony_id
+        entry = cache.get(key)
+        # Only the request that actually removes the key may use it.
+        if entry is None or not cache.delete(key):
+            return None
+        return entry
+
+    async def asave(self, request, ceremony_id, entry):
+        await caches[self.alias].aset(
+            self.key_prefix + ceremony_id, entry, get_timeout() / 1000
+        )
+
+    async def asave_many(self, request, entries):
+        await caches[self.alias].aset_many(
+            {self.key_prefix + ceremony_id: entry for ceremony_id, entry in entries},
+            get_timeout() / 1000,
+        )
+
+    async def apop(self, request, ceremony_id):
+        cache = caches[self.alias]
+        key = self.key_prefix + ceremony_id
+        entry = await cache.aget(key)
+        if entry is None or not await cache.adelete(key):
+            return None
+        return entry
+
+
+class LocMemChallengeStore(ChallengeStore):
+    """
+    Keeps challenges in a size-bounded LRU map in the current process.
+    Expired entries are evicted as new ones are issued. Only suitable when
+    both halves of a ceremony are served by the same process.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = LRUCache(max_entries)
+
+    def save(self, request, ceremony_id, entry):
+        now = time.time()
+        self._entries.set(ceremony_id, entry)
+        self._entries.evict(lambda oldest: oldest["expires"] < now)
+
+    def pop(self, request, ceremony_id):
+        return self._entries.pop(ceremony_id)
+
+
+class SignedChallengeStore(ChallengeStore):
+    """
+    Stores nothing when a ceremony starts: the ceremony id is the challenge
+    entry itself, signed with ``SECRET_KEY``. Any process sharing the secret
+    can complete the ceremony, and issuing a challenge writes neither the
+    session nor a cache.
+
+    Each challenge is remembered once used, until it expires, so a ceremony
+    id cannot be replayed. The used challenges are kept in the cache named by
+    ``replay_cache``, ``WEBAUTH_CACHE`` by default, which every process
+    serving ceremonies must share.
+    """
+
+    salt = "webauth.challenges.SignedChallengeStore"
+    key_prefix = "webauth:used-challenge:"
+
+    def __init__(self, replay_cache=None):
+        self.replay_cache = replay_cache or getattr(
+            settings, "WEBAUTH_CACHE", "default"
+        )
+
+    def _new_entry(self, request, ceremony):
+        _, entry = super()._new_entry(request, ceremony)
+        return signing.dumps(entry, salt=self.salt, compress=True), entry
+
+    def save(self, request, ceremony_id, entry):
+        pass
+
+    def save_many(self, request, entries):
+        pass
+
+    def consume(self, request, ceremony, ceremony_id):
+        challenge = self._check_entry(request, ceremony, self._unsign(ceremony_id))
+        if challenge is None or not caches[self.replay_cache].add(
+            self._used_key(challenge), True, get_timeout() / 1000
+        ):
+            return None
+        return challenge
+
+    async def aconsume(self, request, ceremony, ceremony_id):
+        challenge = self._check_entry(request, ceremony, self._unsign(ceremony_id))
+        if challenge is None or not await caches[self.replay_cache].aadd(
+            self._used_key(challenge), True, get_timeout() / 1000
+        ):
+            return None
+        return challenge
+
+    def _unsign(self, ceremony_id):
+        if not ceremony_id:
+            return None
+        try:
+            return signing.loads(ceremony_id, salt=self.salt)
+        except signing.BadSignature:
+            return None
+
+    def _used_key(self, challenge):
+        return self.key_prefix + challenge.hex()
+
+
+def _user_key(request) -> str:
+    user = getattr(request, "user", None)
+    if user is None or not user.is_authenticated:
+        return ""
+    return str(user.pk)
+
+
+@lru_cache(maxsize=None)
+def get_challenge_store() -> ChallengeStore:
+    store_class = import_string(
+        getattr(
+            settings,
+            "WEBAUTH_CHALLENGE_STORE",
+            "webauth.challenges.SessionChallengeStore",
+        )
+    )
+    return store_class(**getattr(settings, "WEBAUTH_CHALLENGE_STORE_OPTIONS", {}))
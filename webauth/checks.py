@@ -0,0 +1,56 @@
+"""
+System checks for Web Authentication settings.
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+from django.core.exceptions import ImproperlyConfigured
+
+from .options import get_algorithms
+
+REQUIRED_SETTINGS = (
+    "WEBAUTH_RP_ID",
+    "WEBAUTH_RP_NAME",
+    "WEBAUTH_ORIGIN",
+    "WEBAUTH_VERIFY_URL",
+)
+
+
+@register()
+def check_settings(app_configs, **kwargs):
+    """Report settings the ceremonies cannot run without."""
+    errors = [
+        Error(f"{name} is not set.", id="webauth.E001")
+        for name in REQUIRED_SETTINGS
+        if not getattr(settings, name, None)
+    ]
+    try:
+        get_algorithms()
+    except ImproperlyConfigured as e:
+        errors.append(Error(str(e), id="webauth.E002"))
+    return errors
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Warn when ``WEBAUTH_CACHE`` is private to each process, so a device
+    revoked or a browser forgotten in one process keeps validating in the
+    others, and a device added or removed is missing from or left in their
+    ``allowCredentials`` lists, until the cached values expire.
+    """
+    alias = getattr(settings, "WEBAUTH_CACHE", "default")
+    backend = settings.CACHES.get(alias, {}).get("BACKEND", "")
+    if backend != "django.core.cache.backends.locmem.LocMemCache":
+        return []
+    return [
+        Warning(
+            f"WEBAUTH_CACHE names the per-process cache {alias!r}.",
+            hint=(
+                "Other processes only notice added and deleted devices and "
+                "forgotten browsers after WEBAUTH_CACHE_TIMEOUT seconds. Use a "
+                "cache shared by all of your processes, such as Redis or "
+                "Memcached."
+            ),
+            id="webauth.W001",
+        )
+    ]
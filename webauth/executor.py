@@ -0,0 +1,172 @@
+"""
+Executor for the CPU-bound parts of a ceremony: CBOR parsing and signature
+verification inside ``verify_registration_response`` and
+``verify_authentication_response``.
+
+Verification runs on a bounded pool so that a burst of ceremonies cannot
+starve the other views served by the same workers. Once ``MAX_QUEUE`` calls
+are waiting for a worker, further calls fail fast with ``VerificationBusy``
+and the views answer 503 with a ``Retry-After`` header.
+
+Configure it with ``WEBAUTH_VERIFICATION_EXECUTOR``::
+
+    WEBAUTH_VERIFICATION_EXECUTOR = {
+        "KIND": "thread",  # or "process", or "inline"
+        "MAX_WORKERS": 4,
+        "MAX_QUEUE": 32,  # None for no limit
+        "TIMEOUT": 5,  # seconds, None to wait forever
+        "RETRY_AFTER": 1,  # seconds
+    }
+
+``"inline"`` runs verification in the calling thread and only enforces the
+concurrency limit; the async views should not use it.
+"""
+import asyncio
+import time
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    TimeoutError,
+)
+from functools import lru_cache, partial
+from threading import BoundedSemaphore
+
+from django.conf import settings
+
+
+class VerificationBusy(Exception):
+    """The executor is saturated or did not answer in time."""
+
+
+class VerificationExecutor:
+    def __init__(
+        self, kind="thread", max_workers=4, max_queue=None, timeout=None, retry_after=1
+    ):
+        self.kind = kind
+        self.timeout = timeout
+        self.retry_after = retry_after
+        if kind == "process":
+            self.pool = ProcessPoolExecutor(max_workers=max_workers)
+        elif kind == "thread":
+            self.pool = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="webauth-verify"
+            )
+        elif kind == "inline":
+            self.pool = None
+        else:
+            raise ValueError(f"Unknown verification executor kind {kind!r}")
+        self.slots = None
+        if max_queue is not None:
+            self.slots = BoundedSemaphore(max_workers + max_queue)
+
+    def submit(self, func, **kwargs) -> Future:
+        """
+        Schedule ``func(**kwargs)``. Raises ``VerificationBusy`` if the queue
+        is full.
+        """
+        if self.slots is not None and not self.slots.acquire(blocking=False):
+            raise VerificationBusy()
+        try:
+            if self.pool is None:
+                future = Future()
+                try:
+                    future.set_result(func(**kwargs))
+                except Exception as e:
+                    future.set_exception(e)
+            else:
+                future = self.pool.submit(partial(func, **kwargs))
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, func, **kwargs):
+        """Run ``func(**kwargs)`` on the executor and wait for its result."""
+        future = self.submit(func, **kwargs)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise VerificationBusy()
+
+    async def arun(self, func, **kwargs):
+        """Async version of ``run``; the event loop is not blocked."""
+        future = asyncio.wrap_future(self.submit(func, **kwargs))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise VerificationBusy()
+
+    def run_many(self, func, calls) -> list:
+        """
+        Run ``func(**kwargs)`` for every ``kwargs`` in ``calls`` concurrently.
+        Returns their results in order, with the exception in place of the
+        result of every call that raised. Calls that do not fit in the queue
+        or miss the timeout get ``VerificationBusy``.
+        """
+        futures = []
+        for kwargs in calls:
+            try:
+                futures.append(self.submit(func, **kwargs))
+            except VerificationBusy as e:
+                futures.append(e)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        results = []
+        for future in futures:
+            if isinstance(future, VerificationBusy):
+                results.append(future)
+                continue
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+            try:
+                results.append(future.result(timeout=remaining))
+            except TimeoutError:
+                results.append(VerificationBusy())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    async def arun_many(self, func, calls) -> list:
+        """Async version of ``run_many``."""
+
+        async def run(kwargs):
+            try:
+                return await self.arun(func, **kwargs)
+            except Exception as e:
+                return e
+
+        return await asyncio.gather(*(run(kwargs) for kwargs in calls))
+
+    def _release(self, future=None):
+        if self.slots is not None:
+            self.slots.release()
+
+
+@lru_cache(maxsize=None)
+def get_executor() -> VerificationExecutor:
+    options = getattr(settings, "WEBAUTH_VERIFICATION_EXECUTOR", {})
+    return VerificationExecutor(
+        kind=options.get("KIND", "thread"),
+        max_workers=options.get("MAX_WORKERS", 4),
+        max_queue=options.get("MAX_QUEUE"),
+        timeout=options.get("TIMEOUT"),
+        retry_after=options.get("RETRY_AFTER", 1),
+    )
+
+
+def run(func, **kwargs):
+    return get_executor().run(func, **kwargs)
+
+
+async def arun(func, **kwargs):
+    return await get_executor().arun(func, **kwargs)
+
+
+def run_many(func, calls):
+    return get_executor().run_many(func, calls)
+
+
+async def arun_many(func, calls):
+    return await get_executor().arun_many(func, calls)
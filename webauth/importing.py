@@ -0,0 +1,285 @@
+"""
+Bulk import of credentials registered elsewhere, e.g. when migrating from
+another MFA system.
+
+Input is JSON Lines, one credential per line, in the shape written by the
+``export_webauth_devices`` command::
+
+    {"user_id": 42, "name": "YubiKey", "credential_id": "<base64url>",
+     "public_key": "<base64url COSE key>", "format": "packed",
+     "type": "public-key", "sign_count": 17}
+
+``username`` may be given instead of ``user_id``. ``user_handle``, the
+base64url user handle the credential was created with, is needed for
+passwordless login with discoverable credentials. Lines are read lazily and
+handled in batches: the COSE keys of a batch are decoded on a process pool
+while the previous batch is inserted with ``bulk_create``. Credentials already
+registered are skipped, and each batch commits on its own, so an interrupted
+import can be resumed from its checkpoint file, or simply run again.
+
+Devices take the time of the import as ``created_at``.
+"""
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.db.models import CharField, Q
+from webauthn.helpers import (
+    base64url_to_bytes,
+    decode_credential_public_key,
+    decoded_public_key_to_cryptography,
+)
+
+from . import options
+from .models import WebAuthDevice, hash_credential_id, user_handle
+
+# Authenticators keep a 32-bit unsigned signature counter.
+MAX_SIGN_COUNT = 2**32 - 1
+
+# Fields checked against the model before a batch reaches the database.
+_CHECKED_FIELDS = (
+    "name",
+    "format",
+    "type",
+    "credential_id",
+    "public_key",
+    "sign_count",
+)
+
+
+class ImportStats:
+    """Running totals of an import, passed to the ``progress`` callback."""
+
+    def __init__(self, skip_lines=0):
+        self.started_at = time.monotonic()
+        self.lines = skip_lines
+        self.imported = 0
+        self.existing = 0
+        self.errors = []
+
+    @property
+    def failed(self) -> int:
+        return len(self.errors)
+
+    @property
+    def rate(self) -> float:
+        """Lines handled per second since the import (re)started."""
+        elapsed = time.monotonic() - self.started_at
+        handled = self.imported + self.existing + self.failed
+        return handled / elapsed if elapsed else 0.0
+
+
+def parse_record(line):
+    """
+    Decodes and validates one input line, down to every value fitting its
+    column. Returns ``(fields, None)`` for a usable credential,
+    ``(None, reason)`` for an unusable one and ``(None, None)`` for a blank
+    line. Runs in the pool.
+    """
+    if not line.strip():
+        return None, None
+    try:
+        data = json.loads(line)
+    except ValueError as e:
+        return None, f"{type(e).__name__}: {e}"
+    if not isinstance(data, dict):
+        return None, "not a JSON object"
+    try:
+        fields = {
+            "user_id": data.get("user_id"),
+            "username": data.get("username"),
+            "name": data.get("name") or "Imported key",
+            "credential_id": base64url_to_bytes(data["credential_id"]),
+            "public_key": base64url_to_bytes(data["public_key"]),
+            "format": data.get("format", "none"),
+            "type": data.get("type", "public-key"),
+            "sign_count": int(data.get("sign_count", 0)),
+            "user_handle": (
+                base64url_to_bytes(data["user_handle"]).hex()
+                if data.get("user_handle")
+                else None
+            ),
+        }
+        decoded_public_key_to_cryptography(
+            decode_credential_public_key(fields["public_key"])
+        )
+    except Exception as e:
+        # A malformed COSE key can fail anywhere in the CBOR and key decoders,
+        # not only with their own exceptions.
+        return None, f"{type(e).__name__}: {e}"
+    if fields["user_id"] is None and fields["username"] is None:
+        return None, "neither user_id nor username given"
+    if fields["user_handle"] is not None and len(fields["user_handle"]) > 128:
+        return None, "user_handle is longer than 64 bytes"
+    if not 0 <= fields["sign_count"] <= MAX_SIGN_COUNT:
+        return None, f"sign_count is not between 0 and {MAX_SIGN_COUNT}"
+    for name in _CHECKED_FIELDS:
+        # One value the column cannot hold would fail the whole batch.
+        field = WebAuthDevice._meta.get_field(name)
+        if isinstance(field, CharField) and not isinstance(fields[name], str):
+            return None, f"{name} is not a string"
+        try:
+            field.run_validators(fields[name])
+        except ValidationError as e:
+            return None, f"{name}: {' '.join(e.messages)}"
+    return fields, None
+
+
+def import_devices(
+    lines, *, batch_size=1000, workers=None, checkpoint=None, progress=None
+) -> ImportStats:
+    """
+    Imports the credentials in ``lines``, an iterable of JSON strings.
+
+    ``workers`` processes validate keys (``0`` validates in this process,
+    ``None`` uses one per CPU). If ``checkpoint`` names a file, the number of
+    lines already handled is kept there after every batch and that many lines
+    are skipped when the import starts again. ``progress`` is called with the
+    ``ImportStats`` after every batch.
+    """
+    skip = _read_checkpoint(checkpoint)
+    stats = ImportStats(skip)
+    lines = iter(lines)
+    for _ in islice(lines, skip):
+        pass
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pool = ProcessPoolExecutor(workers) if workers else None
+    try:
+        pending = None
+        while True:
+            batch = list(islice(lines, batch_size))
+            if not batch:
+                break
+            if pool is None:
+                results = map(parse_record, batch)
+            else:
+                chunksize = max(1, len(batch) // (workers * 4))
+                results = pool.map(parse_record, batch, chunksize=chunksize)
+            # Validation of this batch runs while the previous one is inserted.
+            if pending is not None:
+                _insert_batch(pending, stats, checkpoint, progress)
+            pending = (stats.lines, len(batch), results)
+            stats.lines += len(batch)
+        if pending is not None:
+            _insert_batch(pending, stats, checkpoint, progress)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return stats
+
+
+def _insert_batch(pending, stats, checkpoint, progress):
+    first_line, count, results = pending
+    records = []
+    for line_number, (fields, error) in enumerate(results, first_line + 1):
+        if error is not None:
+            stats.errors.append((line_number, error))
+        elif fields is not None:
+            records.append((line_number, fields))
+
+    devices = _new_devices(records, stats)
+    if devices:
+        with transaction.atomic(using=router.db_for_write(WebAuthDevice)):
+            known = {
+                (credential_hash, bytes(credential_id))
+                for credential_hash, credential_id in WebAuthDevice.objects.filter(
+                    credential_hash__in=[d.credential_hash for d in devices]
+                ).values_list("credential_hash", "credential_id")
+            }
+            new = []
+            for device in devices:
+                key = (device.credential_hash, device.credential_id)
+                if key not in known:
+                    known.add(key)
+                    new.append(device)
+            WebAuthDevice.objects.bulk_create(new)
+        stats.imported += len(new)
+        stats.existing += len(devices) - len(new)
+        options.forget_credentials({device.user_id for device in new})
+
+    _write_checkpoint(checkpoint, first_line + count)
+    if progress is not None:
+        progress(stats)
+
+
+def _new_devices(records, stats):
+    """Resolves the users of a batch with one query and builds its devices."""
+    User = get_user_model()
+    username_field = User.USERNAME_FIELD
+    records = list(_with_user_ids(User, records, stats))
+    user_ids = {fields["user_id"] for _, fields in records} - {None}
+    usernames = {
+        fields["username"] for _, fields in records if fields["user_id"] is None
+    }
+    users = list(
+        User._default_manager.filter(
+            Q(pk__in=user_ids) | Q(**{f"{username_field}__in": usernames})
+        ).values_list("pk", username_field)
+    )
+    known_ids = {pk for pk, username in users}
+    ids_by_username = {username: pk for pk, username in users}
+
+    devices = []
+    for line_number, fields in records:
+        if fields["user_id"] is None:
+            user_id = ids_by_username.get(fields["username"])
+        else:
+            user_id = fields["user_id"] if fields["user_id"] in known_ids else None
+        if user_id is None:
+            user = fields["user_id"] or fields["username"]
+            stats.errors.append((line_number, f"unknown user {user!r}"))
+            continue
+        devices.append(
+            WebAuthDevice(
+                user_id=user_id,
+                name=fields["name"],
+                credential_id=fields["credential_id"],
+                credential_hash=hash_credential_id(fields["credential_id"]),
+                user_handle=fields["user_handle"] or user_handle(user_id),
+                public_key=fields["public_key"],
+                format=fields["format"],
+                type=fields["type"],
+                sign_count=fields["sign_count"],
+            )
+        )
+    return devices
+
+
+def _with_user_ids(User, records, stats):
+    """
+    Converts each ``user_id`` to the type of the user model's primary key,
+    e.g. ``"42"`` to ``42``, and reports those that cannot be.
+    """
+    for line_number, fields in records:
+        if fields["user_id"] is not None:
+            try:
+                fields["user_id"] = User._meta.pk.to_python(fields["user_id"])
+            except ValidationError:
+                stats.errors.append(
+                    (line_number, f"invalid user_id {fields['user_id']!r}")
+                )
+                continue
+        yield line_number, fields
+
+
+def _read_checkpoint(path) -> int:
+    if path is None or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return int(f.read().strip() or 0)
+
+
+def _write_checkpoint(path, lines):
+    if path is None:
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(str(lines))
+    os.replace(tmp, path)
@@ -0,0 +1,174 @@
+"""
+Cache of decoded credential public keys.
+
+``verify_authentication_response`` decodes the COSE public key of a device and
+builds a ``cryptography`` key object on every assertion. ``verify_authentication``
+performs the same checks but keeps the decoded key in a per-process LRU cache
+keyed by device id and credential revision, so repeat logins from the same
+authenticator skip decoding and key construction.
+
+The size of the cache is set by ``WEBAUTH_PUBLIC_KEY_CACHE_SIZE``.
+"""
+import hashlib
+
+from cryptography.exceptions import InvalidSignature
+from django.conf import settings
+from webauthn.authentication.verify_authentication_response import (
+    VerifiedAuthentication,
+    expected_token_binding_statuses,
+)
+from webauthn.helpers import (
+    bytes_to_base64url,
+    decode_credential_public_key,
+    decoded_public_key_to_cryptography,
+    parse_authenticator_data,
+    parse_client_data_json,
+    verify_signature,
+)
+from webauthn.helpers.exceptions import InvalidAuthenticationResponse
+from webauthn.helpers.structs import ClientDataType, PublicKeyCredentialType
+
+from .lru import LRUCache
+from .state import credential_revision
+
+
+class SignCountConflict(InvalidAuthenticationResponse):
+    """The assertion's sign count did not move past the stored one."""
+
+
+class PublicKeyCache:
+    """Thread-safe LRU map of ``(device id, revision)`` to decoded keys."""
+
+    def __init__(self, max_size=1024):
+        self._keys = LRUCache(max_size)
+
+    def get(self, device_id, revision, public_key):
+        """
+        Returns ``(algorithm, key)`` for the device, decoding ``public_key``
+        only if it is not cached yet.
+        """
+        cache_key = (device_id, revision)
+        decoded = self._keys.get(cache_key)
+        if decoded is not None:
+            return decoded
+
+        decoded_public_key = decode_credential_public_key(bytes(public_key))
+        decoded = (
+            decoded_public_key.alg,
+            decoded_public_key_to_cryptography(decoded_public_key),
+        )
+        self._keys.set(cache_key, decoded)
+        return decoded
+
+    def forget(self, device_ids):
+        """Drop every cached key of these devices."""
+        device_ids = set(device_ids)
+        self._keys.discard(lambda cache_key: cache_key[0] in device_ids)
+
+    def clear(self):
+        self._keys.clear()
+
+
+public_keys = PublicKeyCache(getattr(settings, "WEBAUTH_PUBLIC_KEY_CACHE_SIZE", 1024))
+
+
+def verify_authentication(
+    *,
+    credential,
+    expected_challenge,
+    expected_rp_id,
+    expected_origin,
+    device_id,
+    credential_public_key,
+    credential_current_sign_count,
+    require_user_verification=False,
+):
+    """
+    Same as ``webauthn.verify_authentication_response``, except that the
+    public key of device ``device_id`` is taken from the key cache.
+    """
+    if bytes_to_base64url(credential.raw_id) != credential.id:
+        raise InvalidAuthenticationResponse("id and raw_id were not equivalent")
+
+    if credential.type != PublicKeyCredentialType.PUBLIC_KEY:
+        raise InvalidAuthenticationResponse(
+            f'Unexpected credential type "{credential.type}", expected "public-key"'
+        )
+
+    response = credential.response
+
+    client_data = parse_client_data_json(response.client_data_json)
+
+    if client_data.type != ClientDataType.WEBAUTHN_GET:
+        raise InvalidAuthenticationResponse(
+            f'Unexpected client data type "{client_data.type}", '
+            f'expected "{ClientDataType.WEBAUTHN_GET}"'
+        )
+
+    if expected_challenge != client_data.challenge:
+        raise InvalidAuthenticationResponse(
+            "Client data challenge was not expected challenge"
+        )
+
+    if isinstance(expected_origin, str):
+        expected_origin = [expected_origin]
+    if client_data.origin not in expected_origin:
+        raise InvalidAuthenticationResponse(
+            f'Unexpected client data origin "{client_data.origin}", '
+            f"expected one of {expected_origin}"
+        )
+
+    if client_data.token_binding:
+        status = client_data.token_binding.status
+        if status not in expected_token_binding_statuses:
+            raise InvalidAuthenticationResponse(
+                f'Unexpected token_binding status of "{status}"'
+            )
+
+    auth_data = parse_authenticator_data(response.authenticator_data)
+
+    expected_rp_id_hash = hashlib.sha256(expected_rp_id.encode("utf-8")).digest()
+    if auth_data.rp_id_hash != expected_rp_id_hash:
+        raise InvalidAuthenticationResponse("Unexpected RP ID hash")
+
+    if not auth_data.flags.up:
+        raise InvalidAuthenticationResponse(
+            "User was not present during authentication"
+        )
+
+    if require_user_verification and not auth_data.flags.uv:
+        raise InvalidAuthenticationResponse(
+            "User verification is required but user was not verified during "
+            "authentication"
+        )
+
+    client_data_hash = hashlib.sha256(response.client_data_json).digest()
+    signature_base = response.authenticator_data + client_data_hash
+
+    revision = credential_revision(credential.raw_id, credential_public_key)
+    alg, public_key = public_keys.get(device_id, revision, credential_public_key)
+    try:
+        verify_signature(
+            public_key=public_key,
+            signature_alg=alg,
+            signature=response.signature,
+            data=signature_base,
+        )
+    except InvalidSignature:
+        raise InvalidAuthenticationResponse("Could not verify authentication signature")
+
+    # The sign count must grow with every assertion, otherwise this may be a
+    # replayed response or a cloned authenticator. Checked after the signature
+    # so that only genuine assertions are reported as conflicts.
+    if (
+        auth_data.sign_count > 0 or credential_current_sign_count > 0
+    ) and auth_data.sign_count <= credential_current_sign_count:
+        raise SignCountConflict(
+            f"Response sign count of {auth_data.sign_count} was not greater than "
+            f"current count of {credential_current_sign_count}"
+        )
+
+    return VerifiedAuthentication(
+        credential_id=credential.raw_id,
+        new_sign_count=auth_data.sign_count,
+    )
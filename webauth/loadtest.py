@@ -0,0 +1,390 @@
+"""
+Load test of a running site's Web Authentication ceremonies.
+
+A fleet of virtual users, each with its own ``SoftAuthenticator`` (its own
+key and sign counter) and its own keep-alive connection, drives a server
+running the example project concurrently from one asyncio event loop:
+
+    python -m webauth.loadtest http://localhost:8000 --users 500 --duration 60
+
+Every user signs up through ``/register/``, registers its authenticator at
+``/webauth/registration/``, then until the time is up verifies at
+``/webauth/verification/`` and loads ``/private/``. Throughput, latency
+percentiles and error rates are reported per endpoint.
+
+To also report database queries per request, add
+``webauth.loadtest.QueryCountMiddleware`` to the server's ``MIDDLEWARE``
+while testing. Turn off ``WEBAUTH_THROTTLE_RATES`` on the server too, or most
+of the fleet's requests will be throttled.
+"""
+import argparse
+import asyncio
+import json
+import ssl
+import statistics
+import sys
+import time
+from collections import Counter
+from contextlib import ExitStack
+from secrets import token_hex, token_urlsafe
+from urllib.parse import urlencode, urlsplit
+
+from .testing import EDDSA, ES256, RS256, SoftAuthenticator
+
+ALGORITHMS = {"es256": ES256, "eddsa": EDDSA, "rs256": RS256}
+QUERY_COUNT_HEADER = "X-Query-Count"
+
+
+class QueryCountMiddleware:
+    """
+    Reports the number of database queries a request made in the
+    ``X-Query-Count`` response header. Only meant for load testing.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        from django.db import connections
+
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(count))
+            response = self.get_response(request)
+        response[QUERY_COUNT_HEADER] = str(queries)
+        return response
+
+
+class Response:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class Connection:
+    """
+    A minimal HTTP/1.1 client: one keep-alive connection plus the cookies of
+    one user. The standard library has no asyncio HTTP client, and a third
+    party one would be one more thing to install for a load test.
+    """
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.netloc = parts.netloc
+        self.origin = f"{parts.scheme}://{parts.netloc}"
+        self.cookies = {}
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=b"", headers=None) -> Response:
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(
+                    self.host, self.port, ssl=self.ssl
+                )
+            try:
+                return await self._exchange(method, path, body, headers or {})
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                # The server may have closed an idle connection; retry once.
+                if attempt:
+                    raise
+
+    async def _exchange(self, method, path, body, headers):
+        lines = [
+            f"{method} {path} HTTP/1.1",
+            f"Host: {self.netloc}",
+            f"Content-Length: {len(body)}",
+        ]
+        if self.cookies:
+            cookies = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+            lines.append(f"Cookie: {cookies}")
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        self.writer.write("\r\n".join(lines).encode() + b"\r\n\r\n" + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = (await self.reader.readuntil(b"\r\n")).decode("latin-1")
+            if line == "\r\n":
+                break
+            name, value = line.rstrip("\r\n").split(":", 1)
+            name, value = name.lower(), value.strip()
+            if name == "set-cookie":
+                cookie = value.split(";", 1)[0]
+                key, _, cookie_value = cookie.partition("=")
+                self.cookies[key] = cookie_value.strip('"')
+            response_headers[name] = value
+
+        if response_headers.get("transfer-encoding") == "chunked":
+            body = await self._read_chunked()
+        elif "content-length" in response_headers:
+            length = int(response_headers["content-length"])
+            body = await self.reader.readexactly(length)
+        else:
+            body = await self.reader.read()
+            response_headers["connection"] = "close"
+        if response_headers.get("connection") == "close":
+            self.close()
+        return Response(status, response_headers, body)
+
+    async def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                await self.reader.readuntil(b"\r\n")
+                return b"".join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readexactly(2)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = Counter()
+        self.queries = []
+
+    def record(self, elapsed, error=None, queries=None):
+        self.latencies.append(elapsed)
+        if error is not None:
+            self.errors[error] += 1
+        if queries is not None:
+            self.queries.append(queries)
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of already sorted ``samples``."""
+    index = max(0, min(len(samples) - 1, round(fraction * len(samples)) - 1))
+    return samples[index]
+
+
+def summarize(endpoint, stats, duration):
+    samples = sorted(stats.latencies)
+    errors = sum(stats.errors.values())
+    return dict(
+        endpoint=endpoint,
+        requests=len(samples),
+        rps=len(samples) / duration if duration else 0.0,
+        error_rate=errors / len(samples) if samples else 0.0,
+        errors=dict(stats.errors),
+        p50_ms=percentile(samples, 0.50) * 1000,
+        p90_ms=percentile(samples, 0.90) * 1000,
+        p99_ms=percentile(samples, 0.99) * 1000,
+        max_ms=samples[-1] * 1000,
+        queries=statistics.mean(stats.queries) if stats.queries else None,
+    )
+
+
+class VirtualUser:
+    """One user of the fleet, with its own authenticator and connection."""
+
+    def __init__(self, load_test, username):
+        self.load_test = load_test
+        self.username = username
+        self.connection = Connection(load_test.url)
+        self.authenticator = SoftAuthenticator(
+            rp_id=load_test.rp_id, origin=load_test.origin, alg=load_test.alg
+        )
+
+    async def call(self, endpoint, method, path, expected, body=b"", headers=None):
+        """Makes a request, recording it under ``endpoint``."""
+        headers = dict(headers or {})
+        if method == "POST":
+            headers["Origin"] = self.connection.origin
+            headers["X-CSRFToken"] = self.connection.cookies.get("csrftoken", "")
+        stats = self.load_test.stats.setdefault(endpoint, EndpointStats())
+        started = time.perf_counter()
+        try:
+            response = await self.connection.request(method, path, body, headers)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            stats.record(time.perf_counter() - started, type(e).__name__)
+            return None
+        elapsed = time.perf_counter() - started
+        queries = response.headers.get(QUERY_COUNT_HEADER.lower())
+        error = None if response.status == expected else str(response.status)
+        stats.record(elapsed, error, None if queries is None else int(queries))
+        return response if error is None else None
+
+    async def ceremony(self, kind, expected, answer):
+        """Fetches options, then posts the authenticator's answer to them."""
+        path = f"/webauth/{kind}/"
+        response = await self.call(f"{kind}.get", "GET", path, 200)
+        if response is None:
+            return False
+        options = response.json()
+        credential = answer(bytes.fromhex(options["publicKey"]["challenge"]))
+        if kind == "registration":
+            credential = {"name": self.username, "pubKeyCredential": credential}
+        response = await self.call(
+            f"{kind}.post",
+            "POST",
+            path,
+            expected,
+            json.dumps(credential).encode(),
+            {
+                "Content-Type": "application/json",
+                "X-WebAuth-Ceremony": options["ceremony"],
+            },
+        )
+        return response is not None
+
+    async def sign_up(self):
+        if await self.call("signup.get", "GET", "/register/", 200) is None:
+            return False
+        password = token_urlsafe(16)
+        form = urlencode(
+            {
+                "username": self.username,
+                "password1": password,
+                "password2": password,
+                "csrfmiddlewaretoken": self.connection.cookies.get("csrftoken", ""),
+            }
+        ).encode()
+        response = await self.call(
+            "signup.post",
+            "POST",
+            "/register/",
+            302,
+            form,
+            {"Content-Type": "application/x-www-form-urlencoded"},
+        )
+        return response is not None
+
+    async def run(self, deadline):
+        try:
+            if not await self.sign_up():
+                return
+            authenticator = self.authenticator
+            if not await self.ceremony("registration", 201, authenticator.register):
+                return
+            while time.monotonic() < deadline:
+                await self.ceremony("verification", 200, authenticator.authenticate)
+                await self.call("private.get", "GET", "/private/", 200)
+                if self.load_test.think_time:
+                    await asyncio.sleep(self.load_test.think_time)
+        finally:
+            self.connection.close()
+
+
+class LoadTest:
+    def __init__(
+        self,
+        url,
+        users,
+        duration,
+        ramp_up=0,
+        alg=ES256,
+        origin=None,
+        rp_id=None,
+        think_time=0,
+    ):
+        self.url = url.rstrip("/")
+        self.users = users
+        self.duration = duration
+        self.ramp_up = ramp_up
+        self.alg = alg
+        parts = urlsplit(self.url)
+        self.origin = origin or f"{parts.scheme}://{parts.netloc}"
+        self.rp_id = rp_id or parts.hostname
+        self.think_time = think_time
+        self.stats = {}
+
+    async def run(self):
+        """Runs the fleet; returns the per endpoint results."""
+        run_id = token_hex(4)
+        started = time.monotonic()
+        deadline = started + self.ramp_up + self.duration
+
+        async def start(n):
+            if self.ramp_up:
+                await asyncio.sleep(self.ramp_up * n / self.users)
+            await VirtualUser(self, f"load-{run_id}-{n}").run(deadline)
+
+        await asyncio.gather(*(start(n) for n in range(self.users)))
+        elapsed = time.monotonic() - started
+        return [
+            summarize(endpoint, stats, elapsed)
+            for endpoint, stats in sorted(self.stats.items())
+        ]
+
+
+def print_results(results, file=sys.stdout):
+    header = (
+        f"{'endpoint':<20}{'requests':>10}{'req/s':>9}{'errors':>8}"
+        f"{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}{'queries':>9}"
+    )
+    print(header, file=file)
+    print("-" * len(header), file=file)
+    for r in results:
+        queries = "-" if r["queries"] is None else f"{r['queries']:.1f}"
+        print(
+            f"{r['endpoint']:<20}{r['requests']:>10}{r['rps']:>9.1f}"
+            f"{r['error_rate']:>8.1%}{r['p50_ms']:>9.1f}{r['p90_ms']:>9.1f}"
+            f"{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}{queries:>9}",
+            file=file,
+        )
+    for r in results:
+        if r["errors"]:
+            errors = ", ".join(f"{k}: {v}" for k, v in sorted(r["errors"].items()))
+            print(f"{r['endpoint']} errors: {errors}", file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("url", nargs="?", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=100, help="size of the fleet")
+    parser.add_argument(
+        "--duration", type=float, default=30, help="seconds to run after ramp-up"
+    )
+    parser.add_argument(
+        "--ramp-up", type=float, default=5, help="seconds over which users start"
+    )
+    parser.add_argument("--alg", choices=ALGORITHMS, default="es256")
+    parser.add_argument("--origin", help="WEBAUTH_ORIGIN, if not the URL's")
+    parser.add_argument("--rp-id", help="WEBAUTH_RP_ID, if not the URL's host")
+    parser.add_argument(
+        "--think-time", type=float, default=0, help="seconds between iterations"
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    load_test = LoadTest(
+        args.url,
+        args.users,
+        args.duration,
+        ramp_up=args.ramp_up,
+        alg=ALGORITHMS[args.alg],
+        origin=args.origin,
+        rp_id=args.rp_id,
+        think_time=args.think_time,
+    )
+    results = asyncio.run(load_test.run())
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
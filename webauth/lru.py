@@ -0,0 +1,72 @@
+"""
+Thread-safe, size-bounded LRU map shared by the per-process caches: decoded
+public keys, verified certificate chains, locally stored challenges and
+throttle counts.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """
+    Keeps at most ``max_size`` entries, evicting the least recently used
+    first. Reading or writing an entry makes it the most recently used.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._set(key, value)
+
+    def update(self, key, function, default=None):
+        """
+        Replaces the value of ``key``, or ``default`` if there is none, with
+        ``function(value)`` in one step. Returns the new value.
+        """
+        with self._lock:
+            value = function(self._entries.pop(key, default))
+            self._set(key, value)
+            return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def discard(self, predicate):
+        """Drops every entry whose key matches ``predicate``."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def evict(self, predicate):
+        """
+        Drops least recently used entries for as long as their value matches
+        ``predicate``, e.g. because they expired.
+        """
+        with self._lock:
+            while self._entries and predicate(next(iter(self._entries.values()))):
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _set(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
@@ -0,0 +1,76 @@
+"""
+Writes every registered device to JSON Lines or CSV, e.g. for audits or for
+moving devices to another deployment with ``import_webauth_devices``.
+
+Rows are streamed from a server-side cursor where the database supports one,
+so memory use does not grow with the size of the table.
+"""
+import csv
+import json
+
+from django.core.management.base import BaseCommand
+from webauthn.helpers import bytes_to_base64url
+
+from webauth.models import WebAuthDevice
+
+FIELDS = (
+    "id",
+    "user_id",
+    "name",
+    "credential_id",
+    "user_handle",
+    "public_key",
+    "format",
+    "type",
+    "sign_count",
+    "created_at",
+)
+
+
+def export_rows(queryset, chunk_size=2000):
+    """Yields a JSON-compatible dict per device, binary columns in base64url."""
+    for values in queryset.order_by().values_list(*FIELDS).iterator(chunk_size):
+        row = dict(zip(FIELDS, values))
+        row["credential_id"] = bytes_to_base64url(bytes(row["credential_id"]))
+        row["user_handle"] = bytes_to_base64url(bytes.fromhex(row["user_handle"]))
+        row["public_key"] = bytes_to_base64url(bytes(row["public_key"]))
+        row["created_at"] = row["created_at"].isoformat()
+        yield row
+
+
+class Command(BaseCommand):
+    help = "Export all WebAuthn devices as JSON Lines or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format", choices=["jsonl", "csv"], default="jsonl", dest="fmt"
+        )
+        parser.add_argument(
+            "--output", "-o", help="file to write to instead of standard output"
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="rows fetched from the database at a time",
+        )
+        parser.add_argument("--user", type=int, help="only export this user's devices")
+
+    def handle(self, *args, fmt, output, chunk_size, user, **options):
+        queryset = WebAuthDevice.objects.replica()
+        if user is not None:
+            queryset = queryset.filter(user_id=user)
+
+        out = open(output, "w", newline="") if output else self.stdout
+        try:
+            rows = export_rows(queryset, chunk_size)
+            if fmt == "csv":
+                writer = csv.DictWriter(out, fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    out.write(json.dumps(row) + "\n")
+        finally:
+            if output:
+                out.close()
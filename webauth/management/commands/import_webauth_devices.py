@@ -0,0 +1,60 @@
+"""
+Imports credentials from a JSON Lines file; see ``webauth.importing`` for the
+format.
+"""
+import sys
+
+from django.core.management.base import BaseCommand
+
+from webauth.importing import import_devices
+
+
+class Command(BaseCommand):
+    help = "Import WebAuthn devices from JSON Lines, e.g. from another MFA system."
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="JSON Lines file, or - for standard input")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="processes validating keys; 0 to validate in this process "
+            "(default: one per CPU)",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="file recording progress; an interrupted import started "
+            "again with the same file resumes where it stopped",
+        )
+
+    def handle(self, *args, input, batch_size, workers, checkpoint, **options):
+        self.verbosity = options["verbosity"]
+        lines = sys.stdin if input == "-" else open(input)
+        try:
+            stats = import_devices(
+                lines,
+                batch_size=batch_size,
+                workers=workers,
+                checkpoint=checkpoint,
+                progress=self.report,
+            )
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+
+        for line_number, error in sorted(stats.errors):
+            self.stderr.write(f"line {line_number}: {error}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {stats.imported} devices; {stats.existing} already "
+                f"existed, {stats.failed} failed."
+            )
+        )
+
+    def report(self, stats):
+        if self.verbosity >= 1:
+            self.stdout.write(
+                f"{stats.lines} lines: {stats.imported} imported, "
+                f"{stats.existing} existing, {stats.failed} failed "
+                f"({stats.rate:.0f} lines/s)"
+            )
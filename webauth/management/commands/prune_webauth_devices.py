@@ -0,0 +1,38 @@
+"""
+Revokes devices nobody has used for a while, so forgotten or lost
+authenticators stop being able to verify.
+
+Devices are selected and deleted in batches of primary keys; see
+``WebAuthDeviceQuerySet.revoke``.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from webauth.models import WebAuthDevice
+
+
+class Command(BaseCommand):
+    help = "Revoke WebAuthn devices unused for a number of days."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            help="revoke devices unused for this many days "
+            "(default: WEBAUTH_STALE_DEVICE_DAYS)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="only count the devices that would be revoked",
+        )
+
+    def handle(self, *args, days, dry_run, **options):
+        if days is not None and days < 1:
+            raise CommandError("--days must be at least 1.")
+        stale = WebAuthDevice.objects.stale(days)
+        if dry_run:
+            count = stale.count()
+            self.stdout.write(f"{count} devices would be revoked.")
+            return
+        count = stale.revoke()
+        self.stdout.write(self.style.SUCCESS(f"Revoked {count} devices."))
@@ -0,0 +1,123 @@
+"""
+Instrumentation of the registration, verification and login ceremonies.
+
+The ceremony views time each stage of a ceremony (``challenge_issue``,
+``challenge_load``, ``device_fetch``, ``verify``, ``sign_count_write``,
+``device_create``) and count how each ceremony ended (``success``,
+``bad_challenge``, ``unknown_device``, ``invalid``, ``too_large``,
+``throttled``, ``inactive``, ``conflict``, ``duplicate``, ``untrusted``,
+``busy``).
+They report to the backend named by ``WEBAUTH_METRICS``.
+
+The default backend, ``Metrics``, discards everything. ``PrometheusMetrics``
+aggregates in the current process and renders the Prometheus text format,
+which ``webauth.views.export_metrics`` serves. Subclass ``Metrics`` to forward
+the numbers elsewhere, e.g. to StatsD.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import lru_cache
+from threading import Lock
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class Metrics:
+    """Metrics backend that records nothing."""
+
+    def observe(self, ceremony: str, stage: str, seconds: float):
+        """Record that ``stage`` of a ``ceremony`` took ``seconds``."""
+
+    def increment(self, ceremony: str, outcome: str):
+        """Count a ``ceremony`` that ended with ``outcome``."""
+
+    @contextmanager
+    def timer(self, ceremony: str, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(ceremony, stage, time.perf_counter() - started)
+
+
+class PrometheusMetrics(Metrics):
+    """
+    Keeps stage histograms and outcome counters in memory. Each process
+    exports its own numbers.
+    """
+
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self, buckets=None):
+        if buckets is not None:
+            self.buckets = tuple(sorted(buckets))
+        self._histograms = {}
+        self._counters = {}
+        self._lock = Lock()
+
+    def observe(self, ceremony, stage, seconds):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get((ceremony, stage))
+            if histogram is None:
+                histogram = self._histograms[(ceremony, stage)] = {
+                    "buckets": [0] * (len(self.buckets) + 1),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            histogram["buckets"][index] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def increment(self, ceremony, outcome):
+        with self._lock:
+            key = (ceremony, outcome)
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def render(self) -> str:
+        """The collected metrics in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {
+                key: dict(value, buckets=list(value["buckets"]))
+                for key, value in self._histograms.items()
+            }
+            counters = dict(self._counters)
+
+        lines = [
+            "# HELP webauth_stage_seconds Time spent in each stage of a ceremony.",
+            "# TYPE webauth_stage_seconds histogram",
+        ]
+        for (ceremony, stage), histogram in sorted(histograms.items()):
+            labels = f'ceremony="{ceremony}",stage="{stage}"'
+            cumulative = 0
+            for bound, count in zip(
+                self.buckets + (float("inf"),), histogram["buckets"]
+            ):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f'webauth_stage_seconds_bucket{{{labels},le="{le}"}} {cumulative}'
+                )
+            lines.append(f"webauth_stage_seconds_sum{{{labels}}} {histogram['sum']}")
+            lines.append(
+                f"webauth_stage_seconds_count{{{labels}}} {histogram['count']}"
+            )
+
+        lines += [
+            "# HELP webauth_ceremonies_total Completed ceremonies by outcome.",
+            "# TYPE webauth_ceremonies_total counter",
+        ]
+        for (ceremony, outcome), count in sorted(counters.items()):
+            lines.append(
+                f'webauth_ceremonies_total{{ceremony="{ceremony}",'
+                f'outcome="{outcome}"}} {count}'
+            )
+        return "\n".join(lines) + "\n"
+
+
+@lru_cache(maxsize=None)
+def get_metrics() -> Metrics:
+    backend = getattr(settings, "WEBAUTH_METRICS", "webauth.metrics.Metrics")
+    return import_string(backend)()
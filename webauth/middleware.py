@@ -0,0 +1,109 @@
+"""
+Site-wide enforcement of Web Authentication, as an alternative to decorating
+every view with ``@webauth_required``.
+
+Add ``webauth.middleware.WebAuthRequiredMiddleware`` to ``MIDDLEWARE`` after
+``AuthenticationMiddleware``. Paths matching ``WEBAUTH_REQUIRED_PATHS`` (every
+path by default) then require a verified session, unless they also match
+``WEBAUTH_EXEMPT_PATHS``. The login page, the ``webauth`` views and static
+and media files are always exempt.
+
+Both settings are lists of regular expressions matched against the start of
+``request.path_info``. They are compiled into one expression each the first
+time the middleware runs, and the verify URL is resolved at the same time, so
+a request costs a regex match plus the cached verification check.
+"""
+import re
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.shortcuts import resolve_url
+from django.urls import NoReverseMatch, get_script_prefix, reverse
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import cached_property
+
+from . import REDIRECT_FIELD_NAME, auser_is_webauth_verified, user_is_webauth_verified
+
+WEBAUTH_URL_NAMES = (
+    "batch_verification",
+    "devices",
+    "forget_browsers",
+    "login",
+    "login_ceremony",
+    "registration",
+    "verify",
+    "verification",
+)
+
+
+def compile_paths(patterns):
+    """One regular expression matching any of ``patterns``, or ``None``."""
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+
+
+def _path_info(path):
+    """``path`` without the script prefix that ``reverse()`` adds."""
+    prefix = get_script_prefix()
+    if path.startswith(prefix):
+        return path[len(prefix) - 1 :]
+    return path
+
+
+class WebAuthRequiredMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        if self.is_required(request.path_info):
+            if not user_is_webauth_verified(request):
+                return self.redirect(request)
+
+    async def __acall__(self, request):
+        # Unlike MiddlewareMixin, check without a trip to a thread.
+        if self.is_required(request.path_info):
+            if not await auser_is_webauth_verified(request):
+                return self.redirect(request)
+        return await self.get_response(request)
+
+    def is_required(self, path) -> bool:
+        required, exempt = self.rules
+        if exempt is not None and exempt.match(path):
+            return False
+        return required is not None and required.match(path) is not None
+
+    @cached_property
+    def rules(self):
+        exempt = list(getattr(settings, "WEBAUTH_EXEMPT_PATHS", []))
+        for url in (settings.STATIC_URL, settings.MEDIA_URL, settings.LOGIN_URL):
+            if url:
+                url = urlparse(resolve_url(url))
+                path = _path_info(url.path)
+                # An unset MEDIA_URL reads as "/", or as the script prefix
+                # under FORCE_SCRIPT_NAME, which would exempt everything.
+                if not url.netloc and path.strip("/"):
+                    exempt.append(re.escape(path))
+        for name in WEBAUTH_URL_NAMES:
+            try:
+                url = reverse(f"webauth:{name}")
+            except NoReverseMatch:
+                continue
+            exempt.append(re.escape(_path_info(url)) + "$")
+        required = getattr(settings, "WEBAUTH_REQUIRED_PATHS", [""])
+        return compile_paths(required), compile_paths(exempt)
+
+    @cached_property
+    def verify_url(self):
+        url = resolve_url(settings.WEBAUTH_VERIFY_URL)
+        scheme, netloc = urlparse(url)[:2]
+        return url, scheme, netloc
+
+    def redirect(self, request):
+        url, scheme, netloc = self.verify_url
+        # Same as redirect_to_verify(), with the verify URL parsed only once.
+        if (not scheme or scheme == request.scheme) and (
+            not netloc or netloc == request.get_host()
+        ):
+            path = request.get_full_path()
+        else:
+            path = request.build_absolute_uri()
+        return redirect_to_login(path, url, REDIRECT_FIELD_NAME)
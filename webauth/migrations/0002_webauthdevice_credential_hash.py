@@ -0,0 +1,18 @@
+# Generated by Django 4.0.1 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("webauth", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="webauthdevice",
+            name="credential_hash",
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,72 @@
+import hashlib
+
+from django.db import migrations, transaction
+from django.db.models import Count, Min
+
+BATCH_SIZE = 1000
+
+
+def backfill_credential_hash(apps, schema_editor):
+    """
+    Hash the credential IDs of existing devices. Rows are updated in short
+    transactions of BATCH_SIZE rows each, walking the primary key, so no lock
+    is held on the table for the length of the backfill.
+    """
+    WebAuthDevice = apps.get_model("webauth", "WebAuthDevice")
+    db_alias = schema_editor.connection.alias
+    queryset = WebAuthDevice.objects.using(db_alias).filter(
+        credential_hash__isnull=True
+    )
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=db_alias):
+            devices = list(
+                queryset.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .only("pk", "credential_id")[:BATCH_SIZE]
+            )
+            if not devices:
+                break
+            for device in devices:
+                device.credential_hash = hashlib.sha256(
+                    bytes(device.credential_id)
+                ).hexdigest()
+            WebAuthDevice.objects.using(db_alias).bulk_update(
+                devices, ["credential_hash"]
+            )
+        last_pk = devices[-1].pk
+
+
+def remove_duplicate_credentials(apps, schema_editor):
+    """
+    Keep only the first device registered with each credential, so 0004 can
+    make the hash unique. Registration checked for an existing device before
+    saving, but two requests racing with the same credential could both pass.
+    """
+    WebAuthDevice = apps.get_model("webauth", "WebAuthDevice")
+    db_alias = schema_editor.connection.alias
+    queryset = WebAuthDevice.objects.using(db_alias)
+    duplicates = (
+        queryset.values("credential_hash")
+        .annotate(first=Min("pk"), devices=Count("pk"))
+        .filter(devices__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        with transaction.atomic(using=db_alias):
+            queryset.filter(credential_hash=duplicate["credential_hash"]).exclude(
+                pk=duplicate["first"]
+            ).delete()
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("webauth", "0002_webauthdevice_credential_hash"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_credential_hash, migrations.RunPython.noop),
+        migrations.RunPython(remove_duplicate_credentials, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.0.1 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+from webauth.operations import AddIndexConcurrently, AddUniqueConstraintConcurrently
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("webauth", "0003_backfill_credential_hash"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="webauthdevice",
+            name="credential_hash",
+            field=models.CharField(editable=False, max_length=64),
+        ),
+        AddUniqueConstraintConcurrently(
+            model_name="webauthdevice",
+            constraint=models.UniqueConstraint(
+                fields=("credential_hash",), name="webauth_device_credential_hash"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="webauthdevice",
+            index=models.Index(
+                fields=["user", "created_at"], name="webauth_device_user_created"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("webauth", "0004_credential_hash_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="webauthdevice",
+            name="user_handle",
+            field=models.CharField(editable=False, max_length=128, null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+
+
+def backfill_user_handle(apps, schema_editor):
+    """
+    Existing devices were registered with the hex encoded user id as the
+    user handle, and that is what their authenticators send back, so record
+    it as such. Rows are updated in batches as in 0003.
+    """
+    WebAuthDevice = apps.get_model("webauth", "WebAuthDevice")
+    db_alias = schema_editor.connection.alias
+    queryset = WebAuthDevice.objects.using(db_alias).filter(user_handle__isnull=True)
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=db_alias):
+            devices = list(
+                queryset.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .only("pk", "user_id")[:BATCH_SIZE]
+            )
+            if not devices:
+                break
+            for device in devices:
+                hex_id = f"{device.user_id:x}"
+                if len(hex_id) % 2 == 1:
+                    hex_id = f"0{hex_id}"
+                device.user_handle = hex_id
+            WebAuthDevice.objects.using(db_alias).bulk_update(devices, ["user_handle"])
+        last_pk = devices[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("webauth", "0005_webauthdevice_user_handle"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_user_handle, migrations.RunPython.noop),
+    ]
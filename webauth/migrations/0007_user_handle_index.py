@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+from webauth.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("webauth", "0006_backfill_user_handle"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="webauthdevice",
+            name="user_handle",
+            field=models.CharField(editable=False, max_length=128),
+        ),
+        AddIndexConcurrently(
+            model_name="webauthdevice",
+            index=models.Index(
+                fields=["user_handle"], name="webauth_device_user_handle"
+            ),
+        ),
+    ]
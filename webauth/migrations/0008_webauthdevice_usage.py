@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("webauth", "0007_user_handle_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="webauthdevice",
+            name="last_used_at",
+            field=models.DateTimeField(
+                blank=True, db_index=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="webauthdevice",
+            name="use_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("webauth", "0009_trustgeneration"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="webauthdevice",
+            name="format",
+            field=models.CharField(
+                help_text="generated by the client authenticator to identify this key",
+                max_length=250,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="webauthdevice",
+            name="name",
+            field=models.CharField(
+                help_text="nickname to help the user identify a given key",
+                max_length=250,
+            ),
+        ),
+    ]
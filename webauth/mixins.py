@@ -1,15 +1,38 @@
 from django.contrib.auth.mixins import AccessMixin
 from django.conf import settings
 
-from . import user_is_webauth_verified
+from . import aget_user, auser_is_webauth_verified, user_is_webauth_verified
 
 
 class WebAuthRequiredMixin(AccessMixin):
     """Verify the user passed BOTH authentication factors (password and Web
-    Authentication)."""
+    Authentication), within the last ``webauth_max_age`` seconds if set."""
     login_url = settings.WEBAUTH_VERIFY_URL
+    webauth_max_age = None
 
     def dispatch(self, request, *args, **kwargs):
-        if not user_is_webauth_verified(request):
+        if not user_is_webauth_verified(request, self.webauth_max_age):
             return self.handle_no_permission()
         return super().dispatch(request, *args, **kwargs)
+
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    """Verify that the current user is authenticated, for async views."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncWebAuthRequiredMixin(AccessMixin):
+    """Verify the user passed BOTH authentication factors (password and Web
+    Authentication), for async views."""
+    login_url = settings.WEBAUTH_VERIFY_URL
+    webauth_max_age = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        if not await auser_is_webauth_verified(request, self.webauth_max_age):
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
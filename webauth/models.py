@@ -1,7 +1,177 @@
+import hashlib
+from datetime import timedelta
+
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
 from django.utils.translation import gettext_lazy as _
 
+from .routers import read_database
+
+REVOKE_BATCH_SIZE = 1000
+
+
+def hash_credential_id(credential_id) -> str:
+    """
+    Fixed-length digest of a credential ID. Credential IDs are stored as
+    binary, which cannot be indexed portably, so lookups go through this hash.
+    """
+    return hashlib.sha256(bytes(credential_id)).hexdigest()
+
+
+def user_handle(user_id) -> str:
+    """
+    The WebAuthn user handle of a user, hex encoded. It is derived from the
+    primary key with ``SECRET_KEY``, so it is stable without revealing the
+    key to authenticators.
+    """
+    return salted_hmac(
+        "webauth.user_handle", str(user_id), algorithm="sha256"
+    ).hexdigest()
+
+
+class WebAuthDeviceQuerySet(models.QuerySet):
+    def replica(self, request=None):
+        """
+        These devices, read from a replica when ``WEBAUTH_REPLICAS`` are
+        configured and the session of ``request`` is not pinned to the
+        primary. Only for lookups that can tolerate replication lag.
+        """
+        return self.using(read_database(request))
+
+    def advance_sign_count(self, pk, sign_count) -> bool:
+        """
+        Moves the sign count of device ``pk`` forward to ``sign_count`` with a
+        single conditional UPDATE. Returns False if the stored count is
+        already at or beyond it, which means another assertion from the same
+        credential got there first: a replay, or a cloned authenticator.
+        """
+        if sign_count == 0:
+            # Authenticators without a counter always report zero.
+            return True
+        updated = self.filter(pk=pk, sign_count__lt=sign_count).update(
+            sign_count=sign_count
+        )
+        return updated == 1
+
+    async def aadvance_sign_count(self, pk, sign_count) -> bool:
+        if sign_count == 0:
+            return True
+        updated = await self.filter(pk=pk, sign_count__lt=sign_count).aupdate(
+            sign_count=sign_count
+        )
+        return updated == 1
+
+    def advance_sign_counts(self, sign_counts) -> set:
+        """
+        Moves several devices forward at once; ``sign_counts`` maps device
+        primary keys to their new counts. The rows are locked and checked in
+        one query and written in one UPDATE. Returns the primary keys whose
+        count advanced (or that have no counter), like ``advance_sign_count``.
+        """
+        advanced = {pk for pk, count in sign_counts.items() if count == 0}
+        counters = {pk: count for pk, count in sign_counts.items() if count != 0}
+        if not counters:
+            return advanced
+        with transaction.atomic(using=self.db):
+            current = dict(
+                self.select_for_update()
+                .filter(pk__in=counters)
+                .values_list("pk", "sign_count")
+            )
+            moving = {
+                pk: count
+                for pk, count in counters.items()
+                if pk in current and current[pk] < count
+            }
+            if moving:
+                self.filter(pk__in=moving).update(
+                    sign_count=models.Case(
+                        *(
+                            models.When(pk=pk, then=models.Value(count))
+                            for pk, count in moving.items()
+                        ),
+                        default=models.F("sign_count"),
+                        output_field=models.PositiveIntegerField(),
+                    )
+                )
+        return advanced | set(moving)
+
+    def record_usage(self, usage) -> int:
+        """
+        Adds buffered uses to the devices in one UPDATE; ``usage`` maps
+        device primary keys to ``(uses, last used at)``. ``last_used_at``
+        only ever moves forward, so flushes from several processes can land
+        in any order. Returns the number of devices updated.
+        """
+        if not usage:
+            return 0
+        return self.filter(pk__in=usage).update(
+            use_count=models.F("use_count")
+            + models.Case(
+                *(
+                    models.When(pk=pk, then=models.Value(uses))
+                    for pk, (uses, last_used_at) in usage.items()
+                ),
+                default=models.Value(0),
+                output_field=models.PositiveIntegerField(),
+            ),
+            last_used_at=models.Case(
+                *(
+                    models.When(
+                        models.Q(pk=pk)
+                        & (
+                            models.Q(last_used_at__isnull=True)
+                            | models.Q(last_used_at__lt=last_used_at)
+                        ),
+                        then=models.Value(last_used_at),
+                    )
+                    for pk, (uses, last_used_at) in usage.items()
+                ),
+                default=models.F("last_used_at"),
+                output_field=models.DateTimeField(),
+            ),
+        )
+
+    def unused_since(self, when):
+        """
+        Devices last used before ``when``, or never used and registered
+        before it.
+        """
+        return self.filter(
+            models.Q(last_used_at__lt=when)
+            | models.Q(last_used_at__isnull=True, created_at__lt=when)
+        )
+
+    def stale(self, days=None):
+        """
+        Devices unused for ``days`` days, by default
+        ``WEBAUTH_STALE_DEVICE_DAYS``.
+        """
+        if days is None:
+            days = getattr(settings, "WEBAUTH_STALE_DEVICE_DAYS", 365)
+        return self.unused_since(timezone.now() - timedelta(days=days))
+
+    def revoke(self) -> int:
+        """
+        Deletes these devices ``REVOKE_BATCH_SIZE`` at a time, walking the
+        primary key, so they are never all loaded at once. Each batch goes
+        through ``delete()``, so ``pre_delete`` and ``post_delete`` are sent
+        for every device and sessions verified with them stop being verified.
+        Returns the number of devices deleted.
+        """
+        pks = self.order_by("pk").values_list("pk", flat=True)
+        deleted = 0
+        last_pk = None
+        while True:
+            batch = pks if last_pk is None else pks.filter(pk__gt=last_pk)
+            batch = list(batch[:REVOKE_BATCH_SIZE])
+            if not batch:
+                return deleted
+            deleted += self.filter(pk__in=batch).delete()[0]
+            last_pk = batch[-1]
+
 
 class WebAuthDevice(models.Model):
     """
@@ -19,6 +189,8 @@ class WebAuthDevice(models.Model):
         help_text=_("nickname to help the user identify a given key"),
     )
     credential_id = models.BinaryField(max_length=128)
+    credential_hash = models.CharField(max_length=64, editable=False)
+    user_handle = models.CharField(max_length=128, editable=False)
     public_key = models.BinaryField(max_length=256)
     format = models.CharField(
         max_length=250,
@@ -27,3 +199,43 @@ class WebAuthDevice(models.Model):
     type = models.CharField(max_length=250)
     sign_count = models.PositiveIntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(
+        null=True, blank=True, db_index=True, editable=False
+    )
+    use_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = WebAuthDeviceQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "created_at"], name="webauth_device_user_created"
+            ),
+            models.Index(fields=["user_handle"], name="webauth_device_user_handle"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["credential_hash"], name="webauth_device_credential_hash"
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.credential_hash = hash_credential_id(self.credential_id)
+        if not self.user_handle:
+            self.user_handle = user_handle(self.user_id)
+        super().save(*args, **kwargs)
+
+
+class TrustGeneration(models.Model):
+    """
+    Per-user counter embedded in trusted-browser cookies. Moving it on
+    invalidates every cookie issued to the user before.
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="webauth_trust_generation",
+    )
+    generation = models.PositiveIntegerField(default=0)
@@ -0,0 +1,71 @@
+"""
+Migration operations that build indexes without blocking writes.
+
+On PostgreSQL these build the index ``CONCURRENTLY``, so registrations and
+sign count updates carry on while it is built on a large device table. This
+cannot run in a transaction, so migrations using them set ``atomic = False``.
+Other databases build the index as ``AddIndex`` and ``AddConstraint`` do.
+"""
+from django.db import NotSupportedError, migrations
+
+
+def _concurrently(schema_editor) -> bool:
+    if schema_editor.connection.vendor != "postgresql":
+        return False
+    if schema_editor.connection.in_atomic_block:
+        raise NotSupportedError(
+            "Indexes cannot be built concurrently inside a transaction. "
+            "Define atomic = False in the Migration class."
+        )
+    return True
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    """``AddIndex`` using ``CREATE INDEX CONCURRENTLY`` on PostgreSQL."""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if _concurrently(schema_editor):
+            schema_editor.add_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if _concurrently(schema_editor):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, self.index)
+
+
+class AddUniqueConstraintConcurrently(migrations.AddConstraint):
+    """
+    ``AddConstraint`` for a plain ``UniqueConstraint``. On PostgreSQL the
+    unique index is built concurrently first and the constraint then takes it
+    over, which only needs a brief lock.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if not _concurrently(schema_editor):
+            schema_editor.add_constraint(model, self.constraint)
+            return
+        quote_name = schema_editor.quote_name
+        table = quote_name(model._meta.db_table)
+        name = quote_name(self.constraint.name)
+        columns = ", ".join(
+            quote_name(model._meta.get_field(field).column)
+            for field in self.constraint.fields
+        )
+        schema_editor.execute(
+            f"CREATE UNIQUE INDEX CONCURRENTLY {name} ON {table} ({columns})"
+        )
+        schema_editor.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}"
+        )
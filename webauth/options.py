@@ -0,0 +1,179 @@
+"""
+Building blocks of the options sent to the browser at the start of a ceremony.
+
+The ``allowCredentials`` list of a user is serialized once and kept in the
+``WEBAUTH_CACHE`` cache until one of their devices is saved or deleted, or
+for ``WEBAUTH_CACHE_TIMEOUT`` seconds at most, so ``Verification.get`` costs
+a cache hit rather than a query plus encoding every credential. The same
+list is sent as ``excludeCredentials`` when registering.
+
+The parts of the registration options that only depend on settings (the
+relying party, ``WEBAUTH_ALGORITHMS`` and the authenticator selection) are
+serialized once, the first time they are needed. The ``webauth.E001`` and
+``webauth.E002`` system checks report missing or unusable settings at startup
+instead.
+"""
+import hashlib
+import json
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from webauthn.helpers.cose import COSEAlgorithmIdentifier
+
+from .challenges import get_timeout
+from .routers import cache_timeout, read_database
+from .state import get_cache
+
+
+def get_transports():
+    return getattr(settings, "WEBAUTH_TRANSPORTS", ["usb", "ble", "nfc"])
+
+
+@lru_cache(maxsize=None)
+def _fragment_version(transports) -> str:
+    # Changing WEBAUTH_TRANSPORTS must not serve fragments cached before.
+    return hashlib.sha256(json.dumps(transports).encode()).hexdigest()[:8]
+
+
+def _credentials_key(user_id) -> str:
+    version = _fragment_version(tuple(get_transports()))
+    return f"webauth:user:{user_id}:credentials:{version}"
+
+
+def _credentials_fragment(user_id, database) -> str:
+    from .models import WebAuthDevice
+
+    credential_ids = (
+        WebAuthDevice.objects.using(database)
+        .filter(user_id=user_id)
+        .values_list("credential_id", flat=True)
+    )
+    transports = get_transports()
+    return json.dumps(
+        [
+            {
+                "id": bytes(credential_id).hex(),
+                "type": "public-key",
+                "transports": transports,
+            }
+            for credential_id in credential_ids
+        ]
+    )
+
+
+def allow_credentials(user_id, request=None) -> str:
+    """
+    JSON array describing every credential registered to ``user_id``. On a
+    cache miss the devices are read from the database ``request`` may read
+    from.
+    """
+    cache = get_cache()
+    key = _credentials_key(user_id)
+    fragment = cache.get(key)
+    if fragment is None:
+        database = read_database(request)
+        fragment = _credentials_fragment(user_id, database)
+        cache.set(key, fragment, cache_timeout(database))
+    return fragment
+
+
+async def aallow_credentials(user_id, request=None) -> str:
+    cache = get_cache()
+    key = _credentials_key(user_id)
+    fragment = await cache.aget(key)
+    if fragment is None:
+        database = read_database(request)
+        fragment = await sync_to_async(_credentials_fragment)(user_id, database)
+        await cache.aset(key, fragment, cache_timeout(database))
+    return fragment
+
+
+def forget_credentials(user_ids):
+    get_cache().delete_many([_credentials_key(user_id) for user_id in user_ids])
+
+
+@lru_cache(maxsize=None)
+def get_algorithms() -> tuple:
+    """
+    The public key algorithms offered to authenticators, in order of
+    preference. ``WEBAUTH_ALGORITHMS`` lists their COSE identifiers.
+    """
+    algorithms = getattr(settings, "WEBAUTH_ALGORITHMS", [-8, -7, -257])
+    try:
+        return tuple(COSEAlgorithmIdentifier(alg) for alg in algorithms)
+    except ValueError as e:
+        raise ImproperlyConfigured(f"Unsupported WEBAUTH_ALGORITHMS entry: {e}")
+
+
+@lru_cache(maxsize=None)
+def registration_fragment() -> str:
+    """The members of the registration ``publicKey`` options fixed by settings."""
+    fragment = json.dumps(
+        {
+            "rp": {"id": settings.WEBAUTH_RP_ID, "name": settings.WEBAUTH_RP_NAME},
+            "pubKeyCredParams": [
+                {"type": "public-key", "alg": alg} for alg in get_algorithms()
+            ],
+            "authenticatorSelection": {
+                # Discoverable credentials can also be used to log in.
+                "residentKey": "preferred",
+                "userVerification": "preferred",
+            },
+            "attestation": "direct",
+        }
+    )
+    return fragment[1:-1]
+
+
+def registration_options(ceremony_id, challenge, user, credentials) -> str:
+    """
+    JSON options for ``navigator.credentials.create()``; ``credentials`` is
+    the already serialized list of the user's credentials, which the
+    authenticator is asked not to register again.
+    """
+    from .models import user_handle
+
+    user_entity = {
+        "id": user_handle(user.pk),
+        "name": user.email,
+        "displayName": user.get_full_name() or user.get_username(),
+    }
+    return (
+        '{"ceremony": %s, "publicKey": {%s, "user": %s, '
+        '"excludeCredentials": %s, "timeout": %d, "challenge": %s}}'
+        % (
+            json.dumps(ceremony_id),
+            registration_fragment(),
+            json.dumps(user_entity),
+            credentials,
+            get_timeout(),
+            json.dumps(challenge),
+        )
+    )
+
+
+def login_options(ceremony_id, challenge) -> str:
+    """
+    JSON options for a passwordless login. Without ``allowCredentials`` the
+    authenticator offers its discoverable credentials for this site, and user
+    verification takes the place of the password.
+    """
+    return (
+        '{"ceremony": %s, "publicKey": {"challenge": %s, "allowCredentials": [], '
+        '"userVerification": "required", "timeout": %d}}'
+        % (json.dumps(ceremony_id), json.dumps(challenge), get_timeout())
+    )
+
+
+def verification_options(ceremony_id, challenge, credentials) -> str:
+    """
+    JSON options for ``navigator.credentials.get()``; ``credentials`` is the
+    already serialized ``allowCredentials`` array.
+    """
+    return (
+        '{"ceremony": %s, "publicKey": {"challenge": %s, '
+        '"allowCredentials": %s, "timeout": %d}}'
+        % (json.dumps(ceremony_id), json.dumps(challenge), credentials, get_timeout())
+    )
@@ -0,0 +1,109 @@
+"""
+JSON in and out of the ceremony views.
+
+Request bodies are checked against ``WEBAUTH_MAX_REQUEST_SIZE`` before they
+are read, then parsed once, straight from bytes. The ``webauthn`` credential
+structs are built from the parsed data rather than by serializing it again for
+``parse_raw``.
+
+Set ``WEBAUTH_JSON_BACKEND = "orjson"`` to parse and encode with orjson when
+it is installed; the standard library's ``json`` is used otherwise.
+"""
+import json
+
+from django.conf import settings
+from django.http import HttpResponse
+from webauthn.helpers import base64url_to_bytes
+from webauthn.helpers.structs import (
+    AuthenticationCredential,
+    AuthenticatorAssertionResponse,
+    AuthenticatorAttestationResponse,
+    RegistrationCredential,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class RequestTooLarge(Exception):
+    """The request body exceeds ``WEBAUTH_MAX_REQUEST_SIZE``."""
+
+
+def get_max_request_size() -> int:
+    return getattr(settings, "WEBAUTH_MAX_REQUEST_SIZE", 65536)
+
+
+def _orjson():
+    if getattr(settings, "WEBAUTH_JSON_BACKEND", "json") == "orjson":
+        return orjson
+    return None
+
+
+def loads(data):
+    backend = _orjson()
+    if backend is not None:
+        return backend.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> bytes:
+    backend = _orjson()
+    if backend is not None:
+        return backend.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def json_response(data, status=200) -> HttpResponse:
+    """Like ``JsonResponse``, but encoded with the configured backend."""
+    return HttpResponse(dumps(data), status=status, content_type="application/json")
+
+
+def read_json(request):
+    """
+    Parses the body of ``request``. Raises ``RequestTooLarge`` before reading
+    an oversized body, and ``ValueError`` if it is not JSON.
+    """
+    limit = get_max_request_size()
+    try:
+        declared = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        declared = 0
+    if declared > limit:
+        raise RequestTooLarge()
+    body = request.body
+    if len(body) > limit:
+        raise RequestTooLarge()
+    return loads(body)
+
+
+def registration_credential(data: dict) -> RegistrationCredential:
+    """``RegistrationCredential.parse_raw`` for already parsed JSON."""
+    response = data["response"]
+    return RegistrationCredential(
+        id=data["id"],
+        raw_id=base64url_to_bytes(data["rawId"]),
+        response=AuthenticatorAttestationResponse(
+            attestation_object=base64url_to_bytes(response["attestationObject"]),
+            client_data_json=base64url_to_bytes(response["clientDataJSON"]),
+        ),
+    )
+
+
+def authentication_credential(data: dict) -> AuthenticationCredential:
+    """``AuthenticationCredential.parse_raw`` for already parsed JSON."""
+    response = data["response"]
+    user_handle = response.get("userHandle")
+    return AuthenticationCredential(
+        id=data["id"],
+        raw_id=base64url_to_bytes(data["rawId"]),
+        response=AuthenticatorAssertionResponse(
+            client_data_json=base64url_to_bytes(response["clientDataJSON"]),
+            authenticator_data=base64url_to_bytes(response["authenticatorData"]),
+            signature=base64url_to_bytes(response["signature"]),
+            user_handle=None
+            if user_handle is None
+            else base64url_to_bytes(user_handle),
+        ),
+    )
@@ -0,0 +1,99 @@
+"""
+Database routing for Web Authentication devices.
+
+Add ``webauth.routers.WebAuthRouter`` to ``DATABASE_ROUTERS`` to keep the
+device table on ``WEBAUTH_DATABASE``. Everything done through the default
+manager, including writing sign counts, goes to that database.
+
+Lookups that can tolerate replication lag opt in to ``WEBAUTH_REPLICAS``
+through ``WebAuthDevice.objects.replica(request)``: the ``allowCredentials``
+list, the verification check of protected views and finding the device an
+assertion names. A session that has just registered a device is pinned to
+the primary for ``WEBAUTH_REPLICA_LAG`` seconds, so the new credential is
+never missing from its own lookups. Anything read from a replica is cached
+for no longer than that either, and nothing is cached for longer than
+``WEBAUTH_CACHE_TIMEOUT`` seconds.
+"""
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PINNED_SESSION_KEY = "webauth_primary_until"
+
+
+def get_database() -> str:
+    return getattr(settings, "WEBAUTH_DATABASE", DEFAULT_DB_ALIAS)
+
+
+def get_replicas() -> list:
+    return getattr(settings, "WEBAUTH_REPLICAS", [])
+
+
+def get_replica_lag() -> int:
+    return getattr(settings, "WEBAUTH_REPLICA_LAG", 10)
+
+
+def get_cache_timeout() -> int:
+    return getattr(settings, "WEBAUTH_CACHE_TIMEOUT", 300)
+
+
+def pin_to_primary(request):
+    """Read this session's devices from the primary until replicas catch up."""
+    if get_replicas():
+        request.session[PINNED_SESSION_KEY] = int(time.time()) + get_replica_lag()
+
+
+def read_database(request=None) -> str:
+    """
+    The database to look devices up in for ``request``: a replica, unless
+    there are none or the session is pinned to the primary.
+    """
+    replicas = get_replicas()
+    if not replicas:
+        return get_database()
+    if request is not None:
+        pinned_until = request.session.get(PINNED_SESSION_KEY)
+        if pinned_until is not None and pinned_until > time.time():
+            return get_database()
+    return random.choice(replicas)
+
+
+def cache_timeout(database):
+    """
+    How long a value read from ``database`` may be cached. The primary
+    invalidates the cache on every write, but a process with its own cache
+    never hears about writes made by the others, so even those values expire
+    after ``WEBAUTH_CACHE_TIMEOUT`` seconds.
+    """
+    if database == get_database():
+        return get_cache_timeout()
+    return min(get_cache_timeout(), get_replica_lag())
+
+
+class WebAuthRouter:
+    """Routes the ``webauth`` app to ``WEBAUTH_DATABASE``."""
+
+    app_label = "webauth"
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return get_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return get_database()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Devices only relate to users, which Django's own checks cover.
+        if self.app_label in (obj1._meta.app_label, obj2._meta.app_label):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == self.app_label:
+            return db == get_database()
+        return None
@@ -0,0 +1,46 @@
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import options, state
+from .attestation import get_allowed_aaguids, get_metadata, verified_chains
+from .challenges import get_challenge_store
+from .executor import get_executor
+from .keys import public_keys
+from .metrics import get_metrics
+from .models import WebAuthDevice
+from .throttling import get_throttle_store
+
+
+@receiver(post_save, sender=WebAuthDevice)
+def device_saved(sender, instance, **kwargs):
+    state.cache_device(instance)
+    options.forget_credentials([instance.user_id])
+
+
+@receiver(post_delete, sender=WebAuthDevice)
+def device_deleted(sender, instance, **kwargs):
+    state.forget_devices([instance.pk])
+    public_keys.forget([instance.pk])
+    options.forget_credentials([instance.user_id])
+
+
+@receiver(setting_changed)
+def webauth_setting_changed(setting, **kwargs):
+    if setting.startswith("WEBAUTH_CHALLENGE_STORE"):
+        get_challenge_store.cache_clear()
+    elif setting == "WEBAUTH_VERIFICATION_EXECUTOR":
+        get_executor.cache_clear()
+    elif setting == "WEBAUTH_METRICS":
+        get_metrics.cache_clear()
+    elif setting.startswith("WEBAUTH_THROTTLE_STORE"):
+        get_throttle_store.cache_clear()
+    elif setting in ("WEBAUTH_ALGORITHMS", "WEBAUTH_RP_ID", "WEBAUTH_RP_NAME"):
+        options.get_algorithms.cache_clear()
+        options.registration_fragment.cache_clear()
+    elif setting.startswith("WEBAUTH_MDS_"):
+        get_metadata.cache_clear()
+        get_allowed_aaguids.cache_clear()
+        verified_chains.clear()
+    elif setting == "WEBAUTH_ALLOWED_AAGUIDS":
+        get_allowed_aaguids.cache_clear()
@@ -0,0 +1,214 @@
+"""
+Web Authentication verification state.
+
+A successful ceremony leaves a signed stamp in the session naming the verified
+device, the revision of its credential and the time of verification. Checking
+the stamp only needs the device's current revision, which is kept in Django's
+cache and refreshed whenever a device is saved or deleted, so protected
+requests are normally served without a database query.
+"""
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+
+from .routers import (
+    cache_timeout,
+    get_cache_timeout,
+    get_replica_lag,
+    get_replicas,
+    read_database,
+)
+
+SESSION_KEY = "webauth_verification"
+LEGACY_SESSION_KEY = "webauth_device_id"
+
+_SALT = "webauth.state"
+_REQUEST_ATTR = "_webauth_verification"
+_UNSET = object()
+
+
+def get_cache():
+    return caches[getattr(settings, "WEBAUTH_CACHE", "default")]
+
+
+def credential_revision(credential_id, public_key) -> str:
+    """
+    Short digest identifying the credential material of a device. It changes
+    whenever the credential is replaced, but not when the sign count moves.
+    """
+    digest = hashlib.sha256(bytes(credential_id) + bytes(public_key))
+    return digest.hexdigest()[:16]
+
+
+def _revision_key(device_id) -> str:
+    return f"webauth:device:{device_id}:revision"
+
+
+def cache_device(device, timeout=None):
+    """
+    Record the current revision of a device in the cache, for
+    ``WEBAUTH_CACHE_TIMEOUT`` seconds unless ``timeout`` says otherwise.
+    """
+    if timeout is None:
+        timeout = get_cache_timeout()
+    get_cache().set(
+        _revision_key(device.pk),
+        (
+            str(device.user_id),
+            credential_revision(device.credential_id, device.public_key),
+        ),
+        timeout,
+    )
+
+
+def forget_devices(device_ids):
+    """Drop cached revisions so stamps naming these devices stop validating."""
+    keys = [_revision_key(device_id) for device_id in device_ids]
+    if get_replicas():
+        # A replica may still have the devices; remember they are gone until
+        # it has caught up, rather than let a cache miss read them back.
+        get_cache().set_many(dict.fromkeys(keys, ()), get_replica_lag())
+    else:
+        get_cache().delete_many(keys)
+
+
+def device_revision(device_id, request=None):
+    """
+    Returns ``(user_id, revision)`` for the device, or ``None`` if the device
+    does not exist. Only a cache miss touches the database.
+    """
+    cached = get_cache().get(_revision_key(device_id))
+    if cached is not None:
+        return tuple(cached) or None
+    database = read_database(request)
+    return _revision_of(_device_queryset(device_id, database).first(), database)
+
+
+async def adevice_revision(device_id, request=None):
+    cached = await get_cache().aget(_revision_key(device_id))
+    if cached is not None:
+        return tuple(cached) or None
+    database = read_database(request)
+    device = await _device_queryset(device_id, database).afirst()
+    return await sync_to_async(_revision_of)(device, database)
+
+
+def _device_queryset(device_id, database):
+    from .models import WebAuthDevice
+
+    return (
+        WebAuthDevice.objects.using(database)
+        .filter(id=device_id)
+        .only("id", "user_id", "credential_id", "public_key")
+    )
+
+
+def _revision_of(device, database):
+    if device is None:
+        return None
+    cache_device(device, cache_timeout(database))
+    return str(device.user_id), credential_revision(
+        device.credential_id, device.public_key
+    )
+
+
+def stamp_session(request, device):
+    """Mark the session as verified by ``device`` as of now."""
+    stamp = {
+        "u": str(device.user_id),
+        "d": device.pk,
+        "r": credential_revision(device.credential_id, device.public_key),
+        "t": int(time.time()),
+    }
+    request.session[SESSION_KEY] = signing.dumps(stamp, salt=_SALT)
+    request.session[LEGACY_SESSION_KEY] = device.pk
+    setattr(request, _REQUEST_ATTR, stamp)
+
+
+def clear_session(request):
+    request.session.pop(SESSION_KEY, None)
+    request.session.pop(LEGACY_SESSION_KEY, None)
+    setattr(request, _REQUEST_ATTR, None)
+
+
+def _session_stamp(request):
+    """
+    Returns ``(stamp, legacy_device_id)`` from the session, at most one of
+    which is set. Sessions verified before stamps existed only carry the
+    device id.
+    """
+    signed = request.session.get(SESSION_KEY)
+    if signed is None:
+        return None, request.session.get(LEGACY_SESSION_KEY)
+    try:
+        return signing.loads(signed, salt=_SALT), None
+    except signing.BadSignature:
+        return None, None
+
+
+def _checked_stamp(request, stamp, legacy_device_id, revision):
+    user_id = str(request.user.pk)
+    if revision is None or revision[0] != user_id:
+        return None
+    if stamp is None:
+        # Upgrade the legacy session once; when it was verified is unknown.
+        stamp = {"u": user_id, "d": legacy_device_id, "r": revision[1], "t": None}
+        request.session[SESSION_KEY] = signing.dumps(stamp, salt=_SALT)
+    elif stamp["u"] != user_id or stamp["r"] != revision[1]:
+        return None
+    return stamp
+
+
+def _load_stamp(request):
+    stamp, legacy_device_id = _session_stamp(request)
+    device_id = stamp["d"] if stamp else legacy_device_id
+    if device_id is None:
+        return None
+    revision = device_revision(device_id, request)
+    return _checked_stamp(request, stamp, legacy_device_id, revision)
+
+
+async def _aload_stamp(request):
+    stamp, legacy_device_id = _session_stamp(request)
+    device_id = stamp["d"] if stamp else legacy_device_id
+    if device_id is None:
+        return None
+    revision = await adevice_revision(device_id, request)
+    return _checked_stamp(request, stamp, legacy_device_id, revision)
+
+
+def is_fresh(stamp, max_age) -> bool:
+    """
+    Whether the verification ``stamp`` is at most ``max_age`` seconds old.
+    Sessions verified before stamps recorded the time never are.
+    """
+    return stamp["t"] is not None and time.time() - stamp["t"] <= max_age
+
+
+def get_verification(request):
+    """
+    Returns the verification stamp of an authenticated request, or ``None``
+    if the user has not completed Web Authentication in this session. The
+    result is memoized on the request.
+    """
+    stamp = getattr(request, _REQUEST_ATTR, _UNSET)
+    if stamp is _UNSET:
+        stamp = _load_stamp(request)
+        setattr(request, _REQUEST_ATTR, stamp)
+    return stamp
+
+
+async def aget_verification(request):
+    """
+    Async version of ``get_verification``. ``request.user`` must already be
+    resolved, e.g. by ``webauth.aget_user``.
+    """
+    stamp = getattr(request, _REQUEST_ATTR, _UNSET)
+    if stamp is _UNSET:
+        stamp = await _aload_stamp(request)
+        setattr(request, _REQUEST_ATTR, stamp)
+    return stamp
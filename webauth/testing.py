@@ -0,0 +1,181 @@
+"""
+A software authenticator for driving ceremonies without a browser or security
+key, e.g. from tests, benchmarks and load tests.
+
+    authenticator = SoftAuthenticator(origin="http://localhost:8000")
+    credential = authenticator.register(challenge)
+    assertion = authenticator.authenticate(challenge)
+
+The returned dicts have the JSON shape the built-in templates post to the
+registration and verification views. Keys are generated in memory and
+attestation is ``"none"``, unless a subclass overrides ``attest``.
+"""
+import hashlib
+import json
+import os
+import struct
+from base64 import urlsafe_b64encode
+
+import cbor2
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+ES256 = -7
+EDDSA = -8
+RS256 = -257
+
+# Authenticator data flags
+_USER_PRESENT = 0x01
+_USER_VERIFIED = 0x04
+_ATTESTED_CREDENTIAL_DATA = 0x40
+
+
+def bytes_to_base64url(data: bytes) -> str:
+    return urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+class SoftAuthenticator:
+    """
+    A single credential held in software. ``sign_count`` grows with every
+    assertion, like a real authenticator's counter.
+    """
+
+    def __init__(
+        self,
+        rp_id="localhost",
+        origin="http://localhost:8000",
+        alg=ES256,
+        user_handle=b"",
+        aaguid=bytes(16),
+    ):
+        self.rp_id = rp_id
+        self.origin = origin
+        self.alg = alg
+        self.user_handle = user_handle
+        self.aaguid = aaguid
+        self.credential_id = os.urandom(32)
+        self.sign_count = 0
+        if alg == ES256:
+            self.private_key = ec.generate_private_key(ec.SECP256R1())
+        elif alg == EDDSA:
+            self.private_key = ed25519.Ed25519PrivateKey.generate()
+        elif alg == RS256:
+            self.private_key = rsa.generate_private_key(
+                public_exponent=65537, key_size=2048
+            )
+        else:
+            raise ValueError(f"Unsupported algorithm {alg}")
+
+    def cose_public_key(self) -> bytes:
+        public_key = self.private_key.public_key()
+        if self.alg == ES256:
+            numbers = public_key.public_numbers()
+            return cbor2.dumps(
+                {
+                    1: 2,  # kty: EC2
+                    3: ES256,
+                    -1: 1,  # crv: P-256
+                    -2: numbers.x.to_bytes(32, "big"),
+                    -3: numbers.y.to_bytes(32, "big"),
+                }
+            )
+        if self.alg == EDDSA:
+            return cbor2.dumps(
+                {
+                    1: 1,  # kty: OKP
+                    3: EDDSA,
+                    -1: 6,  # crv: Ed25519
+                    -2: public_key.public_bytes(Encoding.Raw, PublicFormat.Raw),
+                }
+            )
+        numbers = public_key.public_numbers()
+        return cbor2.dumps(
+            {
+                1: 3,  # kty: RSA
+                3: RS256,
+                -1: numbers.n.to_bytes((numbers.n.bit_length() + 7) // 8, "big"),
+                -2: numbers.e.to_bytes((numbers.e.bit_length() + 7) // 8, "big"),
+            }
+        )
+
+    def register(self, challenge: bytes, user_handle: bytes = None) -> dict:
+        """
+        Answer ``navigator.credentials.create()`` for ``challenge``. Passing
+        the ``user.id`` of the options makes the credential discoverable:
+        assertions then return it as the user handle.
+        """
+        if user_handle is not None:
+            self.user_handle = user_handle
+        auth_data = (
+            self._rp_id_hash()
+            + bytes([_USER_PRESENT | _USER_VERIFIED | _ATTESTED_CREDENTIAL_DATA])
+            + struct.pack(">I", self.sign_count)
+            + self.aaguid
+            + struct.pack(">H", len(self.credential_id))
+            + self.credential_id
+            + self.cose_public_key()
+        )
+        client_data = self._client_data("webauthn.create", challenge)
+        fmt, statement = self.attest(auth_data, hashlib.sha256(client_data).digest())
+        attestation_object = cbor2.dumps(
+            {"fmt": fmt, "attStmt": statement, "authData": auth_data}
+        )
+        return {
+            "id": bytes_to_base64url(self.credential_id),
+            "rawId": bytes_to_base64url(self.credential_id),
+            "response": {
+                "attestationObject": bytes_to_base64url(attestation_object),
+                "clientDataJSON": bytes_to_base64url(client_data),
+            },
+            "type": "public-key",
+        }
+
+    def attest(self, auth_data: bytes, client_data_hash: bytes):
+        """
+        Returns the attestation format and statement of a registration,
+        ``"none"`` and an empty statement by default.
+        """
+        return "none", {}
+
+    def authenticate(self, challenge: bytes) -> dict:
+        """Answer ``navigator.credentials.get()`` for ``challenge``."""
+        self.sign_count += 1
+        auth_data = (
+            self._rp_id_hash()
+            + bytes([_USER_PRESENT | _USER_VERIFIED])
+            + struct.pack(">I", self.sign_count)
+        )
+        client_data = self._client_data("webauthn.get", challenge)
+        signature = self.sign(auth_data + hashlib.sha256(client_data).digest())
+        return {
+            "id": bytes_to_base64url(self.credential_id),
+            "rawId": bytes_to_base64url(self.credential_id),
+            "response": {
+                "authenticatorData": bytes_to_base64url(auth_data),
+                "clientDataJSON": bytes_to_base64url(client_data),
+                "signature": bytes_to_base64url(signature),
+                "userHandle": bytes_to_base64url(self.user_handle),
+            },
+            "type": "public-key",
+        }
+
+    def sign(self, data: bytes) -> bytes:
+        if self.alg == ES256:
+            return self.private_key.sign(data, ec.ECDSA(hashes.SHA256()))
+        if self.alg == EDDSA:
+            return self.private_key.sign(data)
+        return self.private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+
+    def _rp_id_hash(self) -> bytes:
+        return hashlib.sha256(self.rp_id.encode()).digest()
+
+    def _client_data(self, type_, challenge) -> bytes:
+        return json.dumps(
+            {
+                "type": type_,
+                "challenge": bytes_to_base64url(challenge),
+                "origin": self.origin,
+                "crossOrigin": False,
+            }
+        ).encode()
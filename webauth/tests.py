@@ -1,3 +1,1416 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import cbor2
+from asgiref.sync import sync_to_async
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import Encoding
+from cryptography.x509.oid import NameOID
+from django.contrib.auth import SESSION_KEY, get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_delete
+from django.http import Http404, HttpRequest, HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import clear_script_prefix, include, path, reverse, set_script_prefix
+from webauthn.helpers import decode_credential_public_key
+from webauthn.helpers.exceptions import InvalidRegistrationResponse
+
+from . import user_is_webauth_verified
+from .attestation import UntrustedAuthenticator, verified_chains, verify_registration
+from .challenges import CEREMONY_HEADER, get_challenge_store
+from .checks import check_settings, check_shared_cache
+from .decorators import awebauth_required, webauth_required
+from .executor import VerificationBusy, VerificationExecutor, get_executor
+from .importing import import_devices
+from .keys import public_keys
+from .lru import LRUCache
+from .metrics import PrometheusMetrics
+from .middleware import WebAuthRequiredMiddleware
+from .models import TrustGeneration, WebAuthDevice, hash_credential_id
+from .options import allow_credentials
+from .payloads import RequestTooLarge, orjson, read_json, registration_credential
+from .routers import (
+    PINNED_SESSION_KEY,
+    WebAuthRouter,
+    cache_timeout,
+    pin_to_primary,
+    read_database,
+)
+from .state import LEGACY_SESSION_KEY, get_cache
+from .state import SESSION_KEY as VERIFIED_SESSION_KEY
+from .testing import ES256, SoftAuthenticator, bytes_to_base64url
+from .throttling import get_throttle_store
+from .trust import get_cookie_name
+from .usage import UsageBuffer, device_usage
+from .views import export_metrics
+
+
+@override_settings(
+    WEBAUTH_RP_ID="localhost",
+    WEBAUTH_RP_NAME="Test Site",
+    WEBAUTH_ORIGIN="http://localhost:8000",
+)
+class CeremonyTestCase(TestCase):
+    """Drives the ceremony views with a ``SoftAuthenticator``."""
+
+    def setUp(self):
+        # Cached credentials, revisions and throttle counts outlive the
+        # rolled back rows they were computed from.
+        get_cache().clear()
+        get_throttle_store.cache_clear()
+        self.user = get_user_model().objects.create_user(
+            "alice", "alice@example.com", "password"
+        )
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        device_usage.clear()
+
+    def start(self, name, **params):
+        """Starts a ceremony; returns its options."""
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def finish(self, name, ceremony_id, data):
+        return self.client.post(
+            reverse(name),
+            json.dumps(data),
+            content_type="application/json",
+            headers={CEREMONY_HEADER: ceremony_id},
+        )
+
+    def register(self, authenticator, name="key"):
+        options = self.start("webauth:registration")
+        credential = authenticator.register(
+            bytes.fromhex(options["publicKey"]["challenge"]),
+            bytes.fromhex(options["publicKey"]["user"]["id"]),
+        )
+        return self.finish(
+            "webauth:registration",
+            options["ceremony"],
+            {"name": name, "pubKeyCredential": credential},
+        )
+
+    def verify(self, authenticator, **extra):
+        options = self.start("webauth:verification")
+        assertion = authenticator.authenticate(
+            bytes.fromhex(options["publicKey"]["challenge"])
+        )
+        return self.finish(
+            "webauth:verification", options["ceremony"], dict(assertion, **extra)
+        )
+
+    def is_verified(self, client=None):
+        client = client or self.client
+        request = HttpRequest()
+        request.session = client.session
+        request.user = self.user
+        request.COOKIES = {
+            name: morsel.value for name, morsel in client.cookies.items()
+        }
+        return user_is_webauth_verified(request)
+
+
+class CeremonyTests(CeremonyTestCase):
+    def test_register_and_verify(self):
+        authenticator = SoftAuthenticator()
+        self.assertEqual(self.register(authenticator).status_code, 201)
+        device = WebAuthDevice.objects.get(user=self.user)
+        self.assertEqual(bytes(device.credential_id), authenticator.credential_id)
+        self.assertFalse(self.is_verified())
+
+        self.assertEqual(self.verify(authenticator).status_code, 200)
+        self.assertTrue(self.is_verified())
+        device.refresh_from_db()
+        self.assertEqual(device.sign_count, authenticator.sign_count)
+
+    def test_register_duplicate_credential(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.assertEqual(self.register(authenticator).status_code, 409)
+        self.assertEqual(WebAuthDevice.objects.count(), 1)
+
+    def test_register_duplicate_race(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        # Another request registered the credential after this one checked.
+        with mock.patch("webauth.views.device_lookup", return_value={"pk": 0}):
+            self.assertEqual(self.register(authenticator).status_code, 409)
+        self.assertEqual(WebAuthDevice.objects.count(), 1)
+
+    def test_challenge_is_single_use(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        options = self.start("webauth:verification")
+        assertion = authenticator.authenticate(
+            bytes.fromhex(options["publicKey"]["challenge"])
+        )
+        response = self.finish("webauth:verification", options["ceremony"], assertion)
+        self.assertEqual(response.status_code, 200)
+        response = self.finish("webauth:verification", options["ceremony"], assertion)
+        self.assertEqual(response.status_code, 400)
+
+    def test_sign_count_must_advance(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.assertEqual(self.verify(authenticator).status_code, 200)
+        authenticator.sign_count -= 1
+        with self.assertLogs("webauth.views", "WARNING"):
+            self.assertEqual(self.verify(authenticator).status_code, 409)
+
+    def test_wrong_signature(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        impostor = SoftAuthenticator()
+        impostor.credential_id = authenticator.credential_id
+        self.assertEqual(self.verify(impostor).status_code, 400)
+        self.assertFalse(self.is_verified())
+
+    def test_deleting_device_ends_verification(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.verify(authenticator)
+        WebAuthDevice.objects.get(user=self.user).delete()
+        self.assertFalse(self.is_verified())
+
+
+class RegistrationOptionsTests(CeremonyTestCase):
+    def test_exclude_existing_credentials(self):
+        first, second = SoftAuthenticator(), SoftAuthenticator()
+        self.register(first)
+        self.register(second)
+        other = get_user_model().objects.create_user("bob")
+        WebAuthDevice.objects.create(
+            user=other,
+            name="key",
+            credential_id=bytes(16),
+            public_key=first.cose_public_key(),
+            format="none",
+            type="public-key",
+            sign_count=0,
+        )
+        options = self.start("webauth:registration")["publicKey"]
+        self.assertEqual(
+            sorted(bytes.fromhex(c["id"]) for c in options["excludeCredentials"]),
+            sorted([first.credential_id, second.credential_id]),
+        )
+
+    def test_algorithms(self):
+        options = self.start("webauth:registration")["publicKey"]
+        self.assertEqual(
+            options["pubKeyCredParams"],
+            [{"type": "public-key", "alg": alg} for alg in (-8, -7, -257)],
+        )
+        with self.settings(WEBAUTH_ALGORITHMS=[-7]):
+            options = self.start("webauth:registration")["publicKey"]
+        self.assertEqual(
+            options["pubKeyCredParams"], [{"type": "public-key", "alg": -7}]
+        )
+
+    @override_settings(WEBAUTH_ALGORITHMS=[-7])
+    def test_other_algorithms_are_rejected(self):
+        # SoftAuthenticator keys are ES256, so allow only RS256.
+        with self.settings(WEBAUTH_ALGORITHMS=[-257]):
+            self.assertEqual(self.register(SoftAuthenticator()).status_code, 400)
+        self.assertEqual(self.register(SoftAuthenticator()).status_code, 201)
+
+    def test_settings_check(self):
+        self.assertEqual(check_settings(None), [])
+        with self.settings(WEBAUTH_RP_NAME="", WEBAUTH_ALGORITHMS=[-7, 12345]):
+            self.assertEqual(
+                [error.id for error in check_settings(None)],
+                ["webauth.E001", "webauth.E002"],
+            )
+
+
+class AllowCredentialsTests(CeremonyTestCase):
+    def allowed(self):
+        options = self.start("webauth:verification")
+        return [
+            bytes.fromhex(credential["id"])
+            for credential in options["publicKey"]["allowCredentials"]
+        ]
+
+    def test_follows_devices(self):
+        first, second = SoftAuthenticator(), SoftAuthenticator()
+        self.assertEqual(self.allowed(), [])
+        self.register(first)
+        self.assertEqual(self.allowed(), [first.credential_id])
+        self.register(second)
+        self.assertEqual(
+            sorted(self.allowed()), sorted([first.credential_id, second.credential_id])
+        )
+        WebAuthDevice.objects.get(
+            credential_hash=hash_credential_id(first.credential_id)
+        ).delete()
+        self.assertEqual(self.allowed(), [second.credential_id])
+
+    @override_settings(WEBAUTH_CACHE_TIMEOUT=60)
+    def test_added_elsewhere_expires(self):
+        if not isinstance(get_cache(), LocMemCache):
+            self.skipTest("needs a LocMemCache to move its clock")
+        self.assertEqual(self.allowed(), [])
+        # Another process registering a device leaves this one's cache alone.
+        authenticator = SoftAuthenticator()
+        WebAuthDevice.objects.bulk_create(
+            [
+                WebAuthDevice(
+                    user=self.user,
+                    name="key",
+                    credential_id=authenticator.credential_id,
+                    credential_hash=hash_credential_id(authenticator.credential_id),
+                    user_handle="",
+                    public_key=authenticator.cose_public_key(),
+                    format="none",
+                    type="public-key",
+                    sign_count=0,
+                )
+            ]
+        )
+        self.assertEqual(self.allowed(), [])
+
+        later = time.time() + 61
+        with mock.patch(
+            "django.core.cache.backends.locmem.time", mock.Mock(time=lambda: later)
+        ):
+            self.assertEqual(self.allowed(), [authenticator.credential_id])
+
+
+@override_settings(WEBAUTH_CHALLENGE_STORE="webauth.challenges.SignedChallengeStore")
+class SignedChallengeStoreTests(CeremonyTestCase):
+    def test_replay_on_another_process(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        options = self.start("webauth:verification")
+        assertion = authenticator.authenticate(
+            bytes.fromhex(options["publicKey"]["challenge"])
+        )
+        response = self.finish("webauth:verification", options["ceremony"], assertion)
+        self.assertEqual(response.status_code, 200)
+
+        # A fresh store stands in for another worker process.
+        get_challenge_store.cache_clear()
+        response = self.finish("webauth:verification", options["ceremony"], assertion)
+        self.assertEqual(response.status_code, 400)
+
+
+class PayloadTests(CeremonyTestCase):
+    def post(self, name, body):
+        return self.client.post(reverse(name), body, content_type="application/json")
+
+    @override_settings(WEBAUTH_MAX_REQUEST_SIZE=100)
+    def test_too_large(self):
+        body = json.dumps({"name": "x" * 100})
+        for name in ["webauth:registration", "webauth:verification"]:
+            self.assertEqual(self.post(name, body).status_code, 413)
+
+    @override_settings(WEBAUTH_MAX_REQUEST_SIZE=100)
+    def test_body_longer_than_declared(self):
+        request = HttpRequest()
+        request._body = b"[" + b"0," * 50 + b"0]"
+        with self.assertRaises(RequestTooLarge):
+            read_json(request)
+
+    def test_malformed(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        for body in ["{", "[]", '{"pubKeyCredential": 1}']:
+            self.assertEqual(self.post("webauth:registration", body).status_code, 400)
+            self.assertEqual(self.post("webauth:verification", body).status_code, 400)
+
+    @override_settings(WEBAUTH_JSON_BACKEND="orjson")
+    def test_orjson_backend(self):
+        backend = mock.Mock(
+            loads=mock.Mock(wraps=json.loads),
+            dumps=mock.Mock(side_effect=lambda obj: json.dumps(obj).encode()),
+        )
+        with mock.patch("webauth.payloads.orjson", backend):
+            authenticator = SoftAuthenticator()
+            self.assertEqual(self.register(authenticator).status_code, 201)
+            self.assertEqual(self.verify(authenticator).status_code, 200)
+        self.assertEqual(backend.loads.call_count, 2)
+
+    @override_settings(WEBAUTH_JSON_BACKEND="orjson")
+    def test_orjson_missing(self):
+        with mock.patch("webauth.payloads.orjson", None):
+            authenticator = SoftAuthenticator()
+            self.assertEqual(self.register(authenticator).status_code, 201)
+            self.assertEqual(self.verify(authenticator).status_code, 200)
+
+    @skipUnless(orjson, "orjson is not installed")
+    @override_settings(WEBAUTH_JSON_BACKEND="orjson")
+    def test_orjson(self):
+        authenticator = SoftAuthenticator()
+        self.assertEqual(self.register(authenticator).status_code, 201)
+        self.assertEqual(self.verify(authenticator).status_code, 200)
+        self.assertTrue(self.is_verified())
+
+
+class RevokeTests(CeremonyTestCase):
+    def test_revoke_ends_verification(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.verify(authenticator)
+        self.assertTrue(self.is_verified())
+        self.assertEqual(WebAuthDevice.objects.filter(user=self.user).revoke(), 1)
+        self.assertFalse(self.is_verified())
+        self.assertEqual(self.verify(authenticator).status_code, 400)
+
+    def test_revoke_in_batches(self):
+        for _ in range(5):
+            self.register(SoftAuthenticator())
+        deleted = []
+        post_delete.connect(
+            lambda instance, **kwargs: deleted.append(instance.pk),
+            sender=WebAuthDevice,
+            weak=False,
+            dispatch_uid="test_revoke_in_batches",
+        )
+        self.addCleanup(
+            post_delete.disconnect,
+            sender=WebAuthDevice,
+            dispatch_uid="test_revoke_in_batches",
+        )
+        with mock.patch("webauth.models.REVOKE_BATCH_SIZE", 2):
+            self.assertEqual(WebAuthDevice.objects.revoke(), 5)
+        self.assertEqual(len(deleted), 5)
+        self.assertFalse(WebAuthDevice.objects.exists())
+
+    @override_settings(WEBAUTH_CACHE_TIMEOUT=60)
+    def test_revoke_elsewhere_expires(self):
+        if not isinstance(get_cache(), LocMemCache):
+            self.skipTest("needs a LocMemCache to move its clock")
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.verify(authenticator)
+        # Another process deleting the device leaves this one's cache alone.
+        devices = WebAuthDevice.objects.filter(user=self.user)
+        devices._raw_delete(devices.db)
+        self.assertTrue(self.is_verified())
+
+        later = time.time() + 61
+        with mock.patch(
+            "django.core.cache.backends.locmem.time", mock.Mock(time=lambda: later)
+        ):
+            self.assertFalse(self.is_verified())
+
+    def test_locmem_cache_warning(self):
+        with self.settings(
+            CACHES={
+                "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+                "shared": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+            }
+        ):
+            self.assertEqual(
+                [error.id for error in check_shared_cache(None)], ["webauth.W001"]
+            )
+            with self.settings(WEBAUTH_CACHE="shared"):
+                self.assertEqual(check_shared_cache(None), [])
+
+
+class KeyCacheTests(CeremonyTestCase):
+    def setUp(self):
+        super().setUp()
+        public_keys.clear()
+        patcher = mock.patch(
+            "webauth.keys.decode_credential_public_key",
+            wraps=decode_credential_public_key,
+        )
+        self.decode = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cache_hit(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.assertEqual(self.verify(authenticator).status_code, 200)
+        self.assertEqual(self.verify(authenticator).status_code, 200)
+        self.assertEqual(self.decode.call_count, 1)
+
+    def test_sign_count_conflict_on_cache_hit(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.verify(authenticator)
+        authenticator.sign_count -= 1
+        with self.assertLogs("webauth.views", "WARNING"):
+            self.assertEqual(self.verify(authenticator).status_code, 409)
+        self.assertEqual(self.decode.call_count, 1)
+
+    def test_deleted_device_is_forgotten(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.verify(authenticator)
+        WebAuthDevice.objects.get(user=self.user).delete()
+        self.assertEqual(len(public_keys._keys), 0)
+
+        # The same credential registered again, with another key pair.
+        replacement = SoftAuthenticator()
+        replacement.credential_id = authenticator.credential_id
+        self.assertEqual(self.register(replacement).status_code, 201)
+        self.assertEqual(self.verify(replacement).status_code, 200)
+        self.assertEqual(self.verify(authenticator).status_code, 400)
+
+    def test_new_public_key_is_decoded(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.verify(authenticator)
+        replacement = SoftAuthenticator()
+        replacement.credential_id = authenticator.credential_id
+        replacement.sign_count = authenticator.sign_count
+        device = WebAuthDevice.objects.get(user=self.user)
+        device.public_key = replacement.cose_public_key()
+        device.save()
+
+        self.assertEqual(self.verify(authenticator).status_code, 400)
+        self.assertEqual(self.verify(replacement).status_code, 200)
+        self.assertEqual(self.decode.call_count, 2)
+
+
+class LRUCacheTests(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+
+    def test_update_and_evict(self):
+        cache = LRUCache(10)
+        for key in "abc":
+            cache.update(key, lambda count: count + 1, 0)
+        cache.update("a", lambda count: count + 1, 0)
+        cache.evict(lambda count: count < 2)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.pop("a"), 2)
+
+
+@override_settings(WEBAUTH_CACHE_TIMEOUT=300, WEBAUTH_REPLICA_LAG=10)
+class RouterTests(CeremonyTestCase):
+    """Routing decisions only; nothing here queries the replica."""
+
+    def request(self):
+        request = HttpRequest()
+        request.session = self.client.session
+        return request
+
+    def test_without_replicas(self):
+        request = self.request()
+        pin_to_primary(request)
+        self.assertNotIn(PINNED_SESSION_KEY, request.session)
+        self.assertEqual(read_database(request), "default")
+        self.assertEqual(cache_timeout("default"), 300)
+
+    @override_settings(WEBAUTH_REPLICAS=["replica"])
+    def test_replicas(self):
+        self.assertEqual(read_database(), "replica")
+        self.assertEqual(read_database(self.request()), "replica")
+        self.assertEqual(WebAuthDevice.objects.replica(self.request()).db, "replica")
+        self.assertEqual(WebAuthDevice.objects.all().db, "default")
+        self.assertEqual(cache_timeout("default"), 300)
+        self.assertEqual(cache_timeout("replica"), 10)
+        with self.settings(WEBAUTH_CACHE_TIMEOUT=5):
+            self.assertEqual(cache_timeout("replica"), 5)
+
+    def test_registration_pins_to_primary(self):
+        # Cached, the excludeCredentials list is not read from the replica.
+        allow_credentials(self.user.pk)
+        with self.settings(WEBAUTH_REPLICAS=["replica"]):
+            self.assertEqual(self.register(SoftAuthenticator()).status_code, 201)
+            request = self.request()
+            self.assertEqual(read_database(request), "default")
+            self.assertEqual(WebAuthDevice.objects.replica(request).db, "default")
+
+            later = time.time() + 11
+            with mock.patch("webauth.routers.time", mock.Mock(time=lambda: later)):
+                self.assertEqual(read_database(request), "replica")
+
+    @override_settings(WEBAUTH_DATABASE="accounts")
+    def test_router(self):
+        router = WebAuthRouter()
+        user_model = get_user_model()
+        self.assertEqual(router.db_for_read(WebAuthDevice), "accounts")
+        self.assertEqual(router.db_for_write(WebAuthDevice), "accounts")
+        self.assertIsNone(router.db_for_read(user_model))
+        self.assertTrue(router.allow_migrate("accounts", "webauth"))
+        self.assertFalse(router.allow_migrate("default", "webauth"))
+        self.assertIsNone(router.allow_migrate("default", "auth"))
+        self.assertTrue(router.allow_relation(WebAuthDevice(), self.user))
+
+
+class UsageTests(CeremonyTestCase):
+    def devices(self, count):
+        for _ in range(count):
+            self.register(SoftAuthenticator())
+        return list(WebAuthDevice.objects.order_by("pk"))
+
+    def test_verification_is_recorded(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.verify(authenticator)
+        self.verify(authenticator)
+        self.assertEqual(device_usage.flush(), 1)
+        device = WebAuthDevice.objects.get(user=self.user)
+        self.assertEqual(device.use_count, 2)
+        self.assertIsNotNone(device.last_used_at)
+
+    def test_record_usage(self):
+        first, second, third = self.devices(3)
+        now = datetime.now(timezone.utc)
+        with self.assertNumQueries(1):
+            updated = WebAuthDevice.objects.record_usage(
+                {first.pk: (2, now), second.pk: (1, now - timedelta(hours=1))}
+            )
+        self.assertEqual(updated, 2)
+        # A flush from a slower process must not move last_used_at back.
+        WebAuthDevice.objects.record_usage({first.pk: (1, now - timedelta(days=1))})
+        for device in (first, second, third):
+            device.refresh_from_db()
+        self.assertEqual((first.use_count, first.last_used_at), (3, now))
+        self.assertEqual(
+            (second.use_count, second.last_used_at), (1, now - timedelta(hours=1))
+        )
+        self.assertEqual((third.use_count, third.last_used_at), (0, None))
+
+    def test_flush_in_batches(self):
+        devices = self.devices(3)
+        usage = UsageBuffer(batch_size=2)
+        self.addCleanup(usage.clear)
+        usage.record([device.pk for device in devices])
+        with self.assertNumQueries(2):
+            self.assertEqual(usage.flush(), 3)
+        self.assertEqual(
+            list(WebAuthDevice.objects.values_list("use_count", flat=True)), [1, 1, 1]
+        )
+
+    def age(self):
+        """Devices used long ago, never used, used lately and just added."""
+        used_long_ago, never_used, used_lately, new = self.devices(4)
+        now = datetime.now(timezone.utc)
+        long_ago = now - timedelta(days=400)
+        WebAuthDevice.objects.filter(pk__in=[used_long_ago.pk, never_used.pk]).update(
+            created_at=long_ago
+        )
+        WebAuthDevice.objects.filter(pk=used_long_ago.pk).update(last_used_at=long_ago)
+        WebAuthDevice.objects.filter(pk=used_lately.pk).update(
+            created_at=long_ago, last_used_at=now - timedelta(days=1)
+        )
+        return used_long_ago, never_used, used_lately, new
+
+    def test_stale(self):
+        used_long_ago, never_used, used_lately, new = self.age()
+        self.assertEqual(
+            set(WebAuthDevice.objects.stale()), {used_long_ago, never_used}
+        )
+        self.assertEqual(
+            set(WebAuthDevice.objects.stale(days=1)),
+            {used_long_ago, never_used, used_lately},
+        )
+        with self.settings(WEBAUTH_STALE_DEVICE_DAYS=500):
+            self.assertFalse(WebAuthDevice.objects.stale().exists())
+
+    def test_prune(self):
+        used_long_ago, never_used, used_lately, new = self.age()
+        out = io.StringIO()
+        call_command("prune_webauth_devices", "--dry-run", stdout=out)
+        self.assertEqual(out.getvalue(), "2 devices would be revoked.\n")
+        self.assertEqual(WebAuthDevice.objects.count(), 4)
+
+        out = io.StringIO()
+        call_command("prune_webauth_devices", stdout=out)
+        self.assertEqual(out.getvalue(), "Revoked 2 devices.\n")
+        self.assertEqual(set(WebAuthDevice.objects.all()), {used_lately, new})
+
+        with self.assertRaises(CommandError):
+            call_command("prune_webauth_devices", "--days", "0")
+
+
+class ImportTests(CeremonyTestCase):
+    def record(self, **fields):
+        authenticator = SoftAuthenticator()
+        return json.dumps(
+            {
+                "user_id": self.user.pk,
+                "credential_id": bytes_to_base64url(authenticator.credential_id),
+                "public_key": bytes_to_base64url(authenticator.cose_public_key()),
+                **fields,
+            }
+        )
+
+    def test_import(self):
+        stats = import_devices([self.record(), "", self.record()], workers=0)
+        self.assertEqual((stats.imported, stats.failed), (2, 0))
+        self.assertEqual(WebAuthDevice.objects.filter(user=self.user).count(), 2)
+
+    def test_user_id_string(self):
+        stats = import_devices([self.record(user_id=str(self.user.pk))], workers=0)
+        self.assertEqual((stats.imported, stats.errors), (1, []))
+
+    def test_bad_lines_are_reported(self):
+        lines = [
+            "[]",
+            '"x"',
+            "{",
+            self.record(user_id="x"),
+            self.record(user_id=self.user.pk + 1),
+            self.record(public_key=""),
+            self.record(public_key=bytes_to_base64url(cbor2.dumps([1, 2]))),
+            self.record(public_key=bytes_to_base64url(cbor2.dumps("x"))),
+            self.record(public_key=bytes_to_base64url(cbor2.dumps({1: 2}))),
+            self.record(),
+        ]
+        stats = import_devices(lines, workers=0)
+        self.assertEqual(stats.imported, 1)
+        self.assertEqual(
+            sorted(line for line, error in stats.errors), list(range(1, 10))
+        )
+
+    def test_values_must_fit(self):
+        lines = [
+            self.record(sign_count=-1),
+            self.record(sign_count=2**32),
+            self.record(name="x" * 251),
+            self.record(format="x" * 251),
+            self.record(type=5),
+            self.record(credential_id=bytes_to_base64url(bytes(129))),
+            self.record(sign_count=2**31 - 1, name="x" * 250),
+        ]
+        stats = import_devices(lines, workers=0)
+        self.assertEqual(
+            [error.split(" ")[0] for line, error in stats.errors],
+            ["sign_count", "sign_count", "name:", "format:", "type", "credential_id:"],
+        )
+        device = WebAuthDevice.objects.get(user=self.user)
+        self.assertEqual(device.sign_count, 2**31 - 1)
+
+
+class CounterlessAuthenticator(SoftAuthenticator):
+    """An authenticator without a signature counter, which always reports 0."""
+
+    def authenticate(self, challenge):
+        self.sign_count = -1
+        return super().authenticate(challenge)
+
+
+class BatchVerificationTests(CeremonyTestCase):
+    def verify_batch(self, authenticators):
+        options = self.start("webauth:batch_verification", count=len(authenticators))
+        batch = [
+            {
+                "ceremony": ceremony["ceremony"],
+                "credential": authenticator.authenticate(
+                    bytes.fromhex(ceremony["publicKey"]["challenge"])
+                ),
+            }
+            for authenticator, ceremony in zip(authenticators, options["ceremonies"])
+        ]
+        response = self.finish("webauth:batch_verification", "", batch)
+        self.assertEqual(response.status_code, 200)
+        return [result["outcome"] for result in response.json()["results"]]
+
+    def test_batch(self):
+        authenticators = [SoftAuthenticator(), SoftAuthenticator()]
+        for authenticator in authenticators:
+            self.register(authenticator)
+        self.assertEqual(self.verify_batch(authenticators), ["success", "success"])
+        self.assertTrue(self.is_verified())
+
+    def test_one_success_per_device(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        with self.assertLogs("webauth.views", "WARNING"):
+            outcomes = self.verify_batch([authenticator, authenticator])
+        self.assertEqual(outcomes, ["conflict", "success"])
+        device = WebAuthDevice.objects.get(user=self.user)
+        self.assertEqual(device.sign_count, authenticator.sign_count)
+
+    def test_one_success_per_device_without_counter(self):
+        authenticator = CounterlessAuthenticator()
+        self.register(authenticator)
+        with self.assertLogs("webauth.views", "WARNING"):
+            outcomes = self.verify_batch([authenticator, authenticator])
+        self.assertEqual(sorted(outcomes), ["conflict", "success"])
+
+
+class LoginTests(CeremonyTestCase):
+    def log_in(self, authenticator):
+        options = self.start("webauth:login_ceremony")
+        assertion = authenticator.authenticate(
+            bytes.fromhex(options["publicKey"]["challenge"])
+        )
+        return self.finish("webauth:login_ceremony", options["ceremony"], assertion)
+
+    def test_login(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.client.logout()
+        self.assertEqual(self.log_in(authenticator).status_code, 200)
+        self.assertEqual(self.client.session[SESSION_KEY], str(self.user.pk))
+        self.assertTrue(self.is_verified())
+
+    def test_login_with_other_user_handle(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.client.logout()
+        authenticator.user_handle = bytes(32)
+        self.assertEqual(self.log_in(authenticator).status_code, 400)
+        self.assertNotIn(SESSION_KEY, self.client.session)
+
+    def test_login_inactive_user(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.client.logout()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.log_in(authenticator).status_code, 400)
+        self.assertNotIn(SESSION_KEY, self.client.session)
+
+
+@override_settings(WEBAUTH_THROTTLE_RATES={"user": None, "credential": "2/m"})
+class ThrottleTests(CeremonyTestCase):
+    def test_credential_limit_follows_raw_id(self):
+        authenticator = SoftAuthenticator()
+        assertion = authenticator.authenticate(bytes(32))
+        statuses = [
+            self.finish(
+                "webauth:verification", "", dict(assertion, id=f"id-{i}")
+            ).status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [400, 400, 429])
+
+    @override_settings(WEBAUTH_THROTTLE_RATES={"login": "2/m"})
+    def test_anonymous_login_limited_per_ip(self):
+        self.client.logout()
+        url = reverse("webauth:login_ceremony")
+        statuses = [self.client.get(url).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        other = self.client_class(REMOTE_ADDR="192.0.2.1")
+        self.assertEqual(other.get(url).status_code, 200)
+
+    def test_login_limited_by_default(self):
+        self.client.logout()
+        url = reverse("webauth:login_ceremony")
+        statuses = {self.client.get(url).status_code for _ in range(31)}
+        self.assertEqual(statuses, {200, 429})
+
+
+class ExecutorTests(CeremonyTestCase):
+    @override_settings(
+        WEBAUTH_VERIFICATION_EXECUTOR={
+            "MAX_WORKERS": 1,
+            "MAX_QUEUE": 0,
+            "RETRY_AFTER": 7,
+        }
+    )
+    def test_saturated(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        get_executor().submit(release.wait)
+
+        response = self.verify(authenticator)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "7")
+        self.assertFalse(self.is_verified())
+
+        release.set()
+        self.assertEqual(self.verify(authenticator).status_code, 200)
+
+    @override_settings(WEBAUTH_VERIFICATION_EXECUTOR={"KIND": "process"})
+    def test_process_pool(self):
+        self.addCleanup(lambda: get_executor().pool.shutdown())
+        authenticator = SoftAuthenticator()
+        self.assertEqual(self.register(authenticator).status_code, 201)
+        self.assertEqual(self.verify(authenticator).status_code, 200)
+        self.assertTrue(self.is_verified())
+
+    @override_settings(WEBAUTH_VERIFICATION_EXECUTOR={"KIND": "inline"})
+    def test_inline(self):
+        authenticator = SoftAuthenticator()
+        with mock.patch("webauth.executor.ThreadPoolExecutor") as pool:
+            self.assertEqual(self.register(authenticator).status_code, 201)
+            self.assertEqual(self.verify(authenticator).status_code, 200)
+        pool.assert_not_called()
+        self.assertTrue(self.is_verified())
+
+    def test_run_many_overflow(self):
+        executor = VerificationExecutor(max_workers=1, max_queue=0)
+        self.addCleanup(executor.pool.shutdown)
+        release, released = threading.Event(), threading.Event()
+        self.addCleanup(release.set)
+        # Callbacks run in order, so the slot is free by the time this one runs.
+        executor.submit(release.wait).add_done_callback(lambda f: released.set())
+        results = executor.run_many(pow, [{"base": 2, "exp": 3}])
+        self.assertIsInstance(results[0], VerificationBusy)
+        release.set()
+        released.wait()
+        self.assertEqual(executor.run_many(pow, [{"base": 2, "exp": 3}]), [8])
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            VerificationExecutor(kind="fiber")
+
+
+@override_settings(WEBAUTH_METRICS="webauth.metrics.PrometheusMetrics")
+class MetricsTests(CeremonyTestCase):
+    def exported(self):
+        response = export_metrics(HttpRequest())
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4")
+        return response.content.decode().splitlines()
+
+    def test_outcomes(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.register(authenticator)
+        self.verify(authenticator)
+        impostor = SoftAuthenticator()
+        impostor.credential_id = authenticator.credential_id
+        self.verify(impostor)
+        self.finish(
+            "webauth:verification", "unknown", authenticator.authenticate(bytes(32))
+        )
+
+        lines = self.exported()
+        for ceremony, outcome, count in [
+            ("registration", "success", 1),
+            ("registration", "duplicate", 1),
+            ("authentication", "success", 1),
+            ("authentication", "invalid", 1),
+            ("authentication", "bad_challenge", 1),
+        ]:
+            self.assertIn(
+                f'webauth_ceremonies_total{{ceremony="{ceremony}",'
+                f'outcome="{outcome}"}} {count}',
+                lines,
+            )
+        self.assertIn(
+            'webauth_stage_seconds_count{ceremony="authentication",stage="verify"} 2',
+            lines,
+        )
+
+    def test_histogram(self):
+        metrics = PrometheusMetrics(buckets=[1.0, 0.001])
+        metrics.observe("authentication", "verify", 0.0005)
+        metrics.observe("authentication", "verify", 2.0)
+        metrics.increment("authentication", "success")
+        labels = 'ceremony="authentication",stage="verify"'
+        self.assertEqual(
+            metrics.render().splitlines(),
+            [
+                "# HELP webauth_stage_seconds Time spent in each stage of a ceremony.",
+                "# TYPE webauth_stage_seconds histogram",
+                f'webauth_stage_seconds_bucket{{{labels},le="0.001"}} 1',
+                f'webauth_stage_seconds_bucket{{{labels},le="1.0"}} 1',
+                f'webauth_stage_seconds_bucket{{{labels},le="+Inf"}} 2',
+                f"webauth_stage_seconds_sum{{{labels}}} 2.0005",
+                f"webauth_stage_seconds_count{{{labels}}} 2",
+                "# HELP webauth_ceremonies_total Completed ceremonies by outcome.",
+                "# TYPE webauth_ceremonies_total counter",
+                'webauth_ceremonies_total{ceremony="authentication",'
+                'outcome="success"} 1',
+            ],
+        )
+
+    @override_settings(WEBAUTH_METRICS="webauth.metrics.Metrics")
+    def test_nothing_to_export(self):
+        with self.assertRaises(Http404):
+            export_metrics(HttpRequest())
+
+
+def certificate(subject, key, issuer=None, issuer_key=None):
+    """A certificate for ``key``, self-signed unless an issuer is given."""
+    now = datetime.now(timezone.utc)
+    issuer = issuer or subject
+    return (
+        x509.CertificateBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, subject)]))
+        .issuer_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, issuer)]))
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=365))
+        .add_extension(
+            x509.BasicConstraints(ca=issuer_key is None, path_length=None),
+            critical=True,
+        )
+        .sign(issuer_key or key, hashes.SHA256())
+        .public_bytes(Encoding.DER)
+    )
+
+
+class PackedAuthenticator(SoftAuthenticator):
+    """Packed attestation, signed with ``key`` under the chain ``x5c``."""
+
+    def __init__(self, key=None, x5c=(), **kwargs):
+        super().__init__(**kwargs)
+        self.attestation_key = key
+        self.x5c = list(x5c)
+
+    def attest(self, auth_data, client_data_hash):
+        if self.attestation_key is None:
+            # Self attestation: signed with the credential's own key.
+            return "packed", {
+                "alg": self.alg,
+                "sig": self.sign(auth_data + client_data_hash),
+            }
+        signature = self.attestation_key.sign(
+            auth_data + client_data_hash, ec.ECDSA(hashes.SHA256())
+        )
+        return "packed", {"alg": ES256, "sig": signature, "x5c": self.x5c}
+
+
+class AttestationTests(CeremonyTestCase):
+    listed = uuid.uuid4()
+    unanchored = uuid.uuid4()
+
+    def setUp(self):
+        super().setUp()
+        verified_chains.clear()
+        root_key = ec.generate_private_key(ec.SECP256R1())
+        self.batch_key = ec.generate_private_key(ec.SECP256R1())
+        root = certificate("Vendor Root", root_key)
+        self.batch = certificate(
+            "Vendor Batch", self.batch_key, "Vendor Root", root_key
+        )
+        payload = {
+            "no": 1,
+            "entries": [
+                {
+                    "aaguid": str(self.listed),
+                    "metadataStatement": {
+                        "description": "Listed Key",
+                        "attestationRootCertificates": [
+                            base64.b64encode(root).decode()
+                        ],
+                    },
+                },
+                {
+                    "aaguid": str(self.unanchored),
+                    "metadataStatement": {"description": "Unanchored Key"},
+                },
+            ],
+        }
+        blob = ".".join(
+            bytes_to_base64url(json.dumps(part).encode())
+            for part in ({"alg": "ES256"}, payload, {})
+        )
+        with tempfile.NamedTemporaryFile("w", suffix=".jwt", delete=False) as f:
+            f.write(blob)
+        self.addCleanup(os.remove, f.name)
+        settings = override_settings(WEBAUTH_MDS_BLOB=f.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def verify_registration(self, authenticator):
+        challenge = os.urandom(32)
+        return verify_registration(
+            credential=registration_credential(authenticator.register(challenge)),
+            expected_challenge=challenge,
+            expected_origin="http://localhost:8000",
+            expected_rp_id="localhost",
+        )
+
+    def test_chain_to_listed_roots(self):
+        authenticator = PackedAuthenticator(
+            self.batch_key, [self.batch], aaguid=self.listed.bytes
+        )
+        self.assertEqual(self.register(authenticator).status_code, 201)
+
+    def test_chain_to_other_roots(self):
+        rogue_key = ec.generate_private_key(ec.SECP256R1())
+        rogue = certificate("Vendor Batch", rogue_key)
+        authenticator = PackedAuthenticator(
+            rogue_key, [rogue], aaguid=self.listed.bytes
+        )
+        with self.assertRaises(InvalidRegistrationResponse):
+            self.verify_registration(authenticator)
+        self.assertEqual(self.register(authenticator).status_code, 400)
+
+    def test_listed_model_without_chain(self):
+        for authenticator in (
+            SoftAuthenticator(aaguid=self.listed.bytes),
+            PackedAuthenticator(aaguid=self.listed.bytes),
+        ):
+            with self.assertRaises(UntrustedAuthenticator):
+                self.verify_registration(authenticator)
+        self.assertEqual(
+            self.register(SoftAuthenticator(aaguid=self.listed.bytes)).status_code,
+            400,
+        )
+        self.assertFalse(WebAuthDevice.objects.exists())
+
+    def test_unlisted_model_without_chain(self):
+        self.assertEqual(self.register(SoftAuthenticator()).status_code, 201)
+
+    def test_allowed_model_without_chain(self):
+        with self.settings(
+            WEBAUTH_ALLOWED_AAGUIDS=[str(self.listed), str(self.unanchored)]
+        ):
+            for aaguid in (self.listed, self.unanchored):
+                with self.assertRaises(UntrustedAuthenticator):
+                    self.verify_registration(PackedAuthenticator(aaguid=aaguid.bytes))
+            with self.assertRaises(UntrustedAuthenticator):
+                self.verify_registration(SoftAuthenticator())
+            self.verify_registration(
+                PackedAuthenticator(
+                    self.batch_key, [self.batch], aaguid=self.listed.bytes
+                )
+            )
+
+    def test_allowed_aaguids_require_blob(self):
+        with self.settings(
+            WEBAUTH_MDS_BLOB=None, WEBAUTH_ALLOWED_AAGUIDS=[str(self.listed)]
+        ):
+            with self.assertRaises(ImproperlyConfigured):
+                self.verify_registration(SoftAuthenticator(aaguid=self.listed.bytes))
+
+
+@override_settings(WEBAUTH_TRUSTED_BROWSER_AGE=3600)
+class TrustedBrowserTests(CeremonyTestCase):
+    def new_session(self, cookie):
+        self.client.logout()
+        self.client.cookies[get_cookie_name()] = cookie
+        self.client.force_login(self.user)
+
+    def test_remembered_browser(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.verify(authenticator, remember=True)
+        cookie = self.client.cookies[get_cookie_name()].value
+        self.new_session(cookie)
+        self.assertTrue(self.is_verified())
+
+        self.client.post(reverse("webauth:forget_browsers"))
+        self.new_session(cookie)
+        self.assertFalse(self.is_verified())
+
+    def test_not_remembered(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.verify(authenticator)
+        self.assertNotIn(get_cookie_name(), self.client.cookies)
+
+    def test_deleted_device(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.verify(authenticator, remember=True)
+        cookie = self.client.cookies[get_cookie_name()].value
+        WebAuthDevice.objects.get(user=self.user).delete()
+        self.new_session(cookie)
+        self.assertFalse(self.is_verified())
+
+    def test_other_user(self):
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.verify(authenticator, remember=True)
+        cookie = self.client.cookies[get_cookie_name()].value
+        self.user = get_user_model().objects.create_user("bob")
+        self.new_session(cookie)
+        self.assertFalse(self.is_verified())
+
+    @override_settings(WEBAUTH_CACHE_TIMEOUT=60)
+    def test_forgotten_elsewhere_expires(self):
+        if not isinstance(get_cache(), LocMemCache):
+            self.skipTest("needs a LocMemCache to move its clock")
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.verify(authenticator, remember=True)
+        cookie = self.client.cookies[get_cookie_name()].value
+        self.new_session(cookie)
+        self.assertTrue(self.is_verified())
+        # Another process moving the generation on leaves this one's cache alone.
+        TrustGeneration.objects.create(user=self.user, generation=1)
+        self.new_session(cookie)
+        self.assertTrue(self.is_verified())
+
+        later = time.time() + 61
+        with mock.patch(
+            "django.core.cache.backends.locmem.time", mock.Mock(time=lambda: later)
+        ):
+            self.assertFalse(self.is_verified())
+
+
+@override_settings(WEBAUTH_TRUSTED_BROWSER_AGE=86400, WEBAUTH_VERIFY_URL="/verify/")
+class FreshnessTests(CeremonyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.authenticator = SoftAuthenticator()
+        self.register(self.authenticator)
+
+    def get_fresh(self):
+        """Requests a view requiring a verification at most 300 seconds old."""
+        request = HttpRequest()
+        request.path = "/sensitive/"
+        request.META = {"SERVER_NAME": "testserver", "SERVER_PORT": "80"}
+        request.session = self.client.session
+        request.user = self.user
+        request.COOKIES = {
+            name: morsel.value for name, morsel in self.client.cookies.items()
+        }
+        view = webauth_required(lambda request: HttpResponse("ok"), max_age=300)
+        return view(request)
+
+    def test_fresh(self):
+        self.verify(self.authenticator)
+        self.assertEqual(self.get_fresh().status_code, 200)
+
+    def test_stale(self):
+        self.verify(self.authenticator)
+        later = time.time() + 301
+        with mock.patch("webauth.state.time", mock.Mock(time=lambda: later)):
+            response = self.get_fresh()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], "/verify/?next=/sensitive/")
+        self.assertTrue(self.is_verified())
+
+    def test_legacy_session(self):
+        self.verify(self.authenticator)
+        session = self.client.session
+        del session[VERIFIED_SESSION_KEY]
+        session[LEGACY_SESSION_KEY] = WebAuthDevice.objects.get(user=self.user).pk
+        session.save()
+        self.assertTrue(self.is_verified())
+        self.assertEqual(self.get_fresh().status_code, 302)
+
+    def test_trusted_browser(self):
+        self.verify(self.authenticator, remember=True)
+        cookie = self.client.cookies[get_cookie_name()].value
+        self.client.logout()
+        self.client.cookies[get_cookie_name()] = cookie
+        self.client.force_login(self.user)
+        self.assertTrue(self.is_verified())
+        self.assertEqual(self.get_fresh().status_code, 302)
+
+
+@awebauth_required
+async def protected(request):
+    return HttpResponse("protected")
+
+
+urlpatterns = [
+    path("webauth/", include("webauth.async_urls")),
+    path("protected/", protected),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__, WEBAUTH_VERIFY_URL="webauth:verify")
+class AsyncCeremonyTests(CeremonyTestCase):
+    """Drives the async ceremony views with ``AsyncClient``."""
+
+    def setUp(self):
+        super().setUp()
+        self.async_client.force_login(self.user)
+
+    async def start(self, name, **params):
+        response = await self.async_client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    async def finish(self, name, ceremony_id, data):
+        return await self.async_client.post(
+            reverse(name),
+            json.dumps(data),
+            content_type="application/json",
+            headers={CEREMONY_HEADER: ceremony_id},
+        )
+
+    async def register(self, authenticator, name="key"):
+        options = await self.start("webauth:registration")
+        credential = authenticator.register(
+            bytes.fromhex(options["publicKey"]["challenge"]),
+            bytes.fromhex(options["publicKey"]["user"]["id"]),
+        )
+        return await self.finish(
+            "webauth:registration",
+            options["ceremony"],
+            {"name": name, "pubKeyCredential": credential},
+        )
+
+    async def verify(self, authenticator):
+        options = await self.start("webauth:verification")
+        assertion = authenticator.authenticate(
+            bytes.fromhex(options["publicKey"]["challenge"])
+        )
+        return await self.finish("webauth:verification", options["ceremony"], assertion)
+
+    async def is_verified(self):
+        return await sync_to_async(super().is_verified)(self.async_client)
+
+    async def test_register_and_verify(self):
+        authenticator = SoftAuthenticator()
+        self.assertEqual((await self.register(authenticator)).status_code, 201)
+        device = await WebAuthDevice.objects.aget(user=self.user)
+        self.assertEqual(bytes(device.credential_id), authenticator.credential_id)
+        self.assertFalse(await self.is_verified())
+
+        self.assertEqual((await self.verify(authenticator)).status_code, 200)
+        self.assertTrue(await self.is_verified())
+        await device.arefresh_from_db()
+        self.assertEqual(device.sign_count, authenticator.sign_count)
+
+    async def test_register_duplicate_credential(self):
+        authenticator = SoftAuthenticator()
+        await self.register(authenticator)
+        self.assertEqual((await self.register(authenticator)).status_code, 409)
+        with mock.patch("webauth.views.device_lookup", return_value={"pk": 0}):
+            self.assertEqual((await self.register(authenticator)).status_code, 409)
+        self.assertEqual(await WebAuthDevice.objects.acount(), 1)
+
+    async def test_sign_count_must_advance(self):
+        authenticator = SoftAuthenticator()
+        await self.register(authenticator)
+        self.assertEqual((await self.verify(authenticator)).status_code, 200)
+        authenticator.sign_count -= 1
+        with self.assertLogs("webauth.views", "WARNING"):
+            self.assertEqual((await self.verify(authenticator)).status_code, 409)
+
+    async def test_batch(self):
+        authenticators = [SoftAuthenticator(), SoftAuthenticator()]
+        for authenticator in authenticators:
+            await self.register(authenticator)
+        options = await self.start("webauth:batch_verification", count=2)
+        batch = [
+            {
+                "ceremony": ceremony["ceremony"],
+                "credential": authenticator.authenticate(
+                    bytes.fromhex(ceremony["publicKey"]["challenge"])
+                ),
+            }
+            for authenticator, ceremony in zip(authenticators, options["ceremonies"])
+        ]
+        response = await self.finish("webauth:batch_verification", "", batch)
+        self.assertEqual(response.status_code, 200)
+        outcomes = [result["outcome"] for result in response.json()["results"]]
+        self.assertEqual(outcomes, ["success", "success"])
+        self.assertTrue(await self.is_verified())
+
+    async def test_login(self):
+        authenticator = SoftAuthenticator()
+        await self.register(authenticator)
+        await sync_to_async(self.async_client.logout)()
+        options = await self.start("webauth:login_ceremony")
+        assertion = authenticator.authenticate(
+            bytes.fromhex(options["publicKey"]["challenge"])
+        )
+        response = await self.finish(
+            "webauth:login_ceremony", options["ceremony"], assertion
+        )
+        self.assertEqual(response.status_code, 200)
+        user_id = await sync_to_async(lambda: self.async_client.session[SESSION_KEY])()
+        self.assertEqual(user_id, str(self.user.pk))
+        self.assertTrue(await self.is_verified())
+
+    async def test_awebauth_required(self):
+        authenticator = SoftAuthenticator()
+        await self.register(authenticator)
+        response = await self.async_client.get("/protected/")
+        self.assertRedirects(
+            response,
+            reverse("webauth:verify") + "?next=/protected/",
+            fetch_redirect_response=False,
+        )
+        await self.verify(authenticator)
+        response = await self.async_client.get("/protected/")
+        self.assertEqual(response.content, b"protected")
+
+
+@override_settings(
+    ROOT_URLCONF=__name__,
+    WEBAUTH_VERIFY_URL="webauth:verify",
+    LOGIN_URL="/accounts/login/",
+    STATIC_URL="/static/",
+)
+class MiddlewareTests(CeremonyTestCase):
+    def get(self, path, user=None, script_name=""):
+        request = RequestFactory().get(path, SCRIPT_NAME=script_name)
+        request.user = user or self.user
+        request.session = self.client.session
+        # Load the session now, so the async middleware never has to.
+        request.session.items()
+        return request
+
+    def middleware(self):
+        return WebAuthRequiredMiddleware(lambda request: HttpResponse("ok"))
+
+    def assertRedirectsToVerify(self, response, path):
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response["Location"], f"{reverse('webauth:verify')}?next={path}"
+        )
+
+    def test_every_path_by_default(self):
+        middleware = self.middleware()
+        self.assertRedirectsToVerify(middleware(self.get("/account/")), "/account/")
+        for exempt in [
+            reverse("webauth:verify"),
+            reverse("webauth:verification"),
+            "/static/app.css",
+            "/accounts/login/",
+        ]:
+            self.assertEqual(middleware(self.get(exempt)).status_code, 200, exempt)
+
+    @override_settings(
+        WEBAUTH_REQUIRED_PATHS=[r"/account/"],
+        WEBAUTH_EXEMPT_PATHS=[r"/account/public/"],
+    )
+    def test_required_and_exempt_paths(self):
+        middleware = self.middleware()
+        self.assertRedirectsToVerify(
+            middleware(self.get("/account/settings/")), "/account/settings/"
+        )
+        self.assertEqual(middleware(self.get("/account/public/")).status_code, 200)
+        self.assertEqual(middleware(self.get("/blog/account/")).status_code, 200)
+
+        authenticator = SoftAuthenticator()
+        self.register(authenticator)
+        self.verify(authenticator)
+        self.assertEqual(middleware(self.get("/account/settings/")).status_code, 200)
+
+    def test_anonymous(self):
+        response = self.middleware()(self.get("/account/", user=AnonymousUser()))
+        self.assertRedirectsToVerify(response, "/account/")
+
+    @override_settings(MEDIA_URL="")
+    def test_script_prefix(self):
+        # Django prefixes the relative MEDIA_URL with the script name.
+        set_script_prefix("/app/")
+        self.addCleanup(clear_script_prefix)
+        middleware = self.middleware()
+        request = self.get("/webauth/verify/", script_name="/app")
+        self.assertEqual(middleware(request).status_code, 200)
+        response = middleware(self.get("/account/", script_name="/app"))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response["Location"], "/app/webauth/verify/?next=/app/account/"
+        )
+
+    async def test_async(self):
+        async def get_response(request):
+            return HttpResponse("ok")
+
+        middleware = WebAuthRequiredMiddleware(get_response)
+        request = await sync_to_async(self.get)("/account/")
+        self.assertRedirectsToVerify(await middleware(request), "/account/")
+        request = await sync_to_async(self.get)(reverse("webauth:verify"))
+        self.assertEqual((await middleware(request)).status_code, 200)
+
+        authenticator = SoftAuthenticator()
+        await sync_to_async(self.register)(authenticator)
+        await sync_to_async(self.verify)(authenticator)
+        request = await sync_to_async(self.get)("/account/")
+        self.assertEqual((await middleware(request)).content, b"ok")
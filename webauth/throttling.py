@@ -0,0 +1,238 @@
+"""
+Throttling of the ceremony views.
+
+Every request to a ceremony view is counted against the user making it and,
+if configured, the client's IP address; completing an authentication also
+counts against the credential presented. Requests from anonymous clients,
+which only passwordless login accepts, are counted against their IP address
+under the ``login`` scope instead of a user. Limits are set per scope in
+``WEBAUTH_THROTTLE_RATES`` as ``"<requests>/<period>"``, the period being
+``s``, ``m``, ``h`` or ``d``, optionally preceded by a number (``"5/10m"``).
+
+Counts are kept in sliding windows, approximated from two fixed windows: the
+current one, and the previous one weighted by how much of it the sliding
+window still overlaps. A request over a limit is answered before the
+challenge store, the database or signature verification are touched.
+
+Select where the counts are kept with ``WEBAUTH_THROTTLE_STORE``; keyword
+arguments for its constructor may be given in
+``WEBAUTH_THROTTLE_STORE_OPTIONS``.
+"""
+import hashlib
+import math
+import re
+import time
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from .lru import LRUCache
+
+USER = "user"
+IP = "ip"
+CREDENTIAL = "credential"
+LOGIN = "login"
+
+DEFAULT_RATES = {USER: "60/m", IP: None, CREDENTIAL: "20/m", LOGIN: "30/m"}
+
+_PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+_RATE = re.compile(r"^(\d+)/(\d*)([smhd])$")
+
+
+class ThrottleStore:
+    """
+    Base class for throttle counter stores. Subclasses implement ``hit``;
+    ``ahit`` may be overridden when the store can count without blocking.
+    """
+
+    def hit(self, key, window, cost) -> Tuple[int, int]:
+        """
+        Adds ``cost`` to the count of ``key`` in the current ``window``
+        seconds long window. Returns the counts of the previous and the
+        current window.
+        """
+        raise NotImplementedError
+
+    async def ahit(self, key, window, cost) -> Tuple[int, int]:
+        return self.hit(key, window, cost)
+
+
+class LocalThrottleStore(ThrottleStore):
+    """
+    Keeps counts in a size-bounded LRU map in the current process. Each
+    process then enforces the limits on its own.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = LRUCache(max_entries)
+
+    def hit(self, key, window, cost):
+        bucket = int(time.time() // window)
+
+        def count(entry):
+            started, previous, current = entry
+            if started != bucket:
+                previous = current if started == bucket - 1 else 0
+                current = 0
+            return bucket, previous, current + cost
+
+        _, previous, current = self._entries.update(key, count, (bucket, 0, 0))
+        return previous, current
+
+
+class CacheThrottleStore(ThrottleStore):
+    """
+    Keeps counts in Django's cache, shared by every process using it. Counts
+    are added with the cache's atomic ``incr``, so use a backend where that
+    holds across processes, such as Redis, Valkey or memcached.
+    """
+
+    key_prefix = "webauth:throttle:"
+
+    def __init__(self, alias=None):
+        self.alias = alias or getattr(settings, "WEBAUTH_CACHE", "default")
+
+    def _keys(self, key, window):
+        bucket = int(time.time() // window)
+        return (
+            f"{self.key_prefix}{key}:{window}:{bucket - 1}",
+            f"{self.key_prefix}{key}:{window}:{bucket}",
+        )
+
+    def hit(self, key, window, cost):
+        cache = caches[self.alias]
+        previous_key, current_key = self._keys(key, window)
+        # Buckets live two windows, long enough to be read as the previous one.
+        if cache.add(current_key, cost, 2 * window):
+            current = cost
+        else:
+            try:
+                current = cache.incr(current_key, cost)
+            except ValueError:
+                # Expired between add() and incr().
+                cache.set(current_key, cost, 2 * window)
+                current = cost
+        return cache.get(previous_key, 0), current
+
+    async def ahit(self, key, window, cost):
+        cache = caches[self.alias]
+        previous_key, current_key = self._keys(key, window)
+        if await cache.aadd(current_key, cost, 2 * window):
+            current = cost
+        else:
+            try:
+                current = await cache.aincr(current_key, cost)
+            except ValueError:
+                await cache.aset(current_key, cost, 2 * window)
+                current = cost
+        return await cache.aget(previous_key, 0), current
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate) -> Tuple[int, int]:
+    """Returns ``(requests, window in seconds)`` for a rate like ``"20/m"``."""
+    match = _RATE.match(rate)
+    if match is None:
+        raise ValueError(f"Invalid throttle rate: {rate!r}")
+    requests, multiple, period = match.groups()
+    return int(requests), int(multiple or 1) * _PERIODS[period]
+
+
+def get_rates() -> dict:
+    return {**DEFAULT_RATES, **getattr(settings, "WEBAUTH_THROTTLE_RATES", {})}
+
+
+@lru_cache(maxsize=None)
+def get_throttle_store() -> ThrottleStore:
+    store_class = import_string(
+        getattr(
+            settings,
+            "WEBAUTH_THROTTLE_STORE",
+            "webauth.throttling.LocalThrottleStore",
+        )
+    )
+    return store_class(**getattr(settings, "WEBAUTH_THROTTLE_STORE_OPTIONS", {}))
+
+
+def _wait(previous, current, requests, window) -> Optional[float]:
+    """
+    Seconds until the sliding window drops back to ``requests``, or ``None``
+    if it has not exceeded them.
+    """
+    elapsed = time.time() % window
+    count = previous * (window - elapsed) / window + current
+    if count <= requests:
+        return None
+    if current > requests:
+        return window - elapsed
+    # The excess is carried by the previous window, which keeps sliding out.
+    return (count - requests) * window / previous
+
+
+def _credential_key(credential_id) -> str:
+    return hashlib.sha256(bytes(credential_id)).hexdigest()[:32]
+
+
+def _scopes(request, credential_id):
+    address = request.META.get("REMOTE_ADDR", "")
+    if request.user.is_authenticated:
+        yield USER, str(request.user.pk)
+    else:
+        yield LOGIN, address
+    yield IP, address
+    if credential_id is not None:
+        yield CREDENTIAL, _credential_key(credential_id)
+
+
+def _limits(scopes):
+    rates = get_rates()
+    for scope, ident in scopes:
+        rate = rates.get(scope)
+        if rate is not None:
+            yield f"{scope}:{ident}", parse_rate(rate)
+
+
+def _throttle(scopes, cost):
+    store = get_throttle_store()
+    for key, (requests, window) in _limits(scopes):
+        wait = _wait(*store.hit(key, window, cost), requests, window)
+        if wait is not None:
+            return math.ceil(wait)
+    return None
+
+
+async def _athrottle(scopes, cost):
+    store = get_throttle_store()
+    for key, (requests, window) in _limits(scopes):
+        wait = _wait(*await store.ahit(key, window, cost), requests, window)
+        if wait is not None:
+            return math.ceil(wait)
+    return None
+
+
+def throttle(request, credential_id=None, cost=1) -> Optional[int]:
+    """
+    Counts ``cost`` requests against the user, or for anonymous requests the
+    login scope, and the IP of ``request``, and
+    against ``credential_id``, the raw credential ID, if given. Returns the
+    whole seconds to wait if any of their limits is exceeded, otherwise
+    ``None``.
+    """
+    return _throttle(_scopes(request, credential_id), cost)
+
+
+async def athrottle(request, credential_id=None, cost=1) -> Optional[int]:
+    return await _athrottle(_scopes(request, credential_id), cost)
+
+
+def throttle_credential(credential_id) -> Optional[int]:
+    """Counts a request against ``credential_id`` alone."""
+    return _throttle([(CREDENTIAL, _credential_key(credential_id))], 1)
+
+
+async def athrottle_credential(credential_id) -> Optional[int]:
+    return await _athrottle([(CREDENTIAL, _credential_key(credential_id))], 1)
@@ -0,0 +1,174 @@
+"""
+Trusted browsers.
+
+With ``WEBAUTH_TRUSTED_BROWSER_AGE`` set, a user completing verification may
+ask for the browser to be remembered. The browser gets a signed cookie naming
+the user, the verifying device, its credential revision and the user's trust
+generation, valid for that many seconds. Later sessions on that browser count
+as verified without another ceremony: checking the cookie takes one signature
+check, and the device revision and the generation normally come from the
+cache.
+
+The cookie is checked on every request instead of being copied into the
+session, so revoking the device, or ``forget_browsers`` moving the user's
+generation on, takes effect everywhere at once, given a ``WEBAUTH_CACHE``
+shared by all processes. Otherwise other processes notice within
+``WEBAUTH_CACHE_TIMEOUT`` seconds. A remembered browser never
+satisfies ``max_age``.
+"""
+from django.conf import settings
+from django.core import signing
+from django.db import router, transaction
+from django.db.models import F
+
+from .routers import get_cache_timeout
+from .state import adevice_revision, credential_revision, device_revision, get_cache
+
+_SALT = "webauth.trust"
+_REQUEST_ATTR = "_webauth_trusted"
+_UNSET = object()
+
+
+def get_trusted_browser_age():
+    """Seconds a remembered browser stays trusted, or ``None`` if disabled."""
+    return getattr(settings, "WEBAUTH_TRUSTED_BROWSER_AGE", None)
+
+
+def get_cookie_name() -> str:
+    return getattr(settings, "WEBAUTH_TRUSTED_BROWSER_COOKIE", "webauth_trusted")
+
+
+def _generation_key(user_id) -> str:
+    return f"webauth:user:{user_id}:trust"
+
+
+def _generation_queryset(user_id):
+    from .models import TrustGeneration
+
+    return TrustGeneration.objects.filter(user_id=user_id).values_list(
+        "generation", flat=True
+    )
+
+
+def trust_generation(user_id) -> int:
+    """The user's current trust generation. Only a cache miss reads the table."""
+    generation = get_cache().get(_generation_key(user_id))
+    if generation is None:
+        generation = _generation_queryset(user_id).first() or 0
+        get_cache().set(_generation_key(user_id), generation, get_cache_timeout())
+    return generation
+
+
+async def atrust_generation(user_id) -> int:
+    generation = await get_cache().aget(_generation_key(user_id))
+    if generation is None:
+        generation = await _generation_queryset(user_id).afirst() or 0
+        await get_cache().aset(
+            _generation_key(user_id), generation, get_cache_timeout()
+        )
+    return generation
+
+
+def forget_browsers(user_id):
+    """Stops every browser remembered for the user so far from being trusted."""
+    from .models import TrustGeneration
+
+    with transaction.atomic(using=router.db_for_write(TrustGeneration)):
+        updated = TrustGeneration.objects.filter(user_id=user_id).update(
+            generation=F("generation") + 1
+        )
+        if not updated:
+            TrustGeneration.objects.get_or_create(
+                user_id=user_id, defaults={"generation": 1}
+            )
+    get_cache().delete(_generation_key(user_id))
+
+
+def _set_cookie(response, device, generation):
+    token = signing.dumps(
+        {
+            "u": str(device.user_id),
+            "d": device.pk,
+            "r": credential_revision(device.credential_id, device.public_key),
+            "g": generation,
+        },
+        salt=_SALT,
+    )
+    response.set_cookie(
+        get_cookie_name(),
+        token,
+        max_age=get_trusted_browser_age(),
+        domain=settings.SESSION_COOKIE_DOMAIN,
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite="Lax",
+    )
+
+
+def trust_browser(response, device):
+    """Remember the browser ``response`` goes to as verified by ``device``."""
+    if get_trusted_browser_age():
+        _set_cookie(response, device, trust_generation(device.user_id))
+
+
+async def atrust_browser(response, device):
+    if get_trusted_browser_age():
+        _set_cookie(response, device, await atrust_generation(device.user_id))
+
+
+def _cookie_payload(request):
+    age = get_trusted_browser_age()
+    token = request.COOKIES.get(get_cookie_name())
+    if not age or token is None:
+        return None
+    try:
+        payload = signing.loads(token, salt=_SALT, max_age=age)
+    except signing.BadSignature:
+        return None
+    if payload["u"] != str(request.user.pk):
+        return None
+    return payload
+
+
+def _checked_stamp(payload, generation, revision):
+    if generation != payload["g"] or revision != (payload["u"], payload["r"]):
+        return None
+    return {"u": payload["u"], "d": payload["d"], "r": payload["r"], "t": None}
+
+
+def trusted_stamp(request):
+    """
+    Returns a verification stamp for an authenticated request from a
+    remembered browser, or ``None``. The result is memoized on the request.
+    """
+    stamp = getattr(request, _REQUEST_ATTR, _UNSET)
+    if stamp is _UNSET:
+        stamp = None
+        payload = _cookie_payload(request)
+        if payload is not None:
+            stamp = _checked_stamp(
+                payload,
+                trust_generation(payload["u"]),
+                device_revision(payload["d"], request),
+            )
+        setattr(request, _REQUEST_ATTR, stamp)
+    return stamp
+
+
+async def atrusted_stamp(request):
+    """
+    Async version of ``trusted_stamp``. ``request.user`` must already be
+    resolved.
+    """
+    stamp = getattr(request, _REQUEST_ATTR, _UNSET)
+    if stamp is _UNSET:
+        stamp = None
+        payload = _cookie_payload(request)
+        if payload is not None:
+            stamp = _checked_stamp(
+                payload,
+                await atrust_generation(payload["u"]),
+                await adevice_revision(payload["d"], request),
+            )
+        setattr(request, _REQUEST_ATTR, stamp)
+    return stamp
@@ -7,7 +7,19 @@ app_name = "webauth"
 urlpatterns = [
     path("devices/", views.DeviceListView.as_view(), name="devices"),
     path("devices/<int:pk>/delete/", views.DeleteDevice.as_view(), name="delete"),
+    path(
+        "devices/forget-browsers/",
+        views.forget_trusted_browsers,
+        name="forget_browsers",
+    ),
     path("registration/", views.Registration.as_view(), name="registration"),
     path("verify/", views.verify, name="verify"),
     path("verification/", views.Verification.as_view(), name="verification"),
+    path("login/", views.passwordless, name="login"),
+    path("login/ceremony/", views.Login.as_view(), name="login_ceremony"),
+    path(
+        "verification/batch/",
+        views.BatchVerification.as_view(),
+        name="batch_verification",
+    ),
 ]
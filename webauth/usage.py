@@ -0,0 +1,107 @@
+"""
+Last-used tracking for devices.
+
+Writing ``last_used_at`` and ``use_count`` on every assertion would add a
+write to every login. Instead, each process remembers the devices used since
+its last flush and writes them all every ``WEBAUTH_USAGE_FLUSH_INTERVAL``
+seconds, with one UPDATE per ``WEBAUTH_USAGE_BATCH_SIZE`` devices, on a
+background thread. A device used again before the flush costs nothing more
+than a dict update.
+
+Uses recorded since the last flush are lost if the process dies without
+exiting cleanly, or if writing them fails, so the flush interval bounds how
+far behind the columns can be. A buffer is also flushed as soon as it holds
+``WEBAUTH_USAGE_MAX_PENDING`` devices, and at interpreter exit.
+"""
+import atexit
+import logging
+from threading import Lock, Timer
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class UsageBuffer:
+    """Thread-safe map of device id to ``(uses, last used at)`` since a flush."""
+
+    def __init__(self, interval=60, batch_size=1000, max_pending=10000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = Lock()
+        self._timer = None
+
+    def record(self, device_ids):
+        """Count one use of each of ``device_ids``, as of now."""
+        if not device_ids:
+            return
+        now = timezone.now()
+        with self._lock:
+            for device_id in device_ids:
+                uses, _ = self._pending.get(device_id, (0, None))
+                self._pending[device_id] = (uses + 1, now)
+            if len(self._pending) >= self.max_pending:
+                self._schedule(0)
+            elif self._timer is None:
+                self._schedule(self.interval)
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = Timer(delay, self._flush_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Writing device usage failed")
+        finally:
+            # The timer thread's connections are never reused.
+            connections.close_all()
+
+    def flush(self) -> int:
+        """Writes the buffered uses now. Returns the number of devices written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+
+        from .models import WebAuthDevice
+
+        items = list(pending.items())
+        for start in range(0, len(items), self.batch_size):
+            WebAuthDevice.objects.record_usage(
+                dict(items[start : start + self.batch_size])
+            )
+        return len(items)
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+
+device_usage = UsageBuffer(
+    getattr(settings, "WEBAUTH_USAGE_FLUSH_INTERVAL", 60),
+    getattr(settings, "WEBAUTH_USAGE_BATCH_SIZE", 1000),
+    getattr(settings, "WEBAUTH_USAGE_MAX_PENDING", 10000),
+)
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        device_usage.flush()
+    except Exception:
+        logger.exception("Writing device usage at exit failed")
@@ -1,21 +1,79 @@
 from http import HTTPStatus
-import json
-from secrets import token_hex
+import logging
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponse, JsonResponse
-from django.shortcuts import render
+from django.db import IntegrityError, router, transaction
+from django.http import Http404, HttpResponse
+from django.shortcuts import redirect, render, resolve_url
 from django.urls import reverse_lazy
+from django.utils.http import url_has_allowed_host_and_scheme
 from django.views import View
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import require_POST
 from django.views.generic.edit import DeleteView
 from django.views.generic.list import ListView
 
-from webauthn import verify_authentication_response, verify_registration_response
-from webauthn.helpers.structs import AuthenticationCredential, RegistrationCredential
+from webauthn.helpers.exceptions import (
+    InvalidAuthenticationResponse,
+    InvalidRegistrationResponse,
+)
 
-from .models import WebAuthDevice
+from . import REDIRECT_FIELD_NAME, aget_user
+from .attestation import UntrustedAuthenticator, verify_registration
+from .challenges import (
+    AUTHENTICATION,
+    CEREMONY_HEADER,
+    LOGIN,
+    REGISTRATION,
+    get_challenge_store,
+)
+from .executor import (
+    VerificationBusy,
+    arun,
+    arun_many,
+    get_executor,
+    run,
+    run_many,
+)
+from .keys import SignCountConflict, verify_authentication
+from .metrics import get_metrics
+from .mixins import AsyncLoginRequiredMixin
+from .models import WebAuthDevice, hash_credential_id, user_handle
+from .options import (
+    aallow_credentials,
+    allow_credentials,
+    get_algorithms,
+    login_options,
+    registration_options,
+    verification_options,
+)
+from .payloads import (
+    RequestTooLarge,
+    authentication_credential,
+    json_response,
+    read_json,
+    registration_credential,
+)
+from .routers import pin_to_primary
+from .state import stamp_session
+from .trust import (
+    atrust_browser,
+    forget_browsers,
+    get_cookie_name,
+    get_trusted_browser_age,
+    trust_browser,
+)
+from .throttling import athrottle, athrottle_credential, throttle, throttle_credential
+from .usage import device_usage
+
+logger = logging.getLogger(__name__)
+
+# Raised by payloads that parse as JSON but are not shaped like a credential.
+MALFORMED = (AttributeError, KeyError, TypeError, ValueError)
 
 
 class DeviceListView(ListView, LoginRequiredMixin):
@@ -37,121 +95,857 @@ class DeleteDevice(DeleteView):
         return qs
 
 
-class Registration(LoginRequiredMixin, View):
-    def get(self, request, *args, **kwargs):
-        display_name = request.user.get_full_name() or request.user.username
-        challenge = token_hex()
-        request.session["webauth_challenge"] = challenge
+def registration_arguments(data, challenge):
+    """
+    Turns a parsed registration request into (device name, verification
+    kwargs).
+    """
+    return data.get("name"), dict(
+        credential=registration_credential(data["pubKeyCredential"]),
+        expected_challenge=challenge,
+        expected_origin=settings.WEBAUTH_ORIGIN,
+        expected_rp_id=settings.WEBAUTH_RP_ID,
+        require_user_verification=False,
+        supported_pub_key_algs=list(get_algorithms()),
+    )
 
-        hex_id = f"{request.user.id:x}"
-        if len(hex_id) % 2 == 1:
-            hex_id = f"0{hex_id}"
 
-        return JsonResponse(
-            {
-                "publicKey": {
-                    "rp": {
-                        "id": settings.WEBAUTH_RP_ID,
-                        "name": settings.WEBAUTH_RP_NAME,
-                    },
-                    "user": {
-                        "id": hex_id,
-                        "name": request.user.email,
-                        "displayName": display_name,
-                    },
-                    "pubKeyCredParams": [
-                        {
-                            "type": "public-key",
-                            "alg": -7,
-                        },
-                    ],
-                    "attestation": "direct",
-                    "timeout": 60000,
-                    "challenge": challenge,
-                },
-            }
+def authentication_arguments(
+    credential, challenge, device, require_user_verification=False
+):
+    return dict(
+        credential=credential,
+        expected_challenge=challenge,
+        expected_rp_id=settings.WEBAUTH_RP_ID,
+        expected_origin=settings.WEBAUTH_ORIGIN,
+        device_id=device.pk,
+        credential_public_key=device.public_key,
+        credential_current_sign_count=device.sign_count,
+        require_user_verification=require_user_verification,
+    )
+
+
+def device_lookup(credential):
+    return dict(
+        credential_hash=hash_credential_id(credential.raw_id),
+        credential_id=credential.raw_id,
+    )
+
+
+def login_lookup(credential):
+    """
+    Finds the device of a passwordless login, and its user, through the user
+    handle the authenticator returned.
+    """
+    return dict(
+        user_handle=credential.response.user_handle.hex(), **device_lookup(credential)
+    )
+
+
+def new_device(user, name, verification):
+    return WebAuthDevice(
+        user=user,
+        user_handle=user_handle(user.pk),
+        name=name,
+        credential_id=verification.credential_id,
+        public_key=verification.credential_public_key,
+        format=verification.fmt,
+        type=verification.credential_type,
+        sign_count=verification.sign_count,
+    )
+
+
+def save_new_device(device) -> bool:
+    """
+    Saves a newly registered device. Returns ``False``, leaving any enclosing
+    transaction usable, when its credential was registered by a request that
+    raced this one past the duplicate check.
+    """
+    try:
+        with transaction.atomic(using=router.db_for_write(WebAuthDevice)):
+            device.save()
+    except IntegrityError:
+        return False
+    return True
+
+
+def rejected_response(ceremony, outcome):
+    get_metrics().increment(ceremony, outcome)
+    return HttpResponse(status=HTTPStatus.BAD_REQUEST)
+
+
+def too_large_response(ceremony):
+    get_metrics().increment(ceremony, "too_large")
+    return HttpResponse(status=HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+
+def throttled_response(ceremony, wait):
+    get_metrics().increment(ceremony, "throttled")
+    response = HttpResponse(status=HTTPStatus.TOO_MANY_REQUESTS)
+    response["Retry-After"] = str(wait)
+    return response
+
+
+def busy_response(ceremony):
+    """Tells the client to retry once the verification executor has room."""
+    get_metrics().increment(ceremony, "busy")
+    return HttpResponse(
+        status=HTTPStatus.SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(get_executor().retry_after)},
+    )
+
+
+def conflict_response(device, ceremony=AUTHENTICATION):
+    """
+    The sign count of ``device`` failed to advance: the assertion was replayed,
+    raced another one from the same credential, or the authenticator has been
+    cloned.
+    """
+    logger.warning(
+        "Sign count of WebAuthDevice %s did not advance; "
+        "the authenticator may have been cloned",
+        device.pk,
+    )
+    get_metrics().increment(ceremony, "conflict")
+    return HttpResponse(status=HTTPStatus.CONFLICT)
+
+
+def duplicate_response():
+    """The credential being registered already belongs to a device."""
+    get_metrics().increment(REGISTRATION, "duplicate")
+    return HttpResponse(status=HTTPStatus.CONFLICT)
+
+
+def export_metrics(request):
+    """
+    Exports the collected ceremony metrics for Prometheus to scrape. Only
+    backends that can render themselves, like ``PrometheusMetrics``, have
+    anything to export.
+    """
+    backend = get_metrics()
+    if not hasattr(backend, "render"):
+        raise Http404("WEBAUTH_METRICS does not support exporting")
+    return HttpResponse(backend.render(), content_type="text/plain; version=0.0.4")
+
+
+class Registration(LoginRequiredMixin, View):
+    def get(self, request, *args, **kwargs):
+        wait = throttle(request)
+        if wait is not None:
+            return throttled_response(REGISTRATION, wait)
+        with get_metrics().timer(REGISTRATION, "challenge_issue"):
+            ceremony_id, challenge = get_challenge_store().issue(request, REGISTRATION)
+        credentials = allow_credentials(request.user.pk, request)
+        return HttpResponse(
+            registration_options(ceremony_id, challenge, request.user, credentials),
+            content_type="application/json",
         )
 
     def post(self, request, *args, **kwargs):
-        challenge = bytes.fromhex(request.session.pop("webauth_challenge"))
-
-        data = json.loads(request.body)
-        name = data.get("name")
-        pub_key_credential = json.dumps(data.get("pubKeyCredential"))
-
-        verification = verify_registration_response(
-            credential=RegistrationCredential.parse_raw(pub_key_credential),
-            expected_challenge=challenge,
-            expected_origin=settings.WEBAUTH_ORIGIN,
-            expected_rp_id=settings.WEBAUTH_RP_ID,
-            require_user_verification=False,
-        )
-        WebAuthDevice.objects.create(
-            user=request.user,
-            name=name,
-            credential_id=verification.credential_id,
-            public_key=verification.credential_public_key,
-            format=verification.fmt,
-            type=verification.credential_type,
-            sign_count=verification.sign_count,
-        )
+        try:
+            data = read_json(request)
+        except RequestTooLarge:
+            return too_large_response(REGISTRATION)
+        except ValueError:
+            return rejected_response(REGISTRATION, "invalid")
+        wait = throttle(request)
+        if wait is not None:
+            return throttled_response(REGISTRATION, wait)
+
+        metrics = get_metrics()
+        with metrics.timer(REGISTRATION, "challenge_load"):
+            challenge = get_challenge_store().consume(
+                request, REGISTRATION, request.headers.get(CEREMONY_HEADER)
+            )
+        if challenge is None:
+            return rejected_response(REGISTRATION, "bad_challenge")
+
+        try:
+            name, arguments = registration_arguments(data, challenge)
+        except MALFORMED:
+            return rejected_response(REGISTRATION, "invalid")
+        credential = arguments["credential"]
+        with metrics.timer(REGISTRATION, "device_fetch"):
+            duplicate = WebAuthDevice.objects.filter(
+                **device_lookup(credential)
+            ).exists()
+        if duplicate:
+            return duplicate_response()
+        try:
+            with metrics.timer(REGISTRATION, "verify"):
+                verification = run(verify_registration, **arguments)
+        except VerificationBusy:
+            return busy_response(REGISTRATION)
+        except UntrustedAuthenticator:
+            return rejected_response(REGISTRATION, "untrusted")
+        except InvalidRegistrationResponse:
+            return rejected_response(REGISTRATION, "invalid")
+        if verification.credential_id != credential.raw_id:
+            return rejected_response(REGISTRATION, "invalid")
+
+        with metrics.timer(REGISTRATION, "device_create"):
+            saved = save_new_device(new_device(request.user, name, verification))
+        if not saved:
+            return duplicate_response()
+        pin_to_primary(request)
+        metrics.increment(REGISTRATION, "success")
         return HttpResponse(status=HTTPStatus.CREATED)
 
 
 @login_required
 def verify(request):
-    return render(request, "webauth/webauthdevice_verify.html")
+    age = get_trusted_browser_age()
+    return render(
+        request,
+        "webauth/webauthdevice_verify.html",
+        {"trusted_browser_days": age // 86400 if age else None},
+    )
+
+
+@login_required
+@require_POST
+def forget_trusted_browsers(request):
+    """Stop trusting every browser the user asked to be remembered."""
+    forget_browsers(request.user.pk)
+    response = redirect("webauth:devices")
+    response.delete_cookie(get_cookie_name(), domain=settings.SESSION_COOKIE_DOMAIN)
+    return response
 
 
 class Verification(LoginRequiredMixin, View):
     def get(self, request, *args, **kwargs):
-        challenge = token_hex()
-        request.session["webauth_challenge"] = challenge
+        wait = throttle(request)
+        if wait is not None:
+            return throttled_response(AUTHENTICATION, wait)
+        with get_metrics().timer(AUTHENTICATION, "challenge_issue"):
+            store = get_challenge_store()
+            ceremony_id, challenge = store.issue(request, AUTHENTICATION)
+        credentials = allow_credentials(request.user.pk, request)
+        return HttpResponse(
+            verification_options(ceremony_id, challenge, credentials),
+            content_type="application/json",
+        )
+
+    def post(self, request, *args, **kwargs):
+        try:
+            data = read_json(request)
+            credential = authentication_credential(data)
+        except RequestTooLarge:
+            return too_large_response(AUTHENTICATION)
+        except MALFORMED:
+            return rejected_response(AUTHENTICATION, "invalid")
+        wait = throttle(request, credential.raw_id)
+        if wait is not None:
+            return throttled_response(AUTHENTICATION, wait)
+
+        metrics = get_metrics()
+        with metrics.timer(AUTHENTICATION, "challenge_load"):
+            challenge = get_challenge_store().consume(
+                request, AUTHENTICATION, request.headers.get(CEREMONY_HEADER)
+            )
+        if challenge is None:
+            return rejected_response(AUTHENTICATION, "bad_challenge")
+        try:
+            with metrics.timer(AUTHENTICATION, "device_fetch"):
+                device = WebAuthDevice.objects.replica(request).get(
+                    **device_lookup(credential)
+                )
+        except WebAuthDevice.DoesNotExist:
+            return rejected_response(AUTHENTICATION, "unknown_device")
+
+        try:
+            with metrics.timer(AUTHENTICATION, "verify"):
+                verification = run(
+                    verify_authentication,
+                    **authentication_arguments(credential, challenge, device),
+                )
+        except VerificationBusy:
+            return busy_response(AUTHENTICATION)
+        except SignCountConflict:
+            return conflict_response(device)
+        except InvalidAuthenticationResponse:
+            return rejected_response(AUTHENTICATION, "invalid")
+
+        with metrics.timer(AUTHENTICATION, "sign_count_write"):
+            advanced = WebAuthDevice.objects.advance_sign_count(
+                device.pk, verification.new_sign_count
+            )
+        if not advanced:
+            return conflict_response(device)
+        device.sign_count = verification.new_sign_count
+        device_usage.record([device.pk])
+
+        stamp_session(request, device)
 
-        credential_ids = WebAuthDevice.objects.filter(user=request.user).values_list(
-            "credential_id", flat=True
+        metrics.increment(AUTHENTICATION, "success")
+        response = HttpResponse()
+        if data.get("remember"):
+            trust_browser(response, device)
+        return response
+
+
+class AsyncRegistration(AsyncLoginRequiredMixin, View):
+    """
+    ``Registration`` for ASGI deployments. Signature verification runs on the
+    executor from ``webauth.executor``; everything else stays on the event
+    loop.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        wait = await athrottle(request)
+        if wait is not None:
+            return throttled_response(REGISTRATION, wait)
+        with get_metrics().timer(REGISTRATION, "challenge_issue"):
+            store = get_challenge_store()
+            ceremony_id, challenge = await store.aissue(request, REGISTRATION)
+        credentials = await aallow_credentials(request.user.pk, request)
+        return HttpResponse(
+            registration_options(ceremony_id, challenge, request.user, credentials),
+            content_type="application/json",
         )
 
-        return JsonResponse(
-            {
-                "publicKey": {
-                    "challenge": challenge,
-                    "allowCredentials": [
-                        {
-                            "id": credential_id.hex(),
-                            "type": "public-key",
-                            "transports": [
-                                "usb",
-                                "ble",
-                                "nfc",
-                            ],
-                        }
-                        for credential_id in credential_ids
-                    ],
-                    "timeout": 60000,
-                },
-            }
+    async def post(self, request, *args, **kwargs):
+        try:
+            data = read_json(request)
+        except RequestTooLarge:
+            return too_large_response(REGISTRATION)
+        except ValueError:
+            return rejected_response(REGISTRATION, "invalid")
+        wait = await athrottle(request)
+        if wait is not None:
+            return throttled_response(REGISTRATION, wait)
+
+        metrics = get_metrics()
+        with metrics.timer(REGISTRATION, "challenge_load"):
+            challenge = await get_challenge_store().aconsume(
+                request, REGISTRATION, request.headers.get(CEREMONY_HEADER)
+            )
+        if challenge is None:
+            return rejected_response(REGISTRATION, "bad_challenge")
+
+        try:
+            name, arguments = registration_arguments(data, challenge)
+        except MALFORMED:
+            return rejected_response(REGISTRATION, "invalid")
+        credential = arguments["credential"]
+        with metrics.timer(REGISTRATION, "device_fetch"):
+            duplicate = await WebAuthDevice.objects.filter(
+                **device_lookup(credential)
+            ).aexists()
+        if duplicate:
+            return duplicate_response()
+        try:
+            with metrics.timer(REGISTRATION, "verify"):
+                verification = await arun(verify_registration, **arguments)
+        except VerificationBusy:
+            return busy_response(REGISTRATION)
+        except UntrustedAuthenticator:
+            return rejected_response(REGISTRATION, "untrusted")
+        except InvalidRegistrationResponse:
+            return rejected_response(REGISTRATION, "invalid")
+        if verification.credential_id != credential.raw_id:
+            return rejected_response(REGISTRATION, "invalid")
+
+        with metrics.timer(REGISTRATION, "device_create"):
+            saved = await sync_to_async(save_new_device)(
+                new_device(request.user, name, verification)
+            )
+        if not saved:
+            return duplicate_response()
+        pin_to_primary(request)
+        metrics.increment(REGISTRATION, "success")
+        return HttpResponse(status=HTTPStatus.CREATED)
+
+
+class AsyncVerification(AsyncLoginRequiredMixin, View):
+    """``Verification`` for ASGI deployments."""
+
+    async def get(self, request, *args, **kwargs):
+        wait = await athrottle(request)
+        if wait is not None:
+            return throttled_response(AUTHENTICATION, wait)
+        with get_metrics().timer(AUTHENTICATION, "challenge_issue"):
+            store = get_challenge_store()
+            ceremony_id, challenge = await store.aissue(request, AUTHENTICATION)
+        credentials = await aallow_credentials(request.user.pk, request)
+        return HttpResponse(
+            verification_options(ceremony_id, challenge, credentials),
+            content_type="application/json",
+        )
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            data = read_json(request)
+            credential = authentication_credential(data)
+        except RequestTooLarge:
+            return too_large_response(AUTHENTICATION)
+        except MALFORMED:
+            return rejected_response(AUTHENTICATION, "invalid")
+        wait = await athrottle(request, credential.raw_id)
+        if wait is not None:
+            return throttled_response(AUTHENTICATION, wait)
+
+        metrics = get_metrics()
+        with metrics.timer(AUTHENTICATION, "challenge_load"):
+            challenge = await get_challenge_store().aconsume(
+                request, AUTHENTICATION, request.headers.get(CEREMONY_HEADER)
+            )
+        if challenge is None:
+            return rejected_response(AUTHENTICATION, "bad_challenge")
+        try:
+            with metrics.timer(AUTHENTICATION, "device_fetch"):
+                device = await WebAuthDevice.objects.replica(request).aget(
+                    **device_lookup(credential)
+                )
+        except WebAuthDevice.DoesNotExist:
+            return rejected_response(AUTHENTICATION, "unknown_device")
+
+        try:
+            with metrics.timer(AUTHENTICATION, "verify"):
+                verification = await arun(
+                    verify_authentication,
+                    **authentication_arguments(credential, challenge, device),
+                )
+        except VerificationBusy:
+            return busy_response(AUTHENTICATION)
+        except SignCountConflict:
+            return conflict_response(device)
+        except InvalidAuthenticationResponse:
+            return rejected_response(AUTHENTICATION, "invalid")
+
+        with metrics.timer(AUTHENTICATION, "sign_count_write"):
+            advanced = await WebAuthDevice.objects.aadvance_sign_count(
+                device.pk, verification.new_sign_count
+            )
+        if not advanced:
+            return conflict_response(device)
+        device.sign_count = verification.new_sign_count
+        device_usage.record([device.pk])
+
+        stamp_session(request, device)
+
+        metrics.increment(AUTHENTICATION, "success")
+        response = HttpResponse()
+        if data.get("remember"):
+            await atrust_browser(response, device)
+        return response
+
+
+def login_redirect_url(request):
+    """Where to send the user after a passwordless login."""
+    url = request.GET.get(REDIRECT_FIELD_NAME)
+    if url and url_has_allowed_host_and_scheme(
+        url, allowed_hosts={request.get_host()}, require_https=request.is_secure()
+    ):
+        return url
+    return resolve_url(settings.LOGIN_REDIRECT_URL)
+
+
+@ensure_csrf_cookie
+def passwordless(request):
+    return render(
+        request,
+        "webauth/login.html",
+        {"redirect_url": login_redirect_url(request)},
+    )
+
+
+def log_in(request, device):
+    login(request, device.user, backend=settings.AUTHENTICATION_BACKENDS[0])
+    stamp_session(request, device)
+
+
+class Login(View):
+    """
+    Passwordless login with a discoverable credential, in place of both the
+    password and the second factor. ``GET`` returns options without
+    ``allowCredentials``. The assertion posted back names its user through
+    the user handle, which finds the device and the user in one indexed
+    query, and a valid one logs that user in.
+    """
+
+    def get(self, request, *args, **kwargs):
+        wait = throttle(request)
+        if wait is not None:
+            return throttled_response(LOGIN, wait)
+        with get_metrics().timer(LOGIN, "challenge_issue"):
+            ceremony_id, challenge = get_challenge_store().issue(request, LOGIN)
+        return HttpResponse(
+            login_options(ceremony_id, challenge), content_type="application/json"
         )
 
     def post(self, request, *args, **kwargs):
-        challenge = bytes.fromhex(request.session.pop("webauth_challenge"))
-
-        credential = AuthenticationCredential.parse_raw(request.body.decode())
-        device = WebAuthDevice.objects.get(credential_id=credential.raw_id)
-
-        verification = verify_authentication_response(
-            credential=credential,
-            expected_challenge=challenge,
-            expected_rp_id=settings.WEBAUTH_RP_ID,
-            expected_origin=settings.WEBAUTH_ORIGIN,
-            credential_public_key=device.public_key,
-            credential_current_sign_count=device.sign_count,
-            require_user_verification=False,
+        try:
+            credential = authentication_credential(read_json(request))
+        except RequestTooLarge:
+            return too_large_response(LOGIN)
+        except MALFORMED:
+            return rejected_response(LOGIN, "invalid")
+        wait = throttle(request, credential.raw_id)
+        if wait is not None:
+            return throttled_response(LOGIN, wait)
+
+        metrics = get_metrics()
+        with metrics.timer(LOGIN, "challenge_load"):
+            challenge = get_challenge_store().consume(
+                request, LOGIN, request.headers.get(CEREMONY_HEADER)
+            )
+        if challenge is None:
+            return rejected_response(LOGIN, "bad_challenge")
+        if not credential.response.user_handle:
+            return rejected_response(LOGIN, "unknown_device")
+        try:
+            with metrics.timer(LOGIN, "device_fetch"):
+                device = WebAuthDevice.objects.select_related("user").get(
+                    **login_lookup(credential)
+                )
+        except WebAuthDevice.DoesNotExist:
+            return rejected_response(LOGIN, "unknown_device")
+        if not device.user.is_active:
+            return rejected_response(LOGIN, "inactive")
+
+        try:
+            with metrics.timer(LOGIN, "verify"):
+                verification = run(
+                    verify_authentication,
+                    **authentication_arguments(
+                        credential, challenge, device, require_user_verification=True
+                    ),
+                )
+        except VerificationBusy:
+            return busy_response(LOGIN)
+        except SignCountConflict:
+            return conflict_response(device, LOGIN)
+        except InvalidAuthenticationResponse:
+            return rejected_response(LOGIN, "invalid")
+
+        with metrics.timer(LOGIN, "sign_count_write"):
+            advanced = WebAuthDevice.objects.advance_sign_count(
+                device.pk, verification.new_sign_count
+            )
+        if not advanced:
+            return conflict_response(device, LOGIN)
+        device.sign_count = verification.new_sign_count
+        device_usage.record([device.pk])
+
+        log_in(request, device)
+
+        metrics.increment(LOGIN, "success")
+        return HttpResponse()
+
+
+class AsyncLogin(View):
+    """``Login`` for ASGI deployments."""
+
+    async def get(self, request, *args, **kwargs):
+        await aget_user(request)
+        wait = await athrottle(request)
+        if wait is not None:
+            return throttled_response(LOGIN, wait)
+        with get_metrics().timer(LOGIN, "challenge_issue"):
+            store = get_challenge_store()
+            ceremony_id, challenge = await store.aissue(request, LOGIN)
+        return HttpResponse(
+            login_options(ceremony_id, challenge), content_type="application/json"
         )
 
+    async def post(self, request, *args, **kwargs):
+        try:
+            credential = authentication_credential(read_json(request))
+        except RequestTooLarge:
+            return too_large_response(LOGIN)
+        except MALFORMED:
+            return rejected_response(LOGIN, "invalid")
+        await aget_user(request)
+        wait = await athrottle(request, credential.raw_id)
+        if wait is not None:
+            return throttled_response(LOGIN, wait)
+
+        metrics = get_metrics()
+        with metrics.timer(LOGIN, "challenge_load"):
+            challenge = await get_challenge_store().aconsume(
+                request, LOGIN, request.headers.get(CEREMONY_HEADER)
+            )
+        if challenge is None:
+            return rejected_response(LOGIN, "bad_challenge")
+        if not credential.response.user_handle:
+            return rejected_response(LOGIN, "unknown_device")
+        try:
+            with metrics.timer(LOGIN, "device_fetch"):
+                device = await WebAuthDevice.objects.select_related("user").aget(
+                    **login_lookup(credential)
+                )
+        except WebAuthDevice.DoesNotExist:
+            return rejected_response(LOGIN, "unknown_device")
+        if not device.user.is_active:
+            return rejected_response(LOGIN, "inactive")
+
+        try:
+            with metrics.timer(LOGIN, "verify"):
+                verification = await arun(
+                    verify_authentication,
+                    **authentication_arguments(
+                        credential, challenge, device, require_user_verification=True
+                    ),
+                )
+        except VerificationBusy:
+            return busy_response(LOGIN)
+        except SignCountConflict:
+            return conflict_response(device, LOGIN)
+        except InvalidAuthenticationResponse:
+            return rejected_response(LOGIN, "invalid")
+
+        with metrics.timer(LOGIN, "sign_count_write"):
+            advanced = await WebAuthDevice.objects.aadvance_sign_count(
+                device.pk, verification.new_sign_count
+            )
+        if not advanced:
+            return conflict_response(device, LOGIN)
         device.sign_count = verification.new_sign_count
-        device.save()
+        device_usage.record([device.pk])
 
-        request.session["webauth_device_id"] = device.id
+        await sync_to_async(log_in)(request, device)
 
+        metrics.increment(LOGIN, "success")
         return HttpResponse()
+
+
+def get_batch_limit():
+    return getattr(settings, "WEBAUTH_BATCH_LIMIT", 16)
+
+
+class AssertionBatch:
+    """
+    The assertions posted to ``BatchVerification`` in one request, and what
+    became of each. The views do the I/O; this class keeps the bookkeeping.
+    """
+
+    def __init__(self, items):
+        if not isinstance(items, list) or not 0 < len(items) <= get_batch_limit():
+            raise ValueError("Expected a list of assertions")
+        self.ceremony_ids = []
+        self.credentials = []
+        self.outcomes = []
+        for item in items:
+            try:
+                ceremony_id = item.get("ceremony")
+                if not isinstance(ceremony_id, str):
+                    raise TypeError("Ceremony id must be a string")
+                credential = authentication_credential(item["credential"])
+            except MALFORMED:
+                ceremony_id, credential = None, None
+            self.ceremony_ids.append(ceremony_id)
+            self.credentials.append(credential)
+            self.outcomes.append(None if credential else "invalid")
+        self.devices = [None] * len(items)
+
+    def pending(self):
+        return [i for i, outcome in enumerate(self.outcomes) if outcome is None]
+
+    def devices_query(self, request):
+        """Matches the devices of every assertion still pending."""
+        return WebAuthDevice.objects.replica(request).filter(
+            credential_hash__in={
+                hash_credential_id(self.credentials[i].raw_id) for i in self.pending()
+            }
+        )
+
+    def verification_calls(self, challenges, devices):
+        """
+        Pairs each pending assertion with its challenge and device, and
+        returns the keyword arguments of the verifications to run.
+        """
+        by_credential = {bytes(device.credential_id): device for device in devices}
+        calls = []
+        for i in self.pending():
+            device = by_credential.get(self.credentials[i].raw_id)
+            if challenges[i] is None:
+                self.outcomes[i] = "bad_challenge"
+            elif device is None:
+                self.outcomes[i] = "unknown_device"
+            else:
+                self.devices[i] = device
+                calls.append(
+                    authentication_arguments(self.credentials[i], challenges[i], device)
+                )
+        return calls
+
+    def sign_counts(self, results):
+        """
+        Records the verification results; returns the sign count to store
+        for each device verified. Only one assertion per device can move its
+        counter: the one with the highest count. Any other from the same
+        device is a replay or comes from a clone, and is a conflict.
+        """
+        sign_counts = {}
+        applied = {}
+        for i, result in zip(self.pending(), results):
+            if isinstance(result, VerificationBusy):
+                self.outcomes[i] = "busy"
+            elif isinstance(result, SignCountConflict):
+                self.outcomes[i] = "conflict"
+            elif isinstance(result, Exception):
+                self.outcomes[i] = "invalid"
+            else:
+                pk = self.devices[i].pk
+                count = result.new_sign_count
+                if pk in applied and count <= sign_counts[pk]:
+                    self.outcomes[i] = "conflict"
+                    continue
+                if pk in applied:
+                    self.outcomes[applied[pk]] = "conflict"
+                applied[pk] = i
+                sign_counts[pk] = count
+                self.outcomes[i] = "success"
+        return sign_counts
+
+    def response(self, request, advanced):
+        metrics = get_metrics()
+        used = []
+        for i, outcome in enumerate(self.outcomes):
+            if outcome == "success" and self.devices[i].pk not in advanced:
+                self.outcomes[i] = outcome = "conflict"
+            if outcome == "conflict":
+                conflict_response(self.devices[i])
+            else:
+                metrics.increment(AUTHENTICATION, outcome)
+            if outcome == "success":
+                used.append(self.devices[i])
+        if used:
+            stamp_session(request, used[0])
+            device_usage.record([device.pk for device in used])
+        return json_response(
+            {
+                "results": [
+                    {"ceremony": ceremony_id, "outcome": outcome}
+                    for ceremony_id, outcome in zip(self.ceremony_ids, self.outcomes)
+                ]
+            }
+        )
+
+
+def batch_count(request):
+    """Number of challenges requested from ``BatchVerification.get``."""
+    try:
+        count = int(request.GET.get("count", 1))
+    except ValueError:
+        return None
+    return count if 0 < count <= get_batch_limit() else None
+
+
+def batch_options(issued, credentials) -> str:
+    return '{"ceremonies": [%s]}' % ", ".join(
+        verification_options(ceremony_id, challenge, credentials)
+        for ceremony_id, challenge in issued
+    )
+
+
+class BatchVerification(LoginRequiredMixin, View):
+    """
+    Verifies up to ``WEBAUTH_BATCH_LIMIT`` assertions in one round trip, for
+    automated clients holding many credentials. ``GET ?count=N`` issues N
+    challenges; the client then posts a JSON array of
+    ``{"ceremony": ..., "credential": ...}`` and gets the outcome of each.
+
+    The devices are fetched in one query, the assertions are verified
+    concurrently on the verification executor, and the sign counts are
+    written in one UPDATE.
+    """
+
+    def get(self, request, *args, **kwargs):
+        count = batch_count(request)
+        if count is None:
+            return HttpResponse(status=HTTPStatus.BAD_REQUEST)
+        wait = throttle(request, cost=count)
+        if wait is not None:
+            return throttled_response(AUTHENTICATION, wait)
+        with get_metrics().timer(AUTHENTICATION, "challenge_issue"):
+            store = get_challenge_store()
+            issued = store.issue_many(request, AUTHENTICATION, count)
+        credentials = allow_credentials(request.user.pk, request)
+        return HttpResponse(
+            batch_options(issued, credentials), content_type="application/json"
+        )
+
+    def post(self, request, *args, **kwargs):
+        try:
+            batch = AssertionBatch(read_json(request))
+        except RequestTooLarge:
+            return too_large_response(AUTHENTICATION)
+        except ValueError:
+            return HttpResponse(status=HTTPStatus.BAD_REQUEST)
+        wait = throttle(request, cost=len(batch.outcomes))
+        if wait is not None:
+            return throttled_response(AUTHENTICATION, wait)
+        for i in batch.pending():
+            if throttle_credential(batch.credentials[i].raw_id) is not None:
+                batch.outcomes[i] = "throttled"
+
+        metrics = get_metrics()
+        store = get_challenge_store()
+        with metrics.timer(AUTHENTICATION, "challenge_load"):
+            challenges = {
+                i: store.consume(request, AUTHENTICATION, batch.ceremony_ids[i])
+                for i in batch.pending()
+            }
+        with metrics.timer(AUTHENTICATION, "device_fetch"):
+            devices = list(batch.devices_query(request))
+        calls = batch.verification_calls(challenges, devices)
+        with metrics.timer(AUTHENTICATION, "verify"):
+            results = run_many(verify_authentication, calls)
+        sign_counts = batch.sign_counts(results)
+        with metrics.timer(AUTHENTICATION, "sign_count_write"):
+            advanced = WebAuthDevice.objects.advance_sign_counts(sign_counts)
+        return batch.response(request, advanced)
+
+
+class AsyncBatchVerification(AsyncLoginRequiredMixin, View):
+    """``BatchVerification`` for ASGI deployments."""
+
+    async def get(self, request, *args, **kwargs):
+        count = batch_count(request)
+        if count is None:
+            return HttpResponse(status=HTTPStatus.BAD_REQUEST)
+        wait = await athrottle(request, cost=count)
+        if wait is not None:
+            return throttled_response(AUTHENTICATION, wait)
+        with get_metrics().timer(AUTHENTICATION, "challenge_issue"):
+            store = get_challenge_store()
+            issued = await store.aissue_many(request, AUTHENTICATION, count)
+        credentials = await aallow_credentials(request.user.pk, request)
+        return HttpResponse(
+            batch_options(issued, credentials), content_type="application/json"
+        )
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            batch = AssertionBatch(read_json(request))
+        except RequestTooLarge:
+            return too_large_response(AUTHENTICATION)
+        except ValueError:
+            return HttpResponse(status=HTTPStatus.BAD_REQUEST)
+        wait = await athrottle(request, cost=len(batch.outcomes))
+        if wait is not None:
+            return throttled_response(AUTHENTICATION, wait)
+        for i in batch.pending():
+            if await athrottle_credential(batch.credentials[i].raw_id) is not None:
+                batch.outcomes[i] = "throttled"
+
+        metrics = get_metrics()
+        store = get_challenge_store()
+        with metrics.timer(AUTHENTICATION, "challenge_load"):
+            challenges = {
+                i: await store.aconsume(request, AUTHENTICATION, batch.ceremony_ids[i])
+                for i in batch.pending()
+            }
+        with metrics.timer(AUTHENTICATION, "device_fetch"):
+            devices = [device async for device in batch.devices_query(request)]
+        calls = batch.verification_calls(challenges, devices)
+        with metrics.timer(AUTHENTICATION, "verify"):
+            results = await arun_many(verify_authentication, calls)
+        sign_counts = batch.sign_counts(results)
+        with metrics.timer(AUTHENTICATION, "sign_count_write"):
+            advanced = await sync_to_async(
+                WebAuthDevice.objects.advance_sign_counts
+            )(sign_counts)
+        return batch.response(request, advanced)